@@ -1,5 +1,236 @@
 // DesignStudio - Mobile-First Design Collaboration Application
 
+const SVG_NS = 'http://www.w3.org/2000/svg';
+const SVG_TAGS = { rectangle: 'rect', circle: 'circle', line: 'line' };
+const HIT_TOLERANCE = 4; // canvas units around thin shapes
+const RENDER_OVERSCAN = 0.25; // fraction of the viewport rendered beyond each edge
+const LOD_PROXY_PIXELS = 3; // shapes smaller than this on screen render as a plain rect
+const NODE_POOL_LIMIT = 512; // recycled SVG nodes kept per tag
+const LAYER_ROW_HEIGHT = 40; // px per layer row, gap included (matches .layer-item)
+const LAYER_LIST_HEIGHT = 420; // px, fallback while the panel is not laid out
+const LAYER_OVERSCAN = 6; // rows rendered above and below the scrolled window
+const HISTORY_MAX_ENTRIES = 200; // undo entries kept per user
+const HISTORY_MAX_BYTES = 2 * 1024 * 1024; // approximate JSON size of one user's undo/redo ops
+const HISTORY_COALESCE_MS = 600; // repeated edits of one property fold into one entry within this window
+const EXPORT_QUALITY = { high: 0.92, medium: 0.8, low: 0.6 }; // encoder quality per export-quality option (QUALITY in export_engine.py)
+
+// Loose quadtree for hit testing and marquee selection (see spatial-index-spec.md;
+// spatial_index.py is the reference implementation)
+class SpatialIndex {
+    constructor(x = 0, y = 0, size = 1024, maxDepth = 10) {
+        this.world = { x, y, size };
+        this.maxDepth = maxDepth;
+        this.clear();
+    }
+
+    clear() {
+        this.root = this.createNode(this.world.x, this.world.y, this.world.size, 0);
+        this.overflow = new Map();
+        this.entries = new Map();
+    }
+
+    createNode(x, y, size, depth) {
+        return { x, y, size, depth, children: null, items: new Map() };
+    }
+
+    get size() {
+        return this.entries.size;
+    }
+
+    has(id) {
+        return this.entries.has(id);
+    }
+
+    targetNode(bounds) {
+        const [minX, minY, maxX, maxY] = bounds;
+        const cx = (minX + maxX) / 2;
+        const cy = (minY + maxY) / 2;
+        const extent = Math.max(maxX - minX, maxY - minY);
+        let node = this.root;
+        // Outside the root cell, or too big for the root's loose bounds
+        if (extent > node.size || !(cx >= node.x && cx < node.x + node.size && cy >= node.y && cy < node.y + node.size)) {
+            return null;
+        }
+        while (node.depth < this.maxDepth && extent <= node.size / 2) {
+            const half = node.size / 2;
+            if (!node.children) node.children = [null, null, null, null];
+            const i = (cx >= node.x + half ? 1 : 0) + (cy >= node.y + half ? 2 : 0);
+            if (!node.children[i]) {
+                node.children[i] = this.createNode(node.x + half * (i & 1), node.y + half * (i >> 1), half, node.depth + 1);
+            }
+            node = node.children[i];
+        }
+        return node;
+    }
+
+    insert(id, bounds, z = 0) {
+        if (this.entries.has(id)) this.remove(id);
+        const node = this.targetNode(bounds);
+        const entry = { bounds, z, node };
+        (node ? node.items : this.overflow).set(id, entry);
+        this.entries.set(id, entry);
+    }
+
+    update(id, bounds = null, z = null) {
+        const entry = this.entries.get(id);
+        if (!entry) return;
+        if (z !== null) entry.z = z;
+        if (bounds) {
+            const node = this.targetNode(bounds);
+            if (node !== entry.node) {
+                (entry.node ? entry.node.items : this.overflow).delete(id);
+                (node ? node.items : this.overflow).set(id, entry);
+                entry.node = node;
+            }
+            entry.bounds = bounds;
+        }
+    }
+
+    z(id) {
+        return this.entries.get(id).z;
+    }
+
+    remove(id) {
+        const entry = this.entries.get(id);
+        if (!entry) return;
+        this.entries.delete(id);
+        (entry.node ? entry.node.items : this.overflow).delete(id);
+    }
+
+    // Calls visit(id, entry) for every entry in a node whose loose bounds overlap
+    visit(minX, minY, maxX, maxY, visit) {
+        this.overflow.forEach((entry, id) => visit(id, entry));
+        const stack = [this.root];
+        while (stack.length) {
+            const node = stack.pop();
+            const half = node.size / 2;
+            if (node.x - half > maxX || node.y - half > maxY ||
+                node.x + node.size + half < minX || node.y + node.size + half < minY) {
+                continue;
+            }
+            node.items.forEach((entry, id) => visit(id, entry));
+            if (node.children) {
+                for (const child of node.children) {
+                    if (child) stack.push(child);
+                }
+            }
+        }
+    }
+
+    // Ids whose bounds contain the point, topmost first
+    queryPoint(x, y) {
+        const found = [];
+        this.visit(x, y, x, y, (id, entry) => {
+            const b = entry.bounds;
+            if (b[0] <= x && x <= b[2] && b[1] <= y && y <= b[3]) found.push([entry.z, id]);
+        });
+        return found.sort((a, b) => b[0] - a[0]).map(([, id]) => id);
+    }
+
+    // Ids intersecting (or, with contain, fully inside) the rectangle, topmost first
+    queryRect(minX, minY, maxX, maxY, contain = false) {
+        const found = [];
+        this.visit(minX, minY, maxX, maxY, (id, entry) => {
+            const b = entry.bounds;
+            const hit = contain
+                ? b[0] >= minX && b[2] <= maxX && b[1] >= minY && b[3] <= maxY
+                : b[0] <= maxX && b[2] >= minX && b[1] <= maxY && b[3] >= minY;
+            if (hit) found.push([entry.z, id]);
+        });
+        return found.sort((a, b) => b[0] - a[0]).map(([, id]) => id);
+    }
+}
+
+// Folds two same-object ops of one type (update or transform) into one
+function mergeOperations(first, second) {
+    if (first.type === 'transform') {
+        const t1 = first.data.transform || {};
+        const t2 = second.data.transform || {};
+        return { ...second, data: { transform: { x: (t1.x || 0) + (t2.x || 0), y: (t1.y || 0) + (t2.y || 0) } } };
+    }
+    return { ...second, data: { ...first.data, ...second.data } };
+}
+
+// Per-user undo/redo log. Each entry holds the forward ops of one change and
+// their inverses (Operation shape from OperationalTransform.ts), so undo costs
+// the size of that change rather than a snapshot of the artboard.
+class UndoHistory {
+    constructor(maxEntries = HISTORY_MAX_ENTRIES, maxBytes = HISTORY_MAX_BYTES, coalesceMs = HISTORY_COALESCE_MS) {
+        this.maxEntries = maxEntries;
+        this.maxBytes = maxBytes;
+        this.coalesceMs = coalesceMs;
+        this.users = new Map(); // user id -> { undo: [], redo: [], bytes }
+    }
+
+    stacks(userId) {
+        let stacks = this.users.get(userId);
+        if (!stacks) {
+            stacks = { undo: [], redo: [], bytes: 0 };
+            this.users.set(userId, stacks);
+        }
+        return stacks;
+    }
+
+    entrySize(entry) {
+        return JSON.stringify(entry.forward).length + JSON.stringify(entry.inverse).length;
+    }
+
+    // Entries with the same coalesceKey recorded within coalesceMs of each
+    // other (a drag, a held arrow key, typing into one field) become one entry
+    record(userId, forward, inverse, coalesceKey = null, coalesceMs = this.coalesceMs, now = Date.now()) {
+        const stacks = this.stacks(userId);
+        for (const entry of stacks.redo) {
+            stacks.bytes -= entry.bytes;
+        }
+        stacks.redo = [];
+
+        const last = stacks.undo[stacks.undo.length - 1];
+        if (coalesceKey && last && last.coalesceKey === coalesceKey && now - last.time <= coalesceMs &&
+            last.forward.length === 1 && forward.length === 1) {
+            stacks.bytes -= last.bytes;
+            last.forward = [mergeOperations(last.forward[0], forward[0])];
+            // The oldest inverse values win: undo returns to the state before the first edit
+            last.inverse = [mergeOperations(inverse[0], last.inverse[0])];
+            last.time = now;
+            last.bytes = this.entrySize(last);
+            stacks.bytes += last.bytes;
+            return last;
+        }
+
+        const entry = { forward, inverse, coalesceKey, time: now, bytes: 0 };
+        entry.bytes = this.entrySize(entry);
+        stacks.undo.push(entry);
+        stacks.bytes += entry.bytes;
+        while (stacks.undo.length > this.maxEntries || (stacks.bytes > this.maxBytes && stacks.undo.length > 1)) {
+            stacks.bytes -= stacks.undo.shift().bytes;
+        }
+        return entry;
+    }
+
+    undo(userId) {
+        const stacks = this.stacks(userId);
+        const entry = stacks.undo.pop();
+        if (entry) {
+            entry.coalesceKey = null; // never fold new edits into an undone entry
+            stacks.redo.push(entry);
+        }
+        return entry || null;
+    }
+
+    redo(userId) {
+        const stacks = this.stacks(userId);
+        const entry = stacks.redo.pop();
+        if (entry) {
+            stacks.undo.push(entry);
+        }
+        return entry || null;
+    }
+
+    forget(userId) {
+        this.users.delete(userId);
+    }
+}
+
 class DesignStudioApp {
     constructor() {
         this.currentTool = 'select';
@@ -91,11 +322,36 @@ class DesignStudioApp {
         };
 
         this.objects = [];
+        this.objectsById = new Map();
+        this.spatialIndex = new SpatialIndex(-512, -512, 2048);
+        this.nextZ = 0;
+
+        // Viewport renderer state
+        this.viewport = { x: 0, y: 0, width: 375, height: 812 };
+        this.renderedNodes = new Map(); // object id -> { element, kind }
+        this.nodePool = { rect: [], circle: [], line: [] };
+        this.dirtyIds = new Set();
+        this.renderScheduled = false;
+
+        // Layer panel state
+        this.layersById = new Map(this.data.layers.map(layer => [layer.id, layer]));
+        this.layerRows = new Map(); // layer id -> row element currently in the list
+        this.layerRowPool = [];
+        this.layersRenderScheduled = false;
+
+        // Operation log for undo/redo; every local change is an Operation
+        this.userId = 'user-local';
+        this.clientId = `client-${Math.random().toString(36).slice(2, 10)}`;
+        this.operationSeq = 0;
+        this.history = new UndoHistory();
+        this.dragState = null;
+        this.dragSeq = 0;
         this.init();
     }
 
     init() {
         this.setupEventListeners();
+        this.setupLayerList();
         this.renderLayers();
         this.renderComments();
         this.renderColorPalette();
@@ -218,6 +474,25 @@ class DesignStudioApp {
                         }
                     }
                     break;
+                case 'y':
+                    if (e.ctrlKey || e.metaKey) {
+                        e.preventDefault();
+                        this.redo();
+                    }
+                    break;
+                case 'arrowleft':
+                case 'arrowright':
+                case 'arrowup':
+                case 'arrowdown':
+                    if (this.selectedObject) {
+                        e.preventDefault();
+                        const step = e.shiftKey ? 10 : 1;
+                        const dx = e.key === 'ArrowLeft' ? -step : e.key === 'ArrowRight' ? step : 0;
+                        const dy = e.key === 'ArrowUp' ? -step : e.key === 'ArrowDown' ? step : 0;
+                        this.moveObject(this.selectedObject, dx, dy, `nudge:${this.selectedObject.id}`);
+                        this.showObjectProperties(this.selectedObject);
+                    }
+                    break;
             }
         });
     }
@@ -240,8 +515,10 @@ class DesignStudioApp {
             if (isDragging && lastPoint) {
                 const deltaX = e.clientX - lastPoint.x;
                 const deltaY = e.clientY - lastPoint.y;
-                canvasWrapper.scrollLeft -= deltaX;
-                canvasWrapper.scrollTop -= deltaY;
+                const rect = document.getElementById('main-canvas').getBoundingClientRect();
+                const unitsPerPixel = this.viewport.width / rect.width;
+                this.setViewport(this.viewport.x - deltaX * unitsPerPixel, this.viewport.y - deltaY * unitsPerPixel,
+                                 this.viewport.width, this.viewport.height);
                 lastPoint = { x: e.clientX, y: e.clientY };
             }
         });
@@ -315,7 +592,13 @@ class DesignStudioApp {
 
     // Canvas drawing events
     onCanvasMouseDown(e) {
-        if (this.currentTool === 'select') return;
+        if (this.currentTool === 'select') {
+            // Start dragging the object under the pointer
+            const point = this.getCanvasPoint(e);
+            const obj = this.getObjectAtPoint(point);
+            this.dragState = obj ? { id: obj.id, last: point, key: `drag:${obj.id}:${++this.dragSeq}` } : null;
+            return;
+        }
         
         const point = this.getCanvasPoint(e);
         this.isDrawing = true;
@@ -323,6 +606,17 @@ class DesignStudioApp {
     }
 
     onCanvasMouseMove(e) {
+        if (this.dragState) {
+            const point = this.getCanvasPoint(e);
+            const obj = this.objectsById.get(this.dragState.id);
+            if (obj) {
+                // One undo entry per drag, however long it pauses
+                this.moveObject(obj, point.x - this.dragState.last.x, point.y - this.dragState.last.y,
+                                this.dragState.key, Infinity);
+            }
+            this.dragState.last = point;
+            return;
+        }
         if (!this.isDrawing) return;
         
         const point = this.getCanvasPoint(e);
@@ -330,6 +624,13 @@ class DesignStudioApp {
     }
 
     onCanvasMouseUp(e) {
+        if (this.dragState) {
+            this.dragState = null;
+            if (this.selectedObject) {
+                this.showObjectProperties(this.selectedObject);
+            }
+            return;
+        }
         if (!this.isDrawing) return;
         
         const point = this.getCanvasPoint(e);
@@ -360,7 +661,7 @@ class DesignStudioApp {
 
     onCanvasTouchMove(e) {
         e.preventDefault();
-        if (e.touches.length === 1 && this.isDrawing) {
+        if (e.touches.length === 1 && (this.isDrawing || this.dragState)) {
             const touch = e.touches[0];
             const mouseEvent = new MouseEvent('mousemove', {
                 clientX: touch.clientX,
@@ -372,7 +673,7 @@ class DesignStudioApp {
 
     onCanvasTouchEnd(e) {
         e.preventDefault();
-        if (this.isDrawing) {
+        if (this.isDrawing || this.dragState) {
             this.onCanvasMouseUp(e);
         }
     }
@@ -380,12 +681,12 @@ class DesignStudioApp {
     getCanvasPoint(e) {
         const canvas = document.getElementById('main-canvas');
         const rect = canvas.getBoundingClientRect();
-        const scaleX = 375 / rect.width;
-        const scaleY = 812 / rect.height;
+        const scaleX = this.viewport.width / rect.width;
+        const scaleY = this.viewport.height / rect.height;
         
         return {
-            x: (e.clientX - rect.left) * scaleX,
-            y: (e.clientY - rect.top) * scaleY
+            x: this.viewport.x + (e.clientX - rect.left) * scaleX,
+            y: this.viewport.y + (e.clientY - rect.top) * scaleY
         };
     }
 
@@ -484,20 +785,23 @@ class DesignStudioApp {
             }
 
             if (shouldAdd) {
-                // Add to objects array
-                this.objects.push({ ...this.drawingPath });
-                
-                // Add to layers
-                this.data.layers.push({
-                    id: this.drawingPath.id,
-                    name: `${this.drawingPath.type} ${this.objects.length}`,
-                    type: this.drawingPath.type,
-                    visible: true,
-                    locked: false,
-                    properties: { ...this.drawingPath }
-                });
+                // Add to objects and layers as an undoable create
+                const data = {
+                    ...this.drawingPath,
+                    name: `${this.drawingPath.type} ${this.objects.length + 1}`,
+                    zIndex: this.nextZ
+                };
+                this.commitOperation(
+                    this.createOperation('create', data.id, data),
+                    this.createOperation('delete', data.id, {})
+                );
+
+                // The preview element becomes the object's rendered node
+                const element = document.getElementById(data.id);
+                if (element) {
+                    this.renderedNodes.set(data.id, { element, kind: data.type });
+                }
 
-                this.renderLayers();
                 this.selectTool('select');
                 this.showNotification(`${this.drawingPath.type} created!`, 'success');
             } else {
@@ -513,31 +817,13 @@ class DesignStudioApp {
     }
 
     createSVGElement(obj) {
-        const canvas = document.getElementById('main-canvas');
-        let element;
-
-        switch(obj.type) {
-            case 'rectangle':
-                element = document.createElementNS('http://www.w3.org/2000/svg', 'rect');
-                element.setAttribute('id', obj.id);
-                element.setAttribute('class', 'canvas-object');
-                break;
-            case 'circle':
-                element = document.createElementNS('http://www.w3.org/2000/svg', 'circle');
-                element.setAttribute('id', obj.id);
-                element.setAttribute('class', 'canvas-object');
-                break;
-            case 'line':
-                element = document.createElementNS('http://www.w3.org/2000/svg', 'line');
-                element.setAttribute('id', obj.id);
-                element.setAttribute('class', 'canvas-object');
-                break;
-        }
+        const tag = SVG_TAGS[obj.type];
+        if (!tag) return;
 
-        if (element) {
-            canvas.appendChild(element);
-            this.updateSVGElement(obj);
-        }
+        const element = this.acquireNode(tag);
+        element.setAttribute('id', obj.id);
+        document.getElementById('objects-layer').appendChild(element);
+        this.updateSVGElement(obj);
     }
 
     updateSVGElement(obj) {
@@ -573,25 +859,179 @@ class DesignStudioApp {
         }
     }
 
+    // Viewport rendering
+    setViewport(x, y, width, height) {
+        this.viewport = { x, y, width, height };
+        document.getElementById('main-canvas').setAttribute('viewBox', `${x} ${y} ${width} ${height}`);
+
+        const grid = document.getElementById('canvas-grid');
+        if (grid) {
+            grid.setAttribute('x', x);
+            grid.setAttribute('y', y);
+            grid.setAttribute('width', width);
+            grid.setAttribute('height', height);
+        }
+        this.scheduleRender();
+    }
+
+    markDirty(obj) {
+        this.dirtyIds.add(obj.id);
+        this.scheduleRender();
+    }
+
+    scheduleRender() {
+        if (this.renderScheduled) return;
+        this.renderScheduled = true;
+        requestAnimationFrame(() => {
+            this.renderScheduled = false;
+            this.renderViewport();
+        });
+    }
+
+    renderViewport() {
+        // Draws the objects intersecting the viewport (plus overscan) in z
+        // order, recycling SVG nodes; shapes only a few pixels wide on screen
+        // are drawn as a plain rect
+        const canvas = document.getElementById('main-canvas');
+        const layer = document.getElementById('objects-layer');
+        const vb = this.viewport;
+        const mx = vb.width * RENDER_OVERSCAN;
+        const my = vb.height * RENDER_OVERSCAN;
+        const ids = this.spatialIndex.queryRect(vb.x - mx, vb.y - my, vb.x + vb.width + mx, vb.y + vb.height + my).reverse();
+        const pixelsPerUnit = canvas.getBoundingClientRect().width / vb.width || 1;
+
+        const visible = new Set();
+        let previous = null;
+        for (const id of ids) {
+            const obj = this.objectsById.get(id);
+            if (!obj || obj.visible === false || !SVG_TAGS[obj.type]) continue;
+
+            const bounds = this.getObjectBounds(obj, 0);
+            const proxy = Math.max(bounds[2] - bounds[0], bounds[3] - bounds[1]) * pixelsPerUnit < LOD_PROXY_PIXELS;
+            const kind = proxy ? 'proxy' : obj.type;
+            let node = this.renderedNodes.get(id);
+            if (node && node.kind !== kind) {
+                this.releaseNode(id);
+                node = null;
+            }
+            if (!node) {
+                node = { element: this.acquireNode(proxy ? 'rect' : SVG_TAGS[obj.type]), kind };
+                node.element.setAttribute('id', id);
+                this.renderedNodes.set(id, node);
+                this.dirtyIds.add(id);
+            }
+
+            // Keep DOM order equal to paint order with as few moves as possible
+            const expected = previous ? previous.nextSibling : layer.firstChild;
+            if (node.element !== expected) {
+                layer.insertBefore(node.element, expected);
+            }
+            previous = node.element;
+            visible.add(id);
+
+            if (this.dirtyIds.has(id)) {
+                if (proxy) {
+                    this.updateProxyElement(node.element, obj, bounds);
+                } else {
+                    this.updateSVGElement(obj);
+                }
+            }
+        }
+
+        for (const id of [...this.renderedNodes.keys()]) {
+            if (!visible.has(id)) {
+                this.releaseNode(id);
+            }
+        }
+        this.dirtyIds.clear();
+    }
+
+    updateProxyElement(element, obj, bounds) {
+        const color = obj.fill && obj.fill !== 'none' ? obj.fill : (obj.stroke || '#999');
+        element.setAttribute('x', bounds[0]);
+        element.setAttribute('y', bounds[1]);
+        element.setAttribute('width', Math.max(bounds[2] - bounds[0], 0.5));
+        element.setAttribute('height', Math.max(bounds[3] - bounds[1], 0.5));
+        element.setAttribute('fill', color);
+        element.setAttribute('stroke', 'none');
+    }
+
+    acquireNode(tag) {
+        const element = this.nodePool[tag].pop() || document.createElementNS(SVG_NS, tag);
+        element.setAttribute('class', 'canvas-object');
+        return element;
+    }
+
+    releaseNode(id) {
+        const node = this.renderedNodes.get(id);
+        if (node) {
+            this.renderedNodes.delete(id);
+        }
+        const element = node ? node.element : document.getElementById(id);
+        if (!element) return;
+
+        element.remove();
+        element.removeAttribute('id');
+        const pool = this.nodePool[element.localName];
+        if (pool && pool.length < NODE_POOL_LIMIT) {
+            pool.push(element);
+        }
+    }
+
     getObjectAtPoint(point) {
-        // Simple hit testing - in a real app this would be more sophisticated
-        for (let obj of this.objects) {
-            if (this.isPointInObject(point, obj)) {
+        // Topmost object under the point: the index narrows by bounds, then
+        // the exact shape test decides
+        for (const id of this.spatialIndex.queryPoint(point.x, point.y)) {
+            const obj = this.objectsById.get(id);
+            if (obj && obj.visible !== false && this.isPointInObject(point, obj)) {
                 return obj;
             }
         }
         return null;
     }
 
+    getObjectsInRect(rect, contain = false) {
+        // Marquee selection, topmost first
+        const ids = this.spatialIndex.queryRect(rect.x, rect.y, rect.x + rect.width, rect.y + rect.height, contain);
+        return ids.map(id => this.objectsById.get(id)).filter(obj => obj && obj.visible !== false);
+    }
+
+    getObjectBounds(obj, tolerance = HIT_TOLERANCE) {
+        // [minX, minY, maxX, maxY] including half the stroke and the hit tolerance
+        const pad = (obj.strokeWidth || 0) / 2 + tolerance;
+        switch(obj.type) {
+            case 'circle':
+                return [obj.cx - obj.r - pad, obj.cy - obj.r - pad, obj.cx + obj.r + pad, obj.cy + obj.r + pad];
+            case 'line':
+                return [Math.min(obj.x1, obj.x2) - pad, Math.min(obj.y1, obj.y2) - pad,
+                        Math.max(obj.x1, obj.x2) + pad, Math.max(obj.y1, obj.y2) + pad];
+            default:
+                return [obj.x - pad, obj.y - pad, obj.x + (obj.width || 0) + pad, obj.y + (obj.height || 0) + pad];
+        }
+    }
+
     isPointInObject(point, obj) {
+        const pad = (obj.strokeWidth || 0) / 2;
         switch(obj.type) {
             case 'rectangle':
-                return point.x >= obj.x && point.x <= obj.x + obj.width &&
-                       point.y >= obj.y && point.y <= obj.y + obj.height;
-            case 'circle':
+                return point.x >= obj.x - pad && point.x <= obj.x + obj.width + pad &&
+                       point.y >= obj.y - pad && point.y <= obj.y + obj.height + pad;
+            case 'circle': {
                 const dx = point.x - obj.cx;
                 const dy = point.y - obj.cy;
-                return Math.sqrt(dx * dx + dy * dy) <= obj.r;
+                return Math.sqrt(dx * dx + dy * dy) <= obj.r + pad;
+            }
+            case 'line': {
+                // Distance from the point to the segment
+                const dx = obj.x2 - obj.x1;
+                const dy = obj.y2 - obj.y1;
+                const lengthSq = dx * dx + dy * dy;
+                const t = lengthSq === 0 ? 0 :
+                    Math.max(0, Math.min(1, ((point.x - obj.x1) * dx + (point.y - obj.y1) * dy) / lengthSq));
+                const ex = point.x - (obj.x1 + t * dx);
+                const ey = point.y - (obj.y1 + t * dy);
+                return Math.sqrt(ex * ex + ey * ey) <= pad + HIT_TOLERANCE;
+            }
             default:
                 return false;
         }
@@ -601,15 +1041,9 @@ class DesignStudioApp {
         this.selectedObject = obj;
         
         // Update layer selection
-        document.querySelectorAll('.layer-item').forEach(item => {
-            item.classList.remove('selected');
-        });
+        this.renderLayers();
         
         if (obj) {
-            const layerElement = document.querySelector(`[data-layer-id="${obj.id}"]`);
-            if (layerElement) {
-                layerElement.classList.add('selected');
-            }
             this.showObjectProperties(obj);
             this.showMobilePanel('properties'); // Auto-switch to properties on mobile
         } else {
@@ -620,20 +1054,167 @@ class DesignStudioApp {
     deleteSelectedObject() {
         if (!this.selectedObject) return;
         
-        // Remove from DOM
-        const element = document.getElementById(this.selectedObject.id);
-        if (element) {
-            element.remove();
+        const id = this.selectedObject.id;
+        this.commitOperation(
+            this.createOperation('delete', id, {}),
+            this.createOperation('create', id, this.objectSnapshot(id))
+        );
+        this.showNotification('Object deleted', 'info');
+    }
+
+    // Objects and operations
+    addObject(obj, layer, z = this.nextZ) {
+        // Inserts at its z position, so an undone delete restacks where it was
+        this.nextZ = Math.max(this.nextZ, z + 1);
+        let lo = 0;
+        let hi = this.objects.length;
+        while (lo < hi) {
+            const mid = (lo + hi) >> 1;
+            if (this.spatialIndex.z(this.objects[mid].id) < z) lo = mid + 1; else hi = mid;
         }
-        
-        // Remove from arrays
-        this.objects = this.objects.filter(obj => obj.id !== this.selectedObject.id);
-        this.data.layers = this.data.layers.filter(layer => layer.id !== this.selectedObject.id);
-        
-        this.selectedObject = null;
+        // Layers without an object (the background) sit below all object layers
+        const layerIndex = lo + this.data.layers.length - this.objects.length;
+        this.objects.splice(lo, 0, obj);
+        this.data.layers.splice(layerIndex, 0, layer);
+        this.objectsById.set(obj.id, obj);
+        this.layersById.set(layer.id, layer);
+        this.spatialIndex.insert(obj.id, this.getObjectBounds(obj), z);
+        this.markDirty(obj);
         this.renderLayers();
-        this.showNoSelection();
-        this.showNotification('Object deleted', 'info');
+    }
+
+    removeObject(id) {
+        const obj = this.objectsById.get(id);
+        if (!obj) return;
+
+        this.releaseNode(id);
+        this.spatialIndex.remove(id);
+        this.objectsById.delete(id);
+        this.objects.splice(this.objects.indexOf(obj), 1);
+        const layer = this.layersById.get(id);
+        if (layer) {
+            this.data.layers.splice(this.data.layers.indexOf(layer), 1);
+            this.layersById.delete(id);
+        }
+        if (this.selectedObject === obj) {
+            this.selectedObject = null;
+            this.showNoSelection();
+        }
+        this.renderLayers();
+    }
+
+    objectSnapshot(id) {
+        // Data of a create op that restores the object, its layer and stacking
+        const obj = this.objectsById.get(id);
+        const layer = this.layersById.get(id);
+        return {
+            ...obj,
+            name: layer ? layer.name : id,
+            locked: layer ? layer.locked : false,
+            zIndex: this.spatialIndex.z(id)
+        };
+    }
+
+    translateObject(obj, dx, dy) {
+        switch(obj.type) {
+            case 'circle':
+                obj.cx += dx;
+                obj.cy += dy;
+                break;
+            case 'line':
+                obj.x1 += dx;
+                obj.y1 += dy;
+                obj.x2 += dx;
+                obj.y2 += dy;
+                break;
+            default:
+                obj.x += dx;
+                obj.y += dy;
+        }
+    }
+
+    moveObject(obj, dx, dy, coalesceKey, coalesceMs) {
+        if (!dx && !dy) return;
+        this.commitOperation(
+            this.createOperation('transform', obj.id, { transform: { x: dx, y: dy } }),
+            this.createOperation('transform', obj.id, { transform: { x: -dx, y: -dy } }),
+            coalesceKey,
+            coalesceMs
+        );
+    }
+
+    createOperation(type, objectId, data) {
+        return {
+            id: `${this.clientId}-${++this.operationSeq}`,
+            type,
+            objectId,
+            data,
+            userId: this.userId,
+            timestamp: Date.now(),
+            clientId: this.clientId
+        };
+    }
+
+    commitOperation(op, inverse, coalesceKey = null, coalesceMs = undefined) {
+        this.applyOperation(op);
+        this.history.record(this.userId, [op], [inverse], coalesceKey, coalesceMs);
+    }
+
+    applyOperation(op, expected = null) {
+        // With `expected`, an update only touches properties that still hold
+        // the expected value, so undoing never reverts a collaborator's later edit
+        const obj = this.objectsById.get(op.objectId);
+        switch(op.type) {
+            case 'create': {
+                if (obj) return false;
+                const { name, locked, zIndex, ...props } = op.data;
+                const created = { ...props, id: op.objectId };
+                this.addObject(created, {
+                    id: op.objectId,
+                    name,
+                    type: created.type,
+                    visible: created.visible !== false,
+                    locked: !!locked,
+                    properties: { ...props }
+                }, zIndex);
+                return true;
+            }
+            case 'delete':
+                if (!obj) return false;
+                this.removeObject(op.objectId);
+                return true;
+            case 'update': {
+                if (!obj) return false;
+                const layer = this.layersById.get(op.objectId);
+                let changed = false;
+                for (const [key, value] of Object.entries(op.data)) {
+                    if (expected && obj[key] !== expected[key]) continue;
+                    obj[key] = value;
+                    if (layer) layer.properties[key] = value;
+                    changed = true;
+                }
+                if (changed) {
+                    this.spatialIndex.update(obj.id, this.getObjectBounds(obj));
+                    this.markDirty(obj);
+                }
+                return changed;
+            }
+            case 'transform': {
+                if (!obj) return false;
+                const transform = op.data.transform || {};
+                this.translateObject(obj, transform.x || 0, transform.y || 0);
+                this.spatialIndex.update(obj.id, this.getObjectBounds(obj));
+                this.markDirty(obj);
+                return true;
+            }
+            default:
+                return false;
+        }
+    }
+
+    reissueOperation(op) {
+        // Undo/redo produce new operations rather than replaying old ids
+        return { ...op, id: `${this.clientId}-${++this.operationSeq}`, timestamp: Date.now() };
     }
 
     // UI Management
@@ -673,31 +1254,104 @@ class DesignStudioApp {
     }
 
     // Layer management
-    renderLayers() {
+    setupLayerList() {
         const layersList = document.getElementById('layers-list');
-        layersList.innerHTML = '';
-        
-        [...this.data.layers].reverse().forEach(layer => {
-            const layerElement = document.createElement('div');
-            layerElement.className = 'layer-item';
-            layerElement.dataset.layerId = layer.id;
-            layerElement.innerHTML = `
-                <button class="layer-visibility" onclick="app.toggleLayerVisibility('${layer.id}')">
-                    ${layer.visible ? '👁' : '🙈'}
-                </button>
-                <div class="layer-icon" style="background-color: ${this.getLayerColor(layer.type)}">
-                    ${this.getLayerIcon(layer.type)}
-                </div>
-                <span class="layer-name">${layer.name}</span>
-            `;
-            
-            layerElement.addEventListener('click', () => {
-                const obj = this.objects.find(o => o.id === layer.id);
-                this.selectObject(obj);
-            });
-            
-            layersList.appendChild(layerElement);
+        this.layersSpacer = document.createElement('div');
+        this.layersSpacer.className = 'layers-spacer';
+        layersList.appendChild(this.layersSpacer);
+
+        // One delegated listener instead of one per row
+        layersList.addEventListener('click', (e) => {
+            const row = e.target.closest('.layer-item');
+            if (!row) return;
+            const layerId = row.dataset.layerId;
+            if (e.target.closest('.layer-visibility')) {
+                this.toggleLayerVisibility(layerId);
+            } else {
+                this.selectObject(this.objectsById.get(layerId) || null);
+            }
         });
+        layersList.addEventListener('scroll', () => this.renderLayers(), { passive: true });
+    }
+
+    renderLayers() {
+        // Coalesced to one patch per frame
+        if (this.layersRenderScheduled) return;
+        this.layersRenderScheduled = true;
+        requestAnimationFrame(() => {
+            this.layersRenderScheduled = false;
+            this.patchLayerRows();
+        });
+    }
+
+    patchLayerRows() {
+        // Keyed, virtualized list: only rows in (or near) the scrolled window
+        // exist, and a row's content is rewritten only when its layer changed
+        const layersList = document.getElementById('layers-list');
+        const layers = this.data.layers;
+        const count = layers.length;
+        this.layersSpacer.style.height = `${count * LAYER_ROW_HEIGHT}px`;
+
+        const viewHeight = layersList.clientHeight || LAYER_LIST_HEIGHT;
+        const first = Math.max(0, Math.floor(layersList.scrollTop / LAYER_ROW_HEIGHT) - LAYER_OVERSCAN);
+        const last = Math.min(count, Math.ceil((layersList.scrollTop + viewHeight) / LAYER_ROW_HEIGHT) + LAYER_OVERSCAN);
+
+        // Newest layer on top
+        const wanted = new Map();
+        for (let index = first; index < last; index++) {
+            wanted.set(layers[count - 1 - index].id, index);
+        }
+
+        for (const [id, row] of this.layerRows) {
+            if (!wanted.has(id)) {
+                row.remove();
+                this.layerRows.delete(id);
+                this.layerRowPool.push(row);
+            }
+        }
+
+        const selectedId = this.selectedObject ? this.selectedObject.id : null;
+        for (const [id, index] of wanted) {
+            let row = this.layerRows.get(id);
+            if (!row) {
+                row = this.layerRowPool.pop() || this.createLayerRow();
+                row.layerKey = null;
+                this.layerRows.set(id, row);
+                this.layersSpacer.appendChild(row);
+            }
+            this.patchLayerRow(row, this.layersById.get(id), index, id === selectedId);
+        }
+    }
+
+    createLayerRow() {
+        const row = document.createElement('div');
+        row.className = 'layer-item';
+        row.innerHTML = `
+            <button class="layer-visibility"></button>
+            <div class="layer-icon"></div>
+            <span class="layer-name"></span>
+        `;
+        return row;
+    }
+
+    patchLayerRow(row, layer, index, selected) {
+        const top = `${index * LAYER_ROW_HEIGHT}px`;
+        if (row.style.top !== top) {
+            row.style.top = top;
+        }
+        if (row.classList.contains('selected') !== selected) {
+            row.classList.toggle('selected', selected);
+        }
+
+        const key = `${layer.id}|${layer.type}|${layer.visible}|${layer.name}`;
+        if (row.layerKey === key) return;
+        row.layerKey = key;
+        row.dataset.layerId = layer.id;
+        const [visibility, icon, name] = row.children;
+        visibility.textContent = layer.visible ? '👁' : '🙈';
+        icon.style.backgroundColor = this.getLayerColor(layer.type);
+        icon.textContent = this.getLayerIcon(layer.type);
+        name.textContent = layer.name;
     }
 
     getLayerIcon(type) {
@@ -723,12 +1377,13 @@ class DesignStudioApp {
     }
 
     toggleLayerVisibility(layerId) {
-        const layer = this.data.layers.find(l => l.id === layerId);
+        const layer = this.layersById.get(layerId);
         if (layer) {
             layer.visible = !layer.visible;
-            const element = document.getElementById(layerId);
-            if (element) {
-                element.style.display = layer.visible ? 'block' : 'none';
+            const obj = this.objectsById.get(layerId);
+            if (obj) {
+                obj.visible = layer.visible;
+                this.markDirty(obj);
             }
             this.renderLayers();
         }
@@ -790,17 +1445,13 @@ class DesignStudioApp {
         const numValue = parseFloat(value);
         const finalValue = isNaN(numValue) ? value : numValue;
         
-        // Update object
-        this.selectedObject[property] = finalValue;
-        
-        // Update in layers array
-        const layer = this.data.layers.find(l => l.id === this.selectedObject.id);
-        if (layer) {
-            layer.properties[property] = finalValue;
-        }
-        
-        // Update SVG element
-        this.updateSVGElement(this.selectedObject);
+        // Update object, layer, bounds and rendering as one undoable update
+        const id = this.selectedObject.id;
+        this.commitOperation(
+            this.createOperation('update', id, { [property]: finalValue }),
+            this.createOperation('update', id, { [property]: this.selectedObject[property] }),
+            `update:${id}:${property}`
+        );
     }
 
     // Comments
@@ -921,8 +1572,12 @@ class DesignStudioApp {
     }
 
     updateZoom() {
-        const canvas = document.getElementById('main-canvas');
-        canvas.style.transform = `scale(${this.zoomLevel})`;
+        // Zoom narrows the viewBox around the current center instead of
+        // scaling the whole SVG, so the renderer knows what is visible
+        const vb = this.viewport;
+        const width = 375 / this.zoomLevel;
+        const height = 812 / this.zoomLevel;
+        this.setViewport(vb.x + (vb.width - width) / 2, vb.y + (vb.height - height) / 2, width, height);
         
         // Update zoom display
         const zoomDisplay = document.querySelector('.zoom-level');
@@ -931,15 +1586,37 @@ class DesignStudioApp {
         }
     }
 
-    // History (simplified)
+    // History: per-user undo/redo of this client's own operations
     undo() {
-        this.showNotification('Undo action', 'info');
-        // In a real app, this would restore previous state
+        const entry = this.history.undo(this.userId);
+        if (!entry) {
+            this.showNotification('Nothing to undo', 'info');
+            return;
+        }
+        for (let i = entry.inverse.length - 1; i >= 0; i--) {
+            this.applyOperation(this.reissueOperation(entry.inverse[i]), entry.forward[i].data);
+        }
+        this.refreshSelection();
     }
 
     redo() {
-        this.showNotification('Redo action', 'info');
-        // In a real app, this would restore next state
+        const entry = this.history.redo(this.userId);
+        if (!entry) {
+            this.showNotification('Nothing to redo', 'info');
+            return;
+        }
+        entry.forward.forEach((op, i) => {
+            this.applyOperation(this.reissueOperation(op), entry.inverse[i].data);
+        });
+        this.refreshSelection();
+    }
+
+    refreshSelection() {
+        if (this.selectedObject && this.objectsById.has(this.selectedObject.id)) {
+            this.showObjectProperties(this.selectedObject);
+        } else {
+            this.selectObject(null);
+        }
     }
 
     // Modal management
@@ -966,30 +1643,123 @@ class DesignStudioApp {
         }
     }
 
-    // Export functionality
-    exportDesign() {
+    // Export functionality. Single exports run here; batch exports go to the
+    // server's export engine (export_engine.py) so they do not tie up the device.
+    async exportDesign() {
         const format = document.getElementById('export-format').value;
-        const scale = document.getElementById('export-scale').value;
-        const quality = document.getElementById('export-quality').value;
-        
-        // Simulate export
-        const canvas = document.getElementById('main-canvas');
-        const svgData = new XMLSerializer().serializeToString(canvas);
-        const svgBlob = new Blob([svgData], { type: 'image/svg+xml;charset=utf-8' });
-        const url = URL.createObjectURL(svgBlob);
-        
+        const scale = Number(document.getElementById('export-scale').value) || 1;
+        const quality = EXPORT_QUALITY[document.getElementById('export-quality').value] || EXPORT_QUALITY.high;
+        const artboard = this.data.projects[0].artboards[0];
+        const width = Math.ceil(artboard.width * scale);
+        const height = Math.ceil(artboard.height * scale);
+        const svg = this.buildExportSVG(artboard, scale);
+
+        try {
+            let blob;
+            if (format === 'svg') {
+                blob = new Blob([svg], { type: 'image/svg+xml;charset=utf-8' });
+            } else if (format === 'pdf') {
+                const jpeg = await this.rasterizeExport(svg, width, height, 'image/jpeg', quality);
+                blob = this.buildPDF(new Uint8Array(await jpeg.arrayBuffer()), width, height,
+                                     artboard.width * 0.75, artboard.height * 0.75);
+            } else {
+                blob = await this.rasterizeExport(svg, width, height,
+                                                  format === 'jpg' ? 'image/jpeg' : 'image/png', quality);
+            }
+            this.downloadBlob(blob, `${artboard.name}@${scale}x.${format}`);
+        } catch (error) {
+            this.showNotification(`Export failed: ${error.message}`, 'error');
+            return;
+        }
+
+        this.closeModal('export-modal');
+        this.showNotification('Design exported successfully!', 'success');
+    }
+
+    buildExportSVG(artboard, scale) {
+        // Standalone SVG of every object on the artboard, built from the object
+        // data rather than the live DOM, which is culled to the viewport and
+        // styled with CSS variables an exported file cannot resolve
+        const escape = value => String(value).replace(/&/g, '&amp;').replace(/"/g, '&quot;').replace(/</g, '&lt;');
+        const parts = [
+            `<svg xmlns="${SVG_NS}" width="${artboard.width * scale}" height="${artboard.height * scale}" ` +
+            `viewBox="0 0 ${artboard.width} ${artboard.height}">`,
+            `<rect x="0" y="0" width="${artboard.width}" height="${artboard.height}" fill="#FFFFFF"/>`
+        ];
+        for (const obj of this.objects) {
+            if (obj.visible === false || !SVG_TAGS[obj.type]) continue;
+            const names = obj.type === 'rectangle' ? ['x', 'y', 'width', 'height'] :
+                          obj.type === 'circle' ? ['cx', 'cy', 'r'] : ['x1', 'y1', 'x2', 'y2'];
+            const attrs = names.map(name => `${name}="${escape(obj[name])}"`);
+            if (obj.type !== 'line') {
+                attrs.push(`fill="${escape(obj.fill || 'transparent')}"`);
+            }
+            attrs.push(`stroke="${escape(obj.stroke || 'black')}"`, `stroke-width="${escape(obj.strokeWidth || 1)}"`);
+            parts.push(`<${SVG_TAGS[obj.type]} ${attrs.join(' ')}/>`);
+        }
+        parts.push('</svg>');
+        return parts.join('\n');
+    }
+
+    rasterizeExport(svg, width, height, type, quality) {
+        // Draws the SVG onto a canvas of the exported pixel size and encodes it
+        return new Promise((resolve, reject) => {
+            const url = URL.createObjectURL(new Blob([svg], { type: 'image/svg+xml;charset=utf-8' }));
+            const image = new Image();
+            image.onload = () => {
+                URL.revokeObjectURL(url);
+                const canvas = document.createElement('canvas');
+                canvas.width = width;
+                canvas.height = height;
+                canvas.getContext('2d').drawImage(image, 0, 0, width, height);
+                canvas.toBlob(blob => blob ? resolve(blob) : reject(new Error('the image is too large')), type, quality);
+            };
+            image.onerror = () => {
+                URL.revokeObjectURL(url);
+                reject(new Error('the design could not be rendered'));
+            };
+            image.src = url;
+        });
+    }
+
+    buildPDF(jpeg, width, height, pageWidth, pageHeight) {
+        // One page of pageWidth x pageHeight points showing the JPEG, the
+        // same layout the server writes with a Flate image
+        const content = `q ${pageWidth.toFixed(2)} 0 0 ${pageHeight.toFixed(2)} 0 0 cm /Im0 Do Q`;
+        const objects = [
+            '<< /Type /Catalog /Pages 2 0 R >>',
+            '<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+            `<< /Type /Page /Parent 2 0 R /MediaBox [0 0 ${pageWidth.toFixed(2)} ${pageHeight.toFixed(2)}] ` +
+            '/Resources << /XObject << /Im0 5 0 R >> >> /Contents 4 0 R >>',
+            `<< /Length ${content.length} >>\nstream\n${content}\nendstream`,
+            [`<< /Type /XObject /Subtype /Image /Width ${width} /Height ${height} /ColorSpace /DeviceRGB ` +
+             `/BitsPerComponent 8 /Filter /DCTDecode /Length ${jpeg.length} >>\nstream\n`, jpeg, '\nendstream']
+        ];
+        const parts = ['%PDF-1.4\n'];
+        const offsets = [];
+        let offset = parts[0].length;
+        objects.forEach((body, i) => {
+            offsets.push(offset);
+            for (const part of [`${i + 1} 0 obj\n`, ...[].concat(body), '\nendobj\n']) {
+                parts.push(part);
+                offset += part.length;
+            }
+        });
+        parts.push(`xref\n0 ${objects.length + 1}\n0000000000 65535 f \n`,
+                   ...offsets.map(value => `${String(value).padStart(10, '0')} 00000 n \n`),
+                   `trailer\n<< /Size ${objects.length + 1} /Root 1 0 R >>\nstartxref\n${offset}\n%%EOF\n`);
+        return new Blob(parts, { type: 'application/pdf' });
+    }
+
+    downloadBlob(blob, filename) {
+        const url = URL.createObjectURL(blob);
         const link = document.createElement('a');
         link.href = url;
-        link.download = `design.${format}`;
+        link.download = filename;
         document.body.appendChild(link);
         link.click();
         document.body.removeChild(link);
         URL.revokeObjectURL(url);
-        
-        this.closeModal('export-modal');
-        
-        // Show success message
-        this.showNotification('Design exported successfully!', 'success');
     }
 
     showNotification(message, type = 'info') {
@@ -0,0 +1,207 @@
+# Lazy, path-indexed reader for generated scaffold artifacts
+#
+# Instead of json.load()-ing all of project_structure.json to read one file,
+# the artifact is memory-mapped and scanned once for the byte span of every
+# leaf path ("figma-clone/packages/mobile/src/services/VectorEngine.ts",
+# "kubernetes/namespace.yaml", ...). The spans are saved in a sidecar
+# <artifact>.idx and reused while the artifact's size and mtime match, so
+# later readers parse only the index and the entries they ask for. Binary
+# (.dsb) artifacts are indexed from their own key tables.
+import argparse
+import json
+import mmap
+import os
+import re
+
+import serializers
+from materializer import is_document_name
+
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+
+_WS = re.compile(rb"[ \t\n\r]*")
+_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"', re.S)
+_STRUCTURAL = re.compile(rb'["{}\[\]]')
+_SCALAR = re.compile(rb"[^,}\]\s]+")
+
+
+def _skip_ws(buf, pos):
+    return _WS.match(buf, pos).end()
+
+
+def _skip_value(buf, pos):
+    first = buf[pos:pos + 1]
+    if first == b'"':
+        return _STRING.match(buf, pos).end()
+    if first in (b"{", b"["):
+        depth = 0
+        while True:
+            m = _STRUCTURAL.search(buf, pos)
+            if m.group() == b'"':
+                pos = _STRING.match(buf, m.start()).end()
+                continue
+            depth += 1 if m.group() in (b"{", b"[") else -1
+            pos = m.end()
+            if depth == 0:
+                return pos
+    return _SCALAR.match(buf, pos).end()
+
+
+def _expect(buf, pos, char):
+    pos = _skip_ws(buf, pos)
+    if buf[pos:pos + 1] != char:
+        raise ValueError(f"malformed artifact: expected {char.decode()!r} at byte {pos}")
+    return pos + 1
+
+
+def _scan_object(buf, pos, prefix, spans):
+    pos = _expect(buf, pos, b"{")
+    pos = _skip_ws(buf, pos)
+    if buf[pos:pos + 1] == b"}":
+        return pos + 1
+    while True:
+        pos = _skip_ws(buf, pos)
+        m = _STRING.match(buf, pos)
+        if m is None:
+            raise ValueError(f"malformed artifact: expected a key at byte {pos}")
+        name = json.loads(m.group())
+        pos = _skip_ws(buf, _expect(buf, m.end(), b":"))
+        path = f"{prefix}/{name}" if prefix else name
+        if buf[pos:pos + 1] == b"{" and not is_document_name(name):
+            pos = _scan_object(buf, pos, path, spans)
+        else:
+            end = _skip_value(buf, pos)
+            spans[path] = (pos, end)
+            pos = end
+        pos = _skip_ws(buf, pos)
+        if buf[pos:pos + 1] == b"}":
+            return pos + 1
+        pos = _expect(buf, pos, b",")
+
+
+def build_index(buf):
+    # {leaf path: (start, end)} for a JSON artifact, without decoding values
+    spans = {}
+    _scan_object(buf, 0, "", spans)
+    return spans
+
+
+class ArtifactReader:
+    def __init__(self, path, index_path=None, rebuild=False):
+        self.path = path
+        self.index_path = index_path or path + INDEX_SUFFIX
+        self._rebuild = rebuild
+        self._spans = None
+        self._root = None
+        self._binary = None
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        head = self._map[:4]
+        if head.startswith(serializers.MAGIC):
+            self._binary = serializers.BinaryArtifact(self._map)
+        elif head.startswith(serializers.GZIP_MAGIC) or head.startswith(serializers.ZSTD_MAGIC):
+            self._map.close()
+            raise ValueError(f"{path} is compressed; read it with serializers.load()")
+
+    def close(self):
+        if self._binary is not None:
+            self._binary.close()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _source_stamp(self):
+        st = os.stat(self.path)
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def _load_index(self):
+        if self._rebuild:
+            return None
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if index.get("version") != INDEX_VERSION or index.get("source") != self._source_stamp():
+            return None
+        return {path: tuple(span) for path, span in index["entries"].items()}
+
+    def _save_index(self, spans):
+        index = {"version": INDEX_VERSION, "source": self._source_stamp(), "entries": spans}
+        tmp = self.index_path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(index, f, separators=(",", ":"))
+            os.replace(tmp, self.index_path)
+        except OSError:
+            pass  # read-only location: keep the in-memory index only
+
+    @property
+    def spans(self):
+        if self._spans is None:
+            if self._binary is not None:
+                # Binary artifacts carry their own offsets; no sidecar needed
+                self._spans = {path: (pos, None)
+                               for path, pos in self._binary.leaves(is_document_name)}
+            else:
+                self._spans = self._load_index()
+                if self._spans is None:
+                    self._spans = build_index(self._map)
+                    self._save_index(self._spans)
+        return self._spans
+
+    def paths(self):
+        return list(self.spans)
+
+    def _resolve(self, path):
+        path = path.strip("/")
+        if path in self.spans:
+            return path
+        # Like BinaryArtifact.lookup, the single "figma-clone" root may be omitted
+        if self._root is None:
+            roots = {p.split("/", 1)[0] for p in self.spans}
+            self._root = roots.pop() if len(roots) == 1 else ""
+        rooted = f"{self._root}/{path}"
+        if self._root and rooted in self.spans:
+            return rooted
+        raise KeyError(path)
+
+    def __contains__(self, path):
+        try:
+            self._resolve(path)
+        except KeyError:
+            return False
+        return True
+
+    def raw(self, path):
+        # JSON bytes of one entry, sliced straight from the map for JSON artifacts
+        start, end = self.spans[self._resolve(path)]
+        if end is None:
+            return json.dumps(self._binary.value_at(start), separators=(",", ":")).encode("utf-8")
+        return self._map[start:end]
+
+    def get(self, path):
+        start, end = self.spans[self._resolve(path)]
+        if end is None:
+            return self._binary.value_at(start)
+        return json.loads(self._map[start:end])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read single entries from a scaffold artifact")
+    parser.add_argument("artifact", help="project_structure.json, deployment_configs.dsb, ...")
+    parser.add_argument("paths", nargs="*", help="leaf paths to print")
+    parser.add_argument("--list", action="store_true", help="list every leaf path")
+    parser.add_argument("--rebuild", action="store_true", help="ignore an existing index")
+    args = parser.parse_args()
+
+    with ArtifactReader(args.artifact, rebuild=args.rebuild) as reader:
+        if args.list:
+            print("\n".join(reader.paths()))
+        for path in args.paths:
+            value = reader.get(path)
+            print(value if isinstance(value, str) else json.dumps(value, indent=2))
@@ -0,0 +1,205 @@
+# Cursor-move coalescing for cursor:move events
+#
+# handleCursorMove broadcasts every CursorMoveEvent and does a Redis setex per
+# move, so traffic grows with mouse events (users x 60 Hz x room size).
+# CursorCoalescer keeps only the latest position per user; a per-room tick
+# (30 Hz by default) sends one packed `cursor:frame` with the cursors that
+# changed since the previous frame, and tool/selection only when those
+# changed. Positions reach Redis at persist_interval (2 s) as one write per
+# moved user, so messages scale with rooms x tick rate. A user's key is
+# deleted on the tick after they leave, so other replicas stop showing them.
+#
+# Frame entries are [userId, x, y] or [userId, x, y, {"tool", "selection"}];
+# users that left are listed under "left". Clients ignore their own userId.
+#
+#   python cursor_coalescer.py    # 10 rooms x 20 users moving at 60 Hz
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+CURSOR_TTL = 30  # seconds, as in handleCursorMove
+
+
+def cursor_key(user_id, project_id):
+    return f"cursor:{user_id}:{project_id}"
+
+
+class _CursorRoom:
+    __slots__ = ("latest", "sent", "dirty", "unsaved", "left", "removed", "task", "idle_ticks")
+
+    def __init__(self):
+        self.latest = {}     # user -> cursor dict
+        self.sent = {}       # user -> (tool, selection) last broadcast
+        self.dirty = set()   # users moved since the last frame
+        self.unsaved = set() # users moved since the last Redis write
+        self.left = set()
+        self.removed = set() # users left whose Redis key is not deleted yet
+        self.task = None
+        self.idle_ticks = 0
+
+
+class CursorCoalescer:
+    def __init__(self, broadcast, redis=None, tick=1 / 30, persist_interval=2.0, idle_ticks=60):
+        # broadcast(project_id, event, payload) -> awaitable or None
+        # redis: asyncio client with setex/delete, or None
+        self.broadcast = broadcast
+        self.redis = redis
+        self.tick = tick
+        self.persist_interval = persist_interval
+        self.idle_ticks = idle_ticks
+        self.rooms = {}
+        self._last_persist = {}
+        self.metrics = {"moves": 0, "frames": 0, "cursors_sent": 0, "redis_writes": 0}
+
+    def move(self, project_id, user_id, x, y, tool=None, selection=None, artboard_id=None):
+        # Called from the cursor:move handler; never awaits
+        self.metrics["moves"] += 1
+        room = self.rooms.get(project_id)
+        if room is None:
+            room = self.rooms[project_id] = _CursorRoom()
+        room.latest[user_id] = {"x": x, "y": y, "tool": tool, "selection": selection,
+                                "artboardId": artboard_id, "timestamp": int(time.time() * 1000)}
+        room.dirty.add(user_id)
+        room.unsaved.add(user_id)
+        room.left.discard(user_id)
+        room.removed.discard(user_id)
+        self._schedule(project_id, room)
+
+    def leave(self, project_id, user_id):
+        room = self.rooms.get(project_id)
+        if room is None or user_id not in room.latest:
+            return
+        del room.latest[user_id]
+        room.sent.pop(user_id, None)
+        room.dirty.discard(user_id)
+        room.unsaved.discard(user_id)
+        room.left.add(user_id)
+        room.removed.add(user_id)
+        # An idle room has no tick running: start one to send the "left" entry
+        # and, once the room is empty, to drop it
+        self._schedule(project_id, room)
+
+    def _schedule(self, project_id, room):
+        if room.task is None:
+            room.task = asyncio.ensure_future(self._run(project_id, room))
+
+    def cursors(self, project_id):
+        # Latest known cursors of a room, e.g. for project:state on join
+        room = self.rooms.get(project_id)
+        return dict(room.latest) if room else {}
+
+    def frame(self, project_id):
+        # Builds (and marks as sent) the next frame payload, or None if nothing moved
+        room = self.rooms.get(project_id)
+        if room is None or not (room.dirty or room.left):
+            return None
+        entries = []
+        for user_id in room.dirty:
+            cursor = room.latest[user_id]
+            entry = [user_id, cursor["x"], cursor["y"]]
+            extras = (cursor["tool"], cursor["selection"], cursor["artboardId"])
+            if room.sent.get(user_id) != extras:
+                room.sent[user_id] = extras
+                entry.append({"tool": extras[0], "selection": extras[1], "artboardId": extras[2]})
+            entries.append(entry)
+        payload = {"t": int(time.time() * 1000), "cursors": entries}
+        if room.left:
+            payload["left"] = sorted(room.left)
+        room.dirty.clear()
+        room.left.clear()
+        return payload
+
+    async def _run(self, project_id, room):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        try:
+            while room.idle_ticks < self.idle_ticks:
+                next_tick += self.tick
+                await asyncio.sleep(max(0.0, next_tick - loop.time()))
+                payload = self.frame(project_id)
+                if payload is None:
+                    room.idle_ticks += 1
+                else:
+                    room.idle_ticks = 0
+                    self.metrics["frames"] += 1
+                    self.metrics["cursors_sent"] += len(payload["cursors"])
+                    result = self.broadcast(project_id, "cursor:frame", payload)
+                    if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+                        await result
+                if room.removed:
+                    await self._remove(project_id, room)
+                if loop.time() - self._last_persist.get(project_id, 0.0) >= self.persist_interval:
+                    self._last_persist[project_id] = loop.time()
+                    await self.persist(project_id)
+        except Exception:
+            log.exception("cursor tick failed for %s", project_id)
+        finally:
+            room.task = None
+            room.idle_ticks = 0
+            if not room.latest and not room.left:
+                self.rooms.pop(project_id, None)
+                self._last_persist.pop(project_id, None)
+            elif room.unsaved:
+                await self.persist(project_id)
+
+    async def persist(self, project_id):
+        room = self.rooms.get(project_id)
+        if self.redis is None or room is None or not room.unsaved:
+            return
+        users, room.unsaved = room.unsaved, set()
+        for user_id in users:
+            cursor = room.latest.get(user_id)
+            if cursor is not None:
+                await self.redis.setex(cursor_key(user_id, project_id), CURSOR_TTL,
+                                       json.dumps(cursor))
+                self.metrics["redis_writes"] += 1
+
+    async def _remove(self, project_id, room):
+        users, room.removed = room.removed, set()
+        if self.redis is not None:
+            await self.redis.delete(*(cursor_key(user_id, project_id) for user_id in users))
+            self.metrics["redis_writes"] += 1
+
+    async def drain(self):
+        # Waits for every room's tick loop to go idle (tests, shutdown)
+        while any(room.task for room in self.rooms.values()):
+            await asyncio.gather(*(room.task for room in list(self.rooms.values()) if room.task))
+
+
+async def _simulate(rooms, users, rate, seconds, tick):
+    class CountingRedis:
+        async def setex(self, key, ttl, value):
+            pass
+
+        async def delete(self, *keys):
+            pass
+
+    coalescer = CursorCoalescer(lambda *args: None, CountingRedis(), tick=tick, idle_ticks=2)
+    for step in range(int(rate * seconds)):
+        for r in range(rooms):
+            for u in range(users):
+                coalescer.move(f"project-{r}", f"user-{u}", step % 375, step % 812, "select")
+        await asyncio.sleep(1 / rate)
+    await coalescer.drain()
+    return coalescer.metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate coalesced cursor broadcasting")
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=60.0, help="moves per second per user")
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--tick", type=float, default=1 / 30)
+    args = parser.parse_args()
+
+    metrics = asyncio.run(_simulate(args.rooms, args.users, args.rate, args.seconds, args.tick))
+    moves = metrics["moves"]
+    print(f"{moves} cursor moves in {args.rooms} rooms of {args.users} users")
+    print(f"  per-move handler: {moves} broadcasts, {moves} Redis writes")
+    print(f"  coalesced:        {metrics['frames']} frames "
+          f"({metrics['cursors_sent']} cursor entries), {metrics['redis_writes']} Redis writes")
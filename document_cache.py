@@ -0,0 +1,353 @@
+# Hot project document cache (reference for CacheService.ts)
+#
+# Every join calls getProjectState, which reads the project, its artboards and
+# their objects from MongoDB; fifty users opening a popular file are fifty
+# identical full reads. DocumentCache puts two tiers in front of the loader:
+#
+#   local  an LRU of decoded documents bounded by their JSON size (max_bytes)
+#   redis  the JSON text under a versioned key, shared by all replicas:
+#            doc:{projectId}:version   counter, bumped by invalidate()
+#            doc:{projectId}:v{n}      the document as of version n (ttl)
+#
+# A document is cached under the version that was current when its load
+# started. invalidate() bumps the counter, so a load that raced an edit lands
+# under a version nobody asks for again and expires; it never overwrites
+# fresher data. Call invalidate() after an applied operation has been
+# persisted (after_persist() wraps a persist step); the bump is published on
+# INVALIDATION_CHANNEL so other replicas drop their local copy (wire their
+# subscriber to handle_invalidation). Local entries also expire after
+# local_ttl, bounding staleness if a message is lost.
+#
+# Concurrent misses for a project share one load in a process. Across
+# replicas, the first to miss takes a short Redis lock (SET NX PX) and loads;
+# the others poll the versioned key for up to lock_wait before loading
+# themselves.
+#
+# Cached documents are shared between callers and must be treated as
+# read-only. redis is any asyncio client with get/set/setex/incr/delete/
+# publish, e.g. redis.asyncio.Redis.from_url(REDIS_URL); None keeps the cache
+# process-local.
+#
+#   python document_cache.py      # join storms and a Zipf join mix against a slow loader
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import OrderedDict
+
+KEY_PREFIX = "doc"
+INVALIDATION_CHANNEL = "doc:invalidate"
+
+
+def version_key(project_id):
+    return f"{KEY_PREFIX}:{project_id}:version"
+
+
+def document_key(project_id, version):
+    return f"{KEY_PREFIX}:{project_id}:v{version}"
+
+
+def lock_key(project_id, version):
+    return f"{KEY_PREFIX}:{project_id}:v{version}:lock"
+
+
+class DocumentCache:
+    def __init__(self, loader, redis=None, max_bytes=256 << 20, ttl=600.0, local_ttl=60.0,
+                 lock_ttl=10.0, lock_wait=2.0, poll_interval=0.02, clock=time.monotonic):
+        # loader(project_id) -> awaitable JSON-serializable document, or None
+        # max_bytes: budget of the local tier, counted as JSON text
+        # ttl: lifetime of a Redis copy; local_ttl: of a local one
+        self.loader = loader
+        self.redis = redis
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.lock_ttl = lock_ttl
+        self.lock_wait = lock_wait
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self._entries = OrderedDict()  # project -> (expires, size, document)
+        self._bytes = 0
+        self._generation = {}          # project -> invalidations during its load
+        self._loading = {}             # project -> Future
+        self.metrics = {"hits": 0, "misses": 0, "redis_hits": 0, "loads": 0, "coalesced": 0,
+                        "lock_waits": 0, "invalidations": 0, "evictions": 0, "too_large": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        # Bytes held by the local tier
+        return self._bytes
+
+    @property
+    def hit_rate(self):
+        total = self.metrics["hits"] + self.metrics["misses"]
+        return self.metrics["hits"] / total if total else 0.0
+
+    # Lookups
+
+    def peek(self, project_id):
+        # Synchronous fast path: the cached document, or None when absent/expired
+        entry = self._entries.get(project_id)
+        if entry is None:
+            return None
+        if entry[0] <= self.clock():
+            self._drop(project_id)
+            return None
+        self._entries.move_to_end(project_id)
+        return entry[2]
+
+    async def get(self, project_id):
+        document = self.peek(project_id)
+        if document is not None:
+            self.metrics["hits"] += 1
+            return document
+        self.metrics["misses"] += 1
+
+        pending = self._loading.get(project_id)
+        if pending is not None:
+            self.metrics["coalesced"] += 1
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[project_id] = future
+        try:
+            document, text = await self._fetch(project_id)
+        except BaseException as error:
+            future.set_exception(error)
+            future.exception()  # retrieved here; waiters re-raise it
+            raise
+        finally:
+            del self._loading[project_id]
+            invalidated = self._generation.pop(project_id, 0)
+        if not invalidated and document is not None:
+            self._store(project_id, document, len(text))
+        future.set_result(document)
+        return document
+
+    async def _fetch(self, project_id):
+        # (document, JSON text) from Redis or the loader
+        if self.redis is None:
+            return await self._load(project_id)
+        version = int(await self.redis.get(version_key(project_id)) or 0)
+        key = document_key(project_id, version)
+        raw = await self.redis.get(key)
+        if raw is not None:
+            self.metrics["redis_hits"] += 1
+            return json.loads(raw), raw
+
+        token = uuid.uuid4().hex
+        if not await self.redis.set(lock_key(project_id, version), token, nx=True,
+                                    px=int(self.lock_ttl * 1000)):
+            # Another replica is loading this version
+            self.metrics["lock_waits"] += 1
+            deadline = self.clock() + self.lock_wait
+            while self.clock() < deadline:
+                await asyncio.sleep(self.poll_interval)
+                raw = await self.redis.get(key)
+                if raw is not None:
+                    self.metrics["redis_hits"] += 1
+                    return json.loads(raw), raw
+            return await self._load(project_id)
+        try:
+            document, text = await self._load(project_id)
+            if document is not None:
+                await self.redis.setex(key, max(1, round(self.ttl)), text)
+            return document, text
+        finally:
+            await self.redis.delete(lock_key(project_id, version))
+
+    async def _load(self, project_id):
+        self.metrics["loads"] += 1
+        document = await self.loader(project_id)
+        if document is None:
+            return None, None
+        return document, json.dumps(document, separators=(",", ":"))
+
+    def _store(self, project_id, document, size):
+        self._drop(project_id)
+        if size > self.max_bytes:
+            self.metrics["too_large"] += 1
+            return
+        self._entries[project_id] = (self.clock() + self.local_ttl, size, document)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.metrics["evictions"] += 1
+
+    def _drop(self, project_id):
+        entry = self._entries.pop(project_id, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    # Invalidation
+
+    def _forget(self, project_id):
+        if project_id in self._loading:
+            self._generation[project_id] = self._generation.get(project_id, 0) + 1
+        self._drop(project_id)
+        self.metrics["invalidations"] += 1
+
+    async def invalidate(self, project_id):
+        # Call once a change to the project (an applied operation, a rename,
+        # an artboard added) has been written to the database
+        self._forget(project_id)
+        if self.redis is None:
+            return
+        version = await self.redis.incr(version_key(project_id))
+        await self.redis.publish(INVALIDATION_CHANNEL,
+                                 json.dumps({"projectId": project_id, "version": version}))
+
+    def after_persist(self, persist):
+        # Wraps an OperationBatcher persist(project_id, operations, state)
+        # step so the project is invalidated once each batch is written
+        async def persist_and_invalidate(project_id, operations, state):
+            try:
+                return await persist(project_id, operations, state)
+            finally:
+                await self.invalidate(project_id)
+        return persist_and_invalidate
+
+    def handle_invalidation(self, message):
+        # Subscriber callback for INVALIDATION_CHANNEL messages from other replicas
+        self._forget(json.loads(message)["projectId"])
+
+
+class _MemoryRedis:
+    # The subset of redis.asyncio the cache uses, shared between simulated
+    # replicas, with a fixed round-trip latency; pub/sub delivers to the
+    # subscribers' callbacks directly
+    def __init__(self, latency=0.0005):
+        self.latency = latency
+        self._values = {}  # key -> (expires, value)
+        self.subscribers = []
+        self.calls = 0
+
+    async def _round_trip(self):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+
+    def _live(self, key):
+        entry = self._values.get(key)
+        if entry is not None and entry[0] is not None and entry[0] <= time.monotonic():
+            del self._values[key]
+            return None
+        return entry
+
+    async def get(self, key):
+        await self._round_trip()
+        entry = self._live(key)
+        return None if entry is None else entry[1]
+
+    async def set(self, key, value, nx=False, px=None):
+        await self._round_trip()
+        if nx and self._live(key) is not None:
+            return None
+        self._values[key] = (time.monotonic() + px / 1000 if px else None, value)
+        return True
+
+    async def setex(self, key, seconds, value):
+        await self._round_trip()
+        self._values[key] = (time.monotonic() + seconds, value)
+
+    async def incr(self, key):
+        await self._round_trip()
+        entry = self._live(key)
+        value = int(entry[1]) + 1 if entry else 1
+        self._values[key] = (None, str(value))
+        return value
+
+    async def delete(self, *keys):
+        await self._round_trip()
+        for key in keys:
+            self._values.pop(key, None)
+
+    async def publish(self, channel, message):
+        await self._round_trip()
+        for subscriber in self.subscribers:
+            subscriber(message)
+
+
+def _project_document(rng, project_id, objects):
+    # Roughly what getProjectState returns: project fields, artboards with
+    # their objects, collaborators
+    return {"id": project_id, "name": f"Project {project_id}", "artboards": [
+        {"id": f"{project_id}-artboard-{a}", "name": f"Screen {a}", "width": 375, "height": 812,
+         "objects": [{"id": f"obj-{i}", "type": "rectangle", "x": round(rng.uniform(0, 375), 2),
+                      "y": round(rng.uniform(0, 812), 2), "width": 40, "height": 40,
+                      "fill": "#4ECDC4", "zIndex": i} for i in range(objects // 4)]}
+        for a in range(4)], "collaborations": [{"userId": f"user-{u}", "role": "EDITOR"} for u in range(5)]}
+
+
+async def _simulate(replicas, storm_users, projects, joins, objects, db_latency, max_bytes, seed):
+    rng = random.Random(seed)
+    documents = {}
+    db_loads = {"count": 0}
+
+    async def loader(project_id):
+        db_loads["count"] += 1
+        await asyncio.sleep(db_latency)
+        if project_id not in documents:
+            documents[project_id] = _project_document(rng, project_id, objects)
+        return documents[project_id]
+
+    redis = _MemoryRedis()
+    caches = [DocumentCache(loader, redis, max_bytes=max_bytes) for _ in range(replicas)]
+    for cache in caches:
+        redis.subscribers.append(cache.handle_invalidation)
+
+    # A join storm: storm_users open one project at once, spread over replicas
+    async def storm(label):
+        before = db_loads["count"]
+        start = time.perf_counter()
+        await asyncio.gather(*(caches[u % replicas].get("project-hot") for u in range(storm_users)))
+        print(f"{label:<34} {db_loads['count'] - before:3} database loads, "
+              f"{(time.perf_counter() - start) * 1e3:7.1f} ms")
+
+    print(f"{replicas} replicas, database load {db_latency * 1e3:.0f} ms, "
+          f"project of {objects} objects")
+    await storm(f"{storm_users} joins, cold")
+    await storm(f"{storm_users} joins, warm")
+    await caches[0].invalidate("project-hot")
+    await storm(f"{storm_users} joins after an edit")
+
+    # Joins over many projects with Zipf popularity and occasional edits
+    weights = [1 / (p + 1) for p in range(projects)]
+    before = db_loads["count"]
+    start = time.perf_counter()
+    latencies = []
+    for _ in range(joins):
+        project_id = f"project-{rng.choices(range(projects), weights)[0]}"
+        cache = rng.choice(caches)
+        if rng.random() < 0.05:
+            await cache.invalidate(project_id)
+        t = time.perf_counter()
+        await cache.get(project_id)
+        latencies.append(time.perf_counter() - t)
+    latencies.sort()
+    loads = db_loads["count"] - before
+    print(f"{joins} joins over {projects} projects: {loads} database loads "
+          f"({loads / joins:.1%}), p50 {latencies[len(latencies) // 2] * 1e3:.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1e3:.2f} ms "
+          f"(uncached: {db_latency * 1e3:.0f} ms each)")
+    for i, cache in enumerate(caches):
+        print(f"  replica {i}: {len(cache)} local documents, {cache.size / 2**20:.1f} MB, "
+              f"hit rate {cache.hit_rate:.1%}, {cache.metrics}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate the project document cache")
+    parser.add_argument("--replicas", type=int, default=2)
+    parser.add_argument("--users", type=int, default=50, help="users in a join storm")
+    parser.add_argument("--projects", type=int, default=500)
+    parser.add_argument("--joins", type=int, default=2_000)
+    parser.add_argument("--objects", type=int, default=2_000, help="objects per project")
+    parser.add_argument("--db-latency", type=float, default=0.040, help="seconds per project load")
+    parser.add_argument("--max-mb", type=float, default=16.0, help="local tier budget per replica")
+    args = parser.parse_args()
+    asyncio.run(_simulate(args.replicas, args.users, args.projects, args.joins, args.objects,
+                          args.db_latency, int(args.max_mb * 2**20), seed=24))
@@ -0,0 +1,276 @@
+# Persistent (structurally shared) document state for the OT engine
+#
+# applyOperation in OperationalTransform.ts does `{ ...currentState }` and then
+# mutates the shared objects map underneath, so it pays for a copy without
+# getting an immutable old version. Here the objects map is a 32-way hash trie:
+# setting or deleting one object copies only the trie nodes on the path to it
+# (about log32(n) small lists), every earlier DocumentState stays valid, and
+# keeping many versions around for undo or Version.snapshot costs only the
+# nodes that actually differ between them.
+#
+#   python document_state.py      # per-op latency vs. artboard object count
+import argparse
+import gc
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+
+_BITS = 5
+_WIDTH = 1 << _BITS
+_MASK = _WIDTH - 1
+_MAX_SHIFT = 60  # past this the hash is exhausted; slots hold collision dicts
+
+# A slot is None, a (key, value) tuple, a branch list or a collision dict
+
+
+def _set(node, h, shift, key, value):
+    node = list(node)
+    i = (h >> shift) & _MASK
+    slot = node[i]
+    if slot is None:
+        node[i] = (key, value)
+        return node, True
+    if type(slot) is tuple:
+        if slot[0] == key:
+            node[i] = (key, value)
+            return node, False
+        if shift >= _MAX_SHIFT:
+            node[i] = {slot[0]: slot[1], key: value}
+            return node, True
+        branch = [None] * _WIDTH
+        branch[(hash(slot[0]) >> (shift + _BITS)) & _MASK] = slot
+        node[i], _ = _set(branch, h, shift + _BITS, key, value)
+        return node, True
+    if type(slot) is list:
+        node[i], added = _set(slot, h, shift + _BITS, key, value)
+        return node, added
+    collisions = dict(slot)
+    added = key not in collisions
+    collisions[key] = value
+    node[i] = collisions
+    return node, added
+
+
+def _delete(node, h, shift, key):
+    # Returns the new node, or the same object when key was absent
+    i = (h >> shift) & _MASK
+    slot = node[i]
+    if slot is None:
+        return node
+    if type(slot) is tuple:
+        if slot[0] != key:
+            return node
+        replacement = None
+    elif type(slot) is list:
+        child = _delete(slot, h, shift + _BITS, key)
+        if child is slot:
+            return node
+        occupied = [s for s in child if s is not None]
+        # Pull a lone leaf back up so the trie stays as shallow as possible
+        if not occupied:
+            replacement = None
+        elif len(occupied) == 1 and type(occupied[0]) is tuple:
+            replacement = occupied[0]
+        else:
+            replacement = child
+    else:
+        if key not in slot:
+            return node
+        collisions = {k: v for k, v in slot.items() if k != key}
+        replacement = next(iter(collisions.items())) if len(collisions) == 1 else collisions
+    node = list(node)
+    node[i] = replacement
+    return node
+
+
+def _get(node, h, key, default):
+    shift = 0
+    while True:
+        slot = node[(h >> shift) & _MASK]
+        if slot is None:
+            return default
+        if type(slot) is tuple:
+            return slot[1] if slot[0] == key else default
+        if type(slot) is list:
+            node = slot
+            shift += _BITS
+            continue
+        return slot.get(key, default)
+
+
+def _items(node):
+    for slot in node:
+        if slot is None:
+            continue
+        if type(slot) is tuple:
+            yield slot
+        elif type(slot) is list:
+            yield from _items(slot)
+        else:
+            yield from slot.items()
+
+
+def _diff(a, b):
+    # Yields (key, old, new) for keys whose value differs between two tries.
+    # Subtrees shared by both (the common case after a few ops) are skipped.
+    for slot_a, slot_b in zip(a, b):
+        if slot_a is slot_b:
+            continue
+        if type(slot_a) is list and type(slot_b) is list:
+            yield from _diff(slot_a, slot_b)
+            continue
+        old = dict(_items([slot_a])) if slot_a is not None else {}
+        new = dict(_items([slot_b])) if slot_b is not None else {}
+        for key, value in old.items():
+            other = new.get(key, _MISSING)
+            if other is not value:
+                yield key, value, other
+        for key, value in new.items():
+            if key not in old:
+                yield key, _MISSING, value
+
+
+_EMPTY = [None] * _WIDTH
+_MISSING = object()
+MISSING = _MISSING
+
+
+class PersistentMap:
+    __slots__ = ("_root", "_size")
+
+    def __init__(self, root=_EMPTY, size=0):
+        self._root = root
+        self._size = size
+
+    @classmethod
+    def from_dict(cls, mapping):
+        result = cls()
+        for key, value in mapping.items():
+            result = result.set(key, value)
+        return result
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, key):
+        return _get(self._root, hash(key), key, _MISSING) is not _MISSING
+
+    def __getitem__(self, key):
+        value = _get(self._root, hash(key), key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        return _get(self._root, hash(key), key, default)
+
+    def __iter__(self):
+        return (key for key, _ in _items(self._root))
+
+    def items(self):
+        return _items(self._root)
+
+    def set(self, key, value):
+        root, added = _set(self._root, hash(key), 0, key, value)
+        return PersistentMap(root, self._size + added)
+
+    def delete(self, key):
+        root = _delete(self._root, hash(key), 0, key)
+        if root is self._root:
+            return self
+        return PersistentMap(root, self._size - 1)
+
+    def to_dict(self):
+        return dict(_items(self._root))
+
+    def diff(self, other):
+        # (key, old, new) for every key changed from self to other; a missing
+        # side is MISSING. Values are compared by identity, which is exact for
+        # maps derived from one another since set() stores the value given.
+        return _diff(self._root, other._root)
+
+
+@dataclass(frozen=True)
+class DocumentState:
+    objects: PersistentMap = PersistentMap()
+    version: int = 0
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        # Accepts the {"objects": {...}} shape stored in Version.snapshot
+        return cls(PersistentMap.from_dict(snapshot.get("objects") or {}),
+                   snapshot.get("version", 0))
+
+    def snapshot(self):
+        return {"objects": self.objects.to_dict(), "version": self.version}
+
+    def advance(self, objects):
+        return replace(self, objects=objects, version=self.version + 1)
+
+
+class StateTimeline:
+    # Keeps the last max_versions states; they share structure, so this costs
+    # roughly one trie path per version rather than one full copy
+    def __init__(self, initial=None, max_versions=256):
+        self.max_versions = max_versions
+        self._states = OrderedDict()
+        self.push(initial or DocumentState())
+
+    def push(self, state):
+        self._states[state.version] = state
+        while len(self._states) > self.max_versions:
+            self._states.popitem(last=False)
+        return state
+
+    @property
+    def latest(self):
+        return next(reversed(self._states.values()))
+
+    def at(self, version):
+        return self._states[version]
+
+
+def benchmark(sizes=(1_000, 10_000, 100_000), ops=20_000, copy_limit=10_000, seed=3):
+    # Imported through the module so __main__ and the engine share one class
+    from document_state import DocumentState
+    from operation_history import OperationHistory
+    from operational_transform import Operation, OperationalTransformEngine
+
+    print(f"{'objects':>8} {'persistent us/op':>17} {'full copy us/op':>16}")
+    for size in sizes:
+        rng = random.Random(seed)
+        objects = {f"obj-{i}": {"x": 0, "y": 0, "scaleX": 1, "scaleY": 1, "rotation": 0,
+                                "fill": "#4ECDC4"} for i in range(size)}
+        batch = [Operation(f"op-{i}", "update", f"obj-{rng.randrange(size)}",
+                           {"fill": f"#{rng.randrange(1 << 24):06x}"}, "user-1", i, "client-1")
+                 for i in range(ops)]
+
+        engine = OperationalTransformEngine(OperationHistory(max_entries=ops))
+        state = DocumentState.from_snapshot({"objects": objects})
+        # Like timeit: the cyclic GC's full scans grow with heap size, not op cost
+        gc.disable()
+        start = time.perf_counter()
+        for op in batch:
+            state = engine.apply_operation(op, state)
+        persistent_us = (time.perf_counter() - start) / ops * 1e6
+
+        copied = "-"
+        if size <= copy_limit:
+            # What applyOperation would cost if it really copied the objects map
+            current = dict(objects)
+            start = time.perf_counter()
+            for op in batch:
+                current = dict(current)
+                current[op.object_id] = {**current[op.object_id], **op.data}
+            copied = f"{(time.perf_counter() - start) / ops * 1e6:16.1f}"
+        gc.enable()
+        print(f"{size:8} {persistent_us:17.1f} {copied:>16}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark persistent document state")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--ops", type=int, default=20_000)
+    args = parser.parse_args()
+    benchmark(tuple(args.sizes), args.ops)
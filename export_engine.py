@@ -0,0 +1,614 @@
+# Headless artboard export with a render worker pool
+#
+# exportDesign in app.js serializes the live SVG on the designer's device, so a
+# batch export of a project's artboards ties the device up for the whole run.
+# ExportEngine renders on the server from stored object data
+# (ArtboardObjectStore), in a pool of worker processes:
+#
+#   svg  the objects as SVG elements, attributes as updateSVGElement sets them
+#   png  rasterized band by band; each band is deflated into IDAT chunks as
+#        it is finished, so a worker holds one band, never the whole image
+#   pdf  one page sized to the artboard (1 CSS px = 0.75 pt) holding the
+#        raster as a Flate image, written the same way
+#   jpg  needs Pillow, whose encoder takes the full raster; the raster is
+#        still built band by band and only the worker ever holds it
+#
+# Workers write straight into a content-addressed cache directory. The key
+# covers the artboard id, a digest of the objects (id and data) in the
+# exported region, the format, scale, background and, for jpg only,
+# quality; identical exports after the first are a disk read, and concurrent
+# identical requests share one render. stream() copies a cached file to a
+# sink (a file, or an HTTP response's write) in fixed-size chunks.
+#
+# Shapes are drawn the way the editor draws them (rectangle, circle, line;
+# fill, stroke, strokeWidth), sampled at pixel centers without anti-aliasing.
+#
+#   python export_engine.py       # 200-artboard batch: cold, cached, after edits
+import argparse
+import asyncio
+import hashlib
+import html
+import inspect
+import io
+import json
+import math
+import os
+import random
+import struct
+import tempfile
+import time
+import zipfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from object_store import ArtboardObjectStore
+
+FORMATS = {"png": "image/png", "jpg": "image/jpeg", "svg": "image/svg+xml", "pdf": "application/pdf"}
+QUALITY = {"high": 92, "medium": 80, "low": 60}
+RENDERER_VERSION = 1  # part of every cache key; bump when output changes
+BAND_ROWS = 64
+CHUNK_SIZE = 64 * 1024
+MAX_PIXELS = 64_000_000
+
+_NAMED_COLORS = {"black": "#000000", "white": "#ffffff", "red": "#ff0000",
+                 "green": "#008000", "blue": "#0000ff", "gray": "#808080", "grey": "#808080"}
+
+
+class ExportError(Exception):
+    pass
+
+
+def parse_color(value):
+    # (r, g, b) for '#rgb', '#rrggbb' or a few names; None for no paint
+    if value is None:
+        return None
+    value = _NAMED_COLORS.get(str(value).strip().lower(), str(value).strip())
+    if value in ("", "none", "transparent"):
+        return None
+    if value.startswith("#") and len(value) == 4:
+        value = "#" + "".join(c * 2 for c in value[1:])
+    if not value.startswith("#") or len(value) != 7:
+        raise ExportError(f"unsupported color {value!r}")
+    return tuple(int(value[i:i + 2], 16) for i in (1, 3, 5))
+
+
+def resolve_quality(quality):
+    # export-quality values ('high' | 'medium' | 'low') or the API's 1-100
+    if isinstance(quality, str) and quality in QUALITY:
+        return QUALITY[quality]
+    quality = int(quality)
+    if not 1 <= quality <= 100:
+        raise ExportError("quality must be between 1 and 100")
+    return quality
+
+
+class _Raster:
+    # Paints the objects into one band of rows at a time. Coordinates are
+    # converted to device pixels up front; a band paints only the objects whose
+    # device bounds overlap it, bottom to top.
+    def __init__(self, objects, region, scale, background, channels):
+        rx, ry, rw, rh = region
+        self.width = max(1, math.ceil(rw * scale))
+        self.height = max(1, math.ceil(rh * scale))
+        if self.width * self.height > MAX_PIXELS:
+            raise ExportError(f"{self.width}x{self.height} exceeds the export pixel limit")
+        self.channels = channels
+        self.stride = self.width * channels
+        alpha = (255,) if channels == 4 else ()
+        self._background = (bytes(parse_color(background)) + bytes(alpha)
+                            if parse_color(background) else bytes(channels))
+        self._shapes = []
+        for obj in objects:
+            shape = self._device_shape(obj, rx, ry, scale, alpha)
+            if shape is not None:
+                self._shapes.append(shape)
+
+    @staticmethod
+    def _device_shape(obj, rx, ry, scale, alpha):
+        if obj.get("visible") is False:
+            return None
+        kind = obj.get("type")
+        fill = parse_color(obj.get("fill"))
+        stroke = parse_color(obj.get("stroke") or "black")
+        # Strokes thinner than a device pixel are drawn one pixel wide
+        stroke_width = max(1.0, float(obj.get("strokeWidth") or 1) * scale)
+        fill = bytes(fill) + bytes(alpha) if fill else None
+        stroke = bytes(stroke) + bytes(alpha) if stroke else None
+        if kind == "rectangle":
+            x0, y0 = (obj["x"] - rx) * scale, (obj["y"] - ry) * scale
+            x1, y1 = x0 + obj["width"] * scale, y0 + obj["height"] * scale
+            half = stroke_width / 2
+            return (kind, y0 - half, y1 + half, (x0, y0, x1, y1, half), fill, stroke)
+        if kind == "circle":
+            cx, cy, r = (obj["cx"] - rx) * scale, (obj["cy"] - ry) * scale, obj["r"] * scale
+            half = stroke_width / 2
+            return (kind, cy - r - half, cy + r + half, (cx, cy, r, half), fill, stroke)
+        if kind == "line":
+            x1, y1 = (obj["x1"] - rx) * scale, (obj["y1"] - ry) * scale
+            x2, y2 = (obj["x2"] - rx) * scale, (obj["y2"] - ry) * scale
+            length = math.hypot(x2 - x1, y2 - y1)
+            if length == 0 or stroke is None:
+                return None
+            # Butt-capped segment as a quad
+            nx, ny = -(y2 - y1) / length * stroke_width / 2, (x2 - x1) / length * stroke_width / 2
+            quad = ((x1 + nx, y1 + ny), (x2 + nx, y2 + ny), (x2 - nx, y2 - ny), (x1 - nx, y1 - ny))
+            ys = [p[1] for p in quad]
+            return (kind, min(ys), max(ys), quad, None, stroke)
+        return None
+
+    def bands(self, rows=BAND_ROWS):
+        # Yields (band bytes, row count) from top to bottom
+        for top in range(0, self.height, rows):
+            count = min(rows, self.height - top)
+            band = bytearray(self._background * (self.width * count))
+            for kind, ymin, ymax, geometry, fill, stroke in self._shapes:
+                if ymax < top or ymin > top + count:
+                    continue
+                first = max(top, math.ceil(ymin - 0.5))
+                last = min(top + count, math.ceil(ymax - 0.5))
+                paint = getattr(self, f"_paint_{kind}")
+                for row in range(first, last):
+                    paint(band, (row - top) * self.stride, row + 0.5, geometry, fill, stroke)
+            yield band, count
+
+    def _span(self, band, offset, x0, x1, color):
+        # Pixels whose centers lie in [x0, x1)
+        first = max(0, math.ceil(x0 - 0.5))
+        last = min(self.width, math.ceil(x1 - 0.5))
+        if last > first:
+            c = self.channels
+            band[offset + first * c:offset + last * c] = color * (last - first)
+
+    def _paint_rectangle(self, band, offset, y, geometry, fill, stroke):
+        x0, y0, x1, y1, half = geometry
+        if fill and y0 <= y < y1:
+            self._span(band, offset, x0, x1, fill)
+        if not stroke:
+            return
+        if y < y0 + half or y >= y1 - half:
+            self._span(band, offset, x0 - half, x1 + half, stroke)
+        else:
+            self._span(band, offset, x0 - half, x0 + half, stroke)
+            self._span(band, offset, x1 - half, x1 + half, stroke)
+
+    def _paint_circle(self, band, offset, y, geometry, fill, stroke):
+        cx, cy, r, half = geometry
+        dy2 = (y - cy) ** 2
+        if fill and dy2 < r * r:
+            w = math.sqrt(r * r - dy2)
+            self._span(band, offset, cx - w, cx + w, fill)
+        outer = r + half
+        if not stroke or dy2 >= outer * outer:
+            return
+        w_out = math.sqrt(outer * outer - dy2)
+        inner = r - half
+        if inner <= 0 or dy2 >= inner * inner:
+            self._span(band, offset, cx - w_out, cx + w_out, stroke)
+        else:
+            w_in = math.sqrt(inner * inner - dy2)
+            self._span(band, offset, cx - w_out, cx - w_in, stroke)
+            self._span(band, offset, cx + w_in, cx + w_out, stroke)
+
+    def _paint_line(self, band, offset, y, quad, fill, stroke):
+        # Where the row crosses the edges of the (convex) quad
+        xs = []
+        for i in range(4):
+            (ax, ay), (bx, by) = quad[i], quad[(i + 1) % 4]
+            if (ay <= y < by) or (by <= y < ay):
+                xs.append(ax + (y - ay) * (bx - ax) / (by - ay))
+        if len(xs) >= 2:
+            self._span(band, offset, min(xs), max(xs), stroke)
+
+
+class _CountingWriter:
+    # Tracks the offsets a PDF cross-reference table needs
+    def __init__(self, out):
+        self.out = out
+        self.offset = 0
+
+    def write(self, data):
+        self.out.write(data)
+        self.offset += len(data)
+
+
+def _png_chunk(out, kind, data):
+    out.write(struct.pack(">I", len(data)) + kind + data
+              + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+
+def _write_png(out, raster):
+    out.write(b"\x89PNG\r\n\x1a\n")
+    color_type = 6 if raster.channels == 4 else 2
+    _png_chunk(out, b"IHDR", struct.pack(">IIBBBBB", raster.width, raster.height, 8, color_type, 0, 0, 0))
+    compressor = zlib.compressobj(6)
+    pending = []
+    pending_bytes = 0
+    stride = raster.stride
+    for band, rows in raster.bands():
+        # Filter type 0 (None) on every row
+        data = b"".join(b"\x00" + band[i * stride:(i + 1) * stride] for i in range(rows))
+        pending.append(compressor.compress(data))
+        pending_bytes += len(pending[-1])
+        if pending_bytes >= CHUNK_SIZE:
+            _png_chunk(out, b"IDAT", b"".join(pending))
+            pending, pending_bytes = [], 0
+    pending.append(compressor.flush())
+    _png_chunk(out, b"IDAT", b"".join(pending))
+    _png_chunk(out, b"IEND", b"")
+
+
+def _write_pdf(out, raster, region):
+    out = _CountingWriter(out)
+    width_pt, height_pt = region[2] * 0.75, region[3] * 0.75
+    offsets = {}
+
+    def begin(number):
+        offsets[number] = out.offset
+        out.write(f"{number} 0 obj\n".encode())
+
+    out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    begin(1)
+    out.write(b"<< /Type /Catalog /Pages 2 0 R >>\nendobj\n")
+    begin(2)
+    out.write(b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj\n")
+    begin(3)
+    out.write(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width_pt:.2f} {height_pt:.2f}] "
+              f"/Resources << /XObject << /Im0 5 0 R >> >> /Contents 4 0 R >>\nendobj\n".encode())
+    content = f"q {width_pt:.2f} 0 0 {height_pt:.2f} 0 0 cm /Im0 Do Q".encode()
+    begin(4)
+    out.write(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream\nendobj\n")
+    # The image length is not known until the stream is written, so it is an
+    # indirect object that follows it
+    begin(5)
+    out.write(f"<< /Type /XObject /Subtype /Image /Width {raster.width} /Height {raster.height} "
+              f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode "
+              f"/Length 6 0 R >>\nstream\n".encode())
+    start = out.offset
+    compressor = zlib.compressobj(6)
+    for band, _ in raster.bands():
+        out.write(compressor.compress(band))
+    out.write(compressor.flush())
+    length = out.offset - start
+    out.write(b"\nendstream\nendobj\n")
+    begin(6)
+    out.write(b"%d\nendobj\n" % length)
+    xref = out.offset
+    out.write(b"xref\n0 7\n0000000000 65535 f \n")
+    for number in range(1, 7):
+        out.write(b"%010d 00000 n \n" % offsets[number])
+    out.write(b"trailer\n<< /Size 7 /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % xref)
+
+
+def _write_jpg(out, raster, quality):
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ExportError("jpg export requires Pillow") from None
+    pixels = bytearray()
+    for band, _ in raster.bands():
+        pixels += band
+    Image.frombuffer("RGB", (raster.width, raster.height), bytes(pixels), "raw", "RGB", 0, 1).save(
+        out, "JPEG", quality=quality, optimize=True)
+
+
+def _svg_number(value):
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+def _write_svg(out, objects, region, scale, background):
+    rx, ry, rw, rh = region
+    out.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{_svg_number(rw * scale)}" '
+              f'height="{_svg_number(rh * scale)}" viewBox="{_svg_number(rx)} {_svg_number(ry)} '
+              f'{_svg_number(rw)} {_svg_number(rh)}">\n'.encode())
+    if parse_color(background):
+        out.write(f'<rect x="{_svg_number(rx)}" y="{_svg_number(ry)}" width="{_svg_number(rw)}" '
+                  f'height="{_svg_number(rh)}" fill="{html.escape(background)}"/>\n'.encode())
+    for obj in objects:
+        if obj.get("visible") is False:
+            continue
+        kind = obj.get("type")
+        if kind == "rectangle":
+            tag, attrs = "rect", ("x", "y", "width", "height")
+        elif kind == "circle":
+            tag, attrs = "circle", ("cx", "cy", "r")
+        elif kind == "line":
+            tag, attrs = "line", ("x1", "y1", "x2", "y2")
+        else:
+            continue
+        parts = [f'{name}="{_svg_number(obj[name])}"' for name in attrs]
+        if kind != "line":
+            parts.append(f'fill="{html.escape(str(obj.get("fill") or "transparent"))}"')
+        parts.append(f'stroke="{html.escape(str(obj.get("stroke") or "black"))}"')
+        parts.append(f'stroke-width="{_svg_number(obj.get("strokeWidth") or 1)}"')
+        out.write(f'<{tag} {" ".join(parts)}/>\n'.encode())
+    out.write(b"</svg>\n")
+
+
+def render_to_file(objects, region, fmt, scale, quality, background, path):
+    # Runs in a pool worker. Writes next to `path` and renames, so a reader
+    # never sees a partial file. Returns (bytes written, render ms).
+    start = time.perf_counter()
+    partial = f"{path}.{os.getpid()}.partial"
+    try:
+        with open(partial, "wb") as out:
+            if fmt == "svg":
+                _write_svg(out, objects, region, scale, background)
+            elif fmt == "png":
+                _write_png(out, _Raster(objects, region, scale, background,
+                                        3 if parse_color(background) else 4))
+            elif fmt == "pdf":
+                _write_pdf(out, _Raster(objects, region, scale, background or "#ffffff", 3), region)
+            else:
+                _write_jpg(out, _Raster(objects, region, scale, background or "#ffffff", 3), quality)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return os.path.getsize(path), (time.perf_counter() - start) * 1e3
+
+
+def render_png(objects, region, scale, background="#ffffff"):
+    # PNG bytes of `region` (x, y, width, height) at `scale`, in memory; for
+    # small images such as thumbnail tiles
+    out = io.BytesIO()
+    _write_png(out, _Raster(objects, region, scale, background, 3 if parse_color(background) else 4))
+    return out.getvalue()
+
+
+class ExportResult:
+    __slots__ = ("artboard_id", "key", "path", "format", "size", "cached", "filename")
+
+    def __init__(self, artboard_id, key, path, fmt, size, cached, filename):
+        self.artboard_id = artboard_id
+        self.key = key
+        self.path = path
+        self.format = fmt
+        self.size = size
+        self.cached = cached
+        self.filename = filename
+
+    @property
+    def media_type(self):
+        return FORMATS[self.format]
+
+
+class ExportEngine:
+    def __init__(self, store=None, cache_dir=None, workers=None, max_cache_bytes=2 << 30, executor=None):
+        # store: ArtboardObjectStore the objects are read from
+        # cache_dir: where rendered files live; scanned on start, so the cache
+        #   survives restarts and can be shared by replicas on one volume
+        # workers: render processes (default: one per CPU)
+        # max_cache_bytes: least recently used files are deleted beyond this
+        self.store = store if store is not None else ArtboardObjectStore()
+        self.cache_dir = cache_dir if cache_dir is not None else tempfile.mkdtemp(prefix="exports-")
+        self.workers = workers or os.cpu_count() or 1
+        self.max_cache_bytes = max_cache_bytes
+        self._executor = executor or ProcessPoolExecutor(self.workers)
+        self._owns_executor = executor is None
+        self._cache = OrderedDict()  # key -> size, least recently used first
+        self._cache_bytes = 0
+        self._inflight = {}  # key -> Future of (size, ms)
+        self.metrics = {"renders": 0, "cache_hits": 0, "shared": 0, "render_ms": 0.0,
+                        "bytes_rendered": 0, "evicted": 0}
+        self._scan()
+
+    async def export(self, artboard, fmt="png", scale=1, quality="high", background="#ffffff",
+                     bounds=None):
+        # artboard: {"id", "name", "width", "height"} as in the Artboard model;
+        # bounds: {"x", "y", "width", "height"} to export part of it
+        if fmt == "jpeg":
+            fmt = "jpg"
+        if fmt not in FORMATS:
+            raise ExportError(f"unsupported format {fmt!r}")
+        scale = float(scale)
+        if not 0 < scale <= 4:
+            raise ExportError("scale must be between 0 and 4")
+        quality = resolve_quality(quality)
+        background = None if background in (None, "transparent") else background
+        parse_color(background)
+        if bounds is not None:
+            region = (bounds["x"], bounds["y"], bounds["width"], bounds["height"])
+        else:
+            region = (0, 0, artboard["width"], artboard["height"])
+
+        loaded = await self.store.load(artboard["id"], region)
+        key = self._key(artboard["id"], loaded, region, fmt, scale, quality, background)
+        filename = f"{artboard.get('name') or artboard['id']}@{scale:g}x.{fmt}"
+        path = self._path(key, fmt)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.metrics["cache_hits"] += 1
+            return ExportResult(artboard["id"], key, path, fmt, self._cache[key], True, filename)
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.metrics["shared"] += 1
+            size, _ = await asyncio.shield(future)
+            return ExportResult(artboard["id"], key, path, fmt, size, True, filename)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        loop = asyncio.get_running_loop()
+        future = self._inflight[key] = loop.run_in_executor(
+            self._executor, render_to_file, [data for _, data, _ in loaded], region, fmt, scale,
+            quality, background, path)
+        try:
+            size, ms = await asyncio.shield(future)
+        finally:
+            del self._inflight[key]
+        self.metrics["renders"] += 1
+        self.metrics["render_ms"] += ms
+        self.metrics["bytes_rendered"] += size
+        self._remember(key, size)
+        return ExportResult(artboard["id"], key, path, fmt, size, False, filename)
+
+    async def export_many(self, artboards, concurrency=None, **options):
+        # Exports a batch (export-all) with at most `concurrency` artboards
+        # loaded or rendering at once; results come back in input order
+        gate = asyncio.Semaphore(concurrency or self.workers * 2)
+
+        async def one(artboard):
+            async with gate:
+                return await self.export(artboard, **options)
+
+        return await asyncio.gather(*(one(artboard) for artboard in artboards))
+
+    async def stream(self, result, write, chunk_size=CHUNK_SIZE):
+        # Copies an export to `write` (file.write, or an HTTP response's
+        # async write) a chunk at a time. The file is opened before anything
+        # is sent, so eviction mid-stream does not cut it short.
+        with open(result.path, "rb") as source:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                sent = write(chunk)
+                if inspect.isawaitable(sent):
+                    await sent
+
+    async def archive(self, results, path):
+        # A ZIP of a batch for ExportAllRequest.archive, written to disk in
+        # the default executor; entries are stored, as the images are
+        # compressed already
+        def write():
+            with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as archive:
+                seen = set()
+                for result in results:
+                    name = result.filename
+                    if name in seen:
+                        name = f"{result.artboard_id}-{name}"
+                    seen.add(name)
+                    archive.write(result.path, name)
+            return os.path.getsize(path)
+
+        return await asyncio.get_running_loop().run_in_executor(None, write)
+
+    def stats(self):
+        return {**self.metrics, "cached_files": len(self._cache), "cache_bytes": self._cache_bytes,
+                "inflight": len(self._inflight)}
+
+    def close(self):
+        if self._owns_executor:
+            self._executor.shutdown()
+
+    @staticmethod
+    def _key(artboard_id, loaded, region, fmt, scale, quality, background):
+        # The object data itself, not its version: versions restart at 1 when
+        # a deleted object is re-created (undo of a delete) under the same id
+        digest = hashlib.sha256()
+        digest.update(repr((RENDERER_VERSION, artboard_id, region, fmt, scale,
+                            quality if fmt == "jpg" else None, background)).encode())
+        for object_id, data, _ in loaded:
+            digest.update(f"\0{object_id}\0".encode())
+            digest.update(json.dumps(data, sort_keys=True, separators=(",", ":")).encode())
+        return digest.hexdigest()
+
+    def _path(self, key, fmt):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{fmt}")
+
+    def _scan(self):
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                key, _, fmt = name.partition(".")
+                if fmt in FORMATS:
+                    path = os.path.join(root, name)
+                    found.append((os.path.getmtime(path), key, os.path.getsize(path)))
+        for _, key, size in sorted(found):
+            self._remember(key, size)
+
+    def _remember(self, key, size):
+        self._cache[key] = size
+        self._cache_bytes += size
+        while self._cache_bytes > self.max_cache_bytes and len(self._cache) > 1:
+            old, old_size = self._cache.popitem(last=False)
+            self._cache_bytes -= old_size
+            for fmt in FORMATS:
+                try:
+                    os.remove(self._path(old, fmt))
+                except FileNotFoundError:
+                    continue
+            self.metrics["evicted"] += 1
+
+
+def _random_artboard(rng, objects, width, height):
+    shapes = {}
+    for z in range(objects):
+        roll = rng.random()
+        color = f"#{rng.randrange(1 << 24):06x}"
+        if roll < 0.5:
+            obj = {"type": "rectangle", "x": round(rng.uniform(-20, width), 2),
+                   "y": round(rng.uniform(-20, height), 2), "width": round(rng.uniform(8, 160), 2),
+                   "height": round(rng.uniform(8, 160), 2), "fill": color, "stroke": "#000000"}
+        elif roll < 0.8:
+            obj = {"type": "circle", "cx": round(rng.uniform(0, width), 2),
+                   "cy": round(rng.uniform(0, height), 2), "r": round(rng.uniform(4, 80), 2),
+                   "fill": color, "stroke": "#333333"}
+        else:
+            obj = {"type": "line", "x1": round(rng.uniform(0, width), 2),
+                   "y1": round(rng.uniform(0, height), 2), "x2": round(rng.uniform(0, width), 2),
+                   "y2": round(rng.uniform(0, height), 2), "stroke": color}
+        obj.update(strokeWidth=rng.choice([1, 2, 4]), zIndex=z)
+        shapes[f"obj-{z}"] = obj
+    return shapes
+
+
+async def _batch(engine, artboards, fmt, scale, label):
+    start = time.perf_counter()
+    before = dict(engine.metrics)
+    results = await engine.export_many(artboards, fmt=fmt, scale=scale)
+    seconds = time.perf_counter() - start
+    renders = engine.metrics["renders"] - before["renders"]
+    render_ms = engine.metrics["render_ms"] - before["render_ms"]
+    size = sum(result.size for result in results)
+    print(f"{label:>14} {len(results):9} {renders:8} {seconds:8.2f} {len(results) / seconds:11.1f} "
+          f"{(render_ms / renders if renders else 0):10.1f} {size / len(results) / 1024:8.1f}")
+    return results
+
+
+async def _benchmark(count, objects, fmt, scale, workers, edits, seed):
+    rng = random.Random(seed)
+    store = ArtboardObjectStore()
+    artboards = []
+    for i in range(count):
+        artboard = {"id": f"artboard-{i}", "name": f"Screen {i}", "width": 375, "height": 812}
+        await store.write(artboard["id"], _random_artboard(rng, objects, 375, 812))
+        artboards.append(artboard)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        engine = ExportEngine(store, cache_dir, workers=workers)
+        print(f"{count} artboards x {objects} objects, {fmt} @{scale:g}x, {engine.workers} workers")
+        print(f"{'batch':>14} {'artboards':>9} {'renders':>8} {'seconds':>8} {'artboards/s':>11} "
+              f"{'ms/render':>10} {'KB/file':>8}")
+        try:
+            await _batch(engine, artboards, fmt, scale, "cold")
+            await _batch(engine, artboards, fmt, scale, "cached")
+            for artboard in rng.sample(artboards, edits):
+                await store.write(artboard["id"], {"obj-0": {"type": "rectangle", "x": 10, "y": 10,
+                                                             "width": 50, "height": 50,
+                                                             "fill": "#ff0000", "zIndex": 0}})
+            results = await _batch(engine, artboards, fmt, scale, f"{edits} edited")
+
+            # Streaming a batch as one archive, then one file to a sink
+            archive_path = os.path.join(cache_dir, "export-all.zip")
+            archived = await engine.archive(results, archive_path)
+            sent = []
+            await engine.stream(results[0], lambda chunk: sent.append(len(chunk)))
+            print(f"archive {archived / 1024:.0f} KB; {results[0].filename} streamed in "
+                  f"{len(sent)} chunks of at most {max(sent) // 1024} KB")
+        finally:
+            engine.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark batch artboard exports")
+    parser.add_argument("--artboards", type=int, default=200)
+    parser.add_argument("--objects", type=int, default=150, help="objects per artboard")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="png")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--edits", type=int, default=10, help="artboards edited before the last batch")
+    args = parser.parse_args()
+    asyncio.run(_benchmark(args.artboards, args.objects, args.format, args.scale, args.workers,
+                           args.edits, seed=21))
@@ -0,0 +1,311 @@
+# Content-addressed generation cache for script.py / script_1.py output
+#
+# Every subtree down to max_depth gets a Merkle fingerprint (for example
+# "figma-clone/packages/backend" or "docker-compose.production.yml"). Serialized
+# JSON fragments are stored under their fingerprint, so a regeneration only
+# re-serializes the subtrees that changed, and a regeneration whose root
+# fingerprint matches the last run for that output (and whose outputs are all
+# still on disk as written) is a no-op. Each run is a "generation"; the least
+# recently used ones are evicted and fragments no longer referenced by a
+# surviving generation are swept.
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import serializers
+from materializer import MANIFEST_NAME, load_manifest, materialize
+
+try:
+    import fcntl
+except ImportError:  # Windows: generations from concurrent runs may be lost, never corrupted
+    fcntl = None
+
+CACHE_DIR = ".gencache"
+
+
+def _join(prefix, name):
+    return f"{prefix}/{name}" if prefix else name
+
+
+def fingerprint(tree, max_depth=4):
+    # Returns {subtree path: fingerprint}; the whole tree is stored under ""
+    fps = {}
+
+    def visit(value, path, depth):
+        if isinstance(value, dict):
+            h = hashlib.sha256(b"d")
+            for name, child in value.items():
+                h.update(json.dumps(name).encode("utf-8"))
+                h.update(visit(child, _join(path, name), depth + 1).encode("ascii"))
+        elif isinstance(value, str):
+            h = hashlib.sha256(b"s" + value.encode("utf-8"))
+        else:
+            h = hashlib.sha256(b"v" + json.dumps(value).encode("utf-8"))
+        fp = h.hexdigest()
+        if depth <= max_depth:
+            fps[path] = fp
+        return fp
+
+    visit(tree, "", 0)
+    return fps
+
+
+class GenerationCache:
+    def __init__(self, root=CACHE_DIR, max_generations=32, max_depth=4):
+        self.root = root
+        self.max_generations = max_generations
+        self.max_depth = max_depth
+        self.hits = 0
+        self.misses = 0
+        self._index = None
+        self._touched = {}
+        self._recorded = {}
+
+    # Index: {"targets": {target: generation id},
+    #         "generations": {id: {"target", "root", "last_used", "output"}}}
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.root, "index.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"targets": {}, "generations": {}}
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = self._load_index()
+        return self._index
+
+    @contextmanager
+    def _locked(self):
+        # Several generator processes may share one cache directory
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, "index.lock"), "w") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write(self, path, text):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def save(self):
+        # Merge this process's changes into whatever is on disk now
+        with self._locked():
+            index = self._load_index()
+            for gen_id, (target, meta) in self._recorded.items():
+                index["generations"][gen_id] = meta
+                index["targets"][target] = gen_id
+            for gen_id, last_used in self._touched.items():
+                if gen_id in index["generations"]:
+                    index["generations"][gen_id]["last_used"] = last_used
+            self._index = index
+            self._touched.clear()
+            self._recorded.clear()
+            self.evict()
+            self._write(os.path.join(self.root, "index.json"), json.dumps(index, indent=2))
+
+    def _object_path(self, fp):
+        return os.path.join(self.root, "objects", fp[:2], fp)
+
+    def _generation_path(self, gen_id):
+        return os.path.join(self.root, "generations", gen_id + ".json")
+
+    def get_fragment(self, fp):
+        try:
+            with open(self._object_path(fp), encoding="utf-8") as f:
+                text = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return text
+
+    def put_fragment(self, fp, text):
+        path = self._object_path(fp)
+        if not os.path.exists(path):
+            self._write(path, text)
+
+    def lookup(self, target):
+        gen_id = self.index["targets"].get(target)
+        if gen_id is None:
+            return None
+        meta = self.index["generations"].get(gen_id)
+        if meta is None:
+            return None
+        meta["last_used"] = self._touched[gen_id] = time.time()
+        return meta
+
+    def fingerprints(self, meta):
+        try:
+            with open(self._generation_path(meta["id"])) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def record(self, target, fps, output=None):
+        gen_id = hashlib.sha256(f"{target}\0{fps['']}".encode("utf-8")).hexdigest()[:32]
+        self._write(self._generation_path(gen_id), json.dumps(fps))
+        meta = {
+            "id": gen_id,
+            "target": target,
+            "root": fps[""],
+            "last_used": time.time(),
+            "output": output,
+        }
+        self._recorded[gen_id] = (target, meta)
+        self.save()
+
+    def evict(self):
+        generations = self.index["generations"]
+        if len(generations) <= self.max_generations:
+            return
+        current = set(self.index["targets"].values())
+        by_age = sorted(generations.values(), key=lambda meta: meta["last_used"])
+        excess = len(generations) - self.max_generations
+        for meta in by_age:
+            if excess == 0:
+                break
+            if meta["id"] in current:
+                continue
+            del generations[meta["id"]]
+            try:
+                os.remove(self._generation_path(meta["id"]))
+            except FileNotFoundError:
+                pass
+            excess -= 1
+        self.sweep()
+
+    def sweep(self, grace=60):
+        # Drop fragments that no surviving generation can reach; recent ones may
+        # belong to a concurrent run that has not recorded its generation yet
+        live = set()
+        for meta in self.index["generations"].values():
+            live.update(self.fingerprints(meta).values())
+        objects = os.path.join(self.root, "objects")
+        if not os.path.isdir(objects):
+            return
+        cutoff = time.time() - grace
+        for bucket in os.listdir(objects):
+            for fp in os.listdir(os.path.join(objects, bucket)):
+                path = os.path.join(objects, bucket, fp)
+                if fp not in live and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+
+
+def _render(value, path, depth, fps, cache):
+    # Produces exactly json.dumps(value, indent=2); dict fragments at or above
+    # max_depth come from the cache when their fingerprint is known
+    fp = fps.get(path) if depth <= cache.max_depth else None
+    if fp is not None and isinstance(value, dict):
+        text = cache.get_fragment(fp)
+        if text is not None:
+            return text
+
+    if isinstance(value, dict) and value:
+        items = []
+        for name, child in value.items():
+            child_text = _render(child, _join(path, name), depth + 1, fps, cache)
+            items.append(f"  {json.dumps(name)}: " + child_text.replace("\n", "\n  "))
+        text = "{\n" + ",\n".join(items) + "\n}"
+    else:
+        text = json.dumps(value, indent=2)
+
+    if fp is not None and isinstance(value, dict):
+        cache.put_fragment(fp, text)
+    return text
+
+
+def _output_stat(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _missing_outputs(root, records):
+    # Manifest paths whose file is gone or no longer matches its record
+    for path, record in records.items():
+        try:
+            st = os.stat(os.path.join(root, *path.split("/")))
+        except FileNotFoundError:
+            yield path
+            continue
+        if st.st_size != record["size"] or st.st_mtime_ns != record["mtime_ns"]:
+            yield path
+
+
+def write_artifact(tree, path, fmt="json", cache=None):
+    # Serializes tree to path in one of the serializers formats; returns False
+    # when the previous generation written there is still current
+    cache = cache or GenerationCache()
+    target = f"{fmt}:" + os.path.abspath(path)
+    fps = fingerprint(tree, cache.max_depth)
+
+    meta = cache.lookup(target)
+    if meta and meta["root"] == fps[""] and os.path.exists(path) \
+            and meta["output"] == _output_stat(path):
+        cache.save()
+        return False
+
+    if fmt == "json":
+        data = _render(tree, "", 0, fps, cache).encode("utf-8")
+    else:
+        data = serializers.dumps(tree, fmt)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    cache.record(target, fps, _output_stat(path))
+    return True
+
+
+def write_json(tree, path, cache=None):
+    # Drop-in for json.dump(tree, f, indent=2)
+    return write_artifact(tree, path, "json", cache)
+
+
+def materialize_cached(tree, root, cache=None, workers=8, prune=False,
+                       manifest_name=MANIFEST_NAME):
+    # Writes the file tree, skipping subtrees whose fingerprint matches the
+    # generation last materialized into root; None when nothing changed at all
+    cache = cache or GenerationCache()
+    target = "tree:" + os.path.join(os.path.abspath(root), manifest_name)
+    fps = fingerprint(tree, cache.max_depth)
+
+    skip = []
+    meta = cache.lookup(target)
+    records = load_manifest(root, manifest_name) if meta else {}
+    if records:
+        previous = cache.fingerprints(meta)
+        # A fingerprint only vouches for files still as they were written:
+        # subtrees holding a deleted or edited output are not skipped
+        dirty = set()
+        for path in _missing_outputs(root, records):
+            parts = path.split("/")
+            dirty.update("/".join(parts[:i]) for i in range(len(parts) + 1))
+
+        def collect(value, path, depth):
+            for name, child in value.items():
+                child_path = _join(path, name)
+                if previous.get(child_path) == fps.get(child_path, "") and child_path not in dirty:
+                    skip.append(child_path)
+                elif isinstance(child, dict) and depth + 1 < cache.max_depth:
+                    collect(child, child_path, depth + 1)
+
+        if previous.get("") == fps[""] and "" not in dirty and not prune:
+            cache.save()
+            return None
+        collect(tree, "", 0)
+
+    report = materialize(tree, root, workers=workers, prune=prune, skip=skip,
+                         manifest_name=manifest_name)
+    cache.record(target, fps)
+    return report
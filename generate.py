@@ -0,0 +1,164 @@
+# Parallel generation CLI for script.py (project) and script_1.py (deployment)
+#
+# Every JSON artifact and every top-level piece of the expanded tree is a
+# separate target, run in a process pool:
+#
+#   python generate.py                          # everything into ./figma-clone
+#   python generate.py --only kubernetes        # just kubernetes/*.yaml
+#   python generate.py --only packages/web --only project_structure.json
+#   python generate.py --only deployment        # all of script_1.py's output
+#   python generate.py --format binary          # project_structure.dsb etc.
+#   python generate.py --list
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from functools import lru_cache
+
+import serializers
+from gencache import materialize_cached, write_artifact
+from materializer import materialize
+
+PROJECT_ROOT = "figma-clone"
+
+
+@dataclass(frozen=True)
+class Target:
+    name: str    # "packages/web", "kubernetes", "project_structure.json", ...
+    source: str  # "project" or "deployment"
+    kind: str    # "json" or "tree"
+
+
+@dataclass
+class TargetResult:
+    target: Target
+    seconds: float
+    written: int
+    unchanged: int
+    cached: bool = False
+
+
+@lru_cache(maxsize=None)
+def sources():
+    # Imported lazily so each pool worker loads the generator modules once
+    from script import project_structure
+    from script_1 import deployment_configs
+    return {"project": project_structure, "deployment": deployment_configs}
+
+
+def _top_level(path):
+    return path.split("/", 1)[0]
+
+
+def list_targets():
+    project = sources()["project"][PROJECT_ROOT]
+    deployment = sources()["deployment"]
+
+    targets = [
+        Target("project_structure.json", "project", "json"),
+        Target("deployment_configs.json", "deployment", "json"),
+    ]
+    for name, value in project.items():
+        if name == "packages":
+            targets += [Target(f"packages/{pkg}", "project", "tree") for pkg in value]
+        else:
+            targets.append(Target(name, "project", "tree"))
+    for name in dict.fromkeys(_top_level(path) for path in deployment):
+        targets.append(Target(name, "deployment", "tree"))
+    return targets
+
+
+def select(targets, only):
+    if not only:
+        return targets
+    patterns = [p.strip("/").removeprefix(PROJECT_ROOT + "/") for p in only]
+
+    def matches(target, pattern):
+        return pattern in (target.name, target.source) or target.name.startswith(pattern + "/")
+
+    return [t for t in targets if any(matches(t, p) for p in patterns)]
+
+
+def subtree(target):
+    if target.kind == "json":
+        return sources()[target.source]
+    if target.source == "project":
+        project = sources()["project"][PROJECT_ROOT]
+        node = project
+        for part in target.name.split("/"):
+            node = node[part]
+        # Re-nest under the original path so files land where script.py puts them
+        for part in reversed(target.name.split("/")):
+            node = {part: node}
+        return {PROJECT_ROOT: node}
+    deployment = sources()["deployment"]
+    return {PROJECT_ROOT: {path: value for path, value in deployment.items()
+                           if _top_level(path) == target.name}}
+
+
+def run_target(target, out, use_cache=True, workers=8, fmt="json"):
+    start = time.perf_counter()
+    tree = subtree(target)
+
+    if target.kind == "json":
+        stem = target.name.removesuffix(".json")
+        path = os.path.join(out, stem + serializers.EXTENSIONS[fmt])
+        if use_cache:
+            written = int(write_artifact(tree, path, fmt))
+        else:
+            serializers.dump(tree, path, fmt)
+            written = 1
+        return TargetResult(target, time.perf_counter() - start, written, 1 - written)
+
+    # Targets share the output root, so each keeps its own manifest
+    manifest_name = os.path.join(".scaffold", target.name.replace("/", "__") + ".json")
+    if use_cache:
+        report = materialize_cached(tree, out, workers=workers, manifest_name=manifest_name)
+    else:
+        report = materialize(tree, out, workers=workers, manifest_name=manifest_name)
+    if report is None:
+        return TargetResult(target, time.perf_counter() - start, 0, 0, cached=True)
+    return TargetResult(target, time.perf_counter() - start,
+                        len(report.written), len(report.unchanged))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate DesignStudio project and deployment files")
+    parser.add_argument("--only", action="append", default=[], metavar="TARGET",
+                        help="target name, prefix or source (project/deployment); repeatable")
+    parser.add_argument("--out", default=".", help="output directory")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--format", choices=list(serializers.EXTENSIONS), default="json",
+                        help="serialization of the JSON artifacts")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the generation cache")
+    parser.add_argument("--list", action="store_true", help="list targets and exit")
+    args = parser.parse_args(argv)
+
+    targets = select(list_targets(), args.only)
+    if args.list:
+        for target in targets:
+            print(f"{target.name:32} {target.source:11} {target.kind}")
+        return 0
+    if not targets:
+        parser.error(f"no target matches {', '.join(args.only)}")
+    if args.format == "zstd" and serializers.zstandard is None:
+        parser.error("--format zstd requires the zstandard package (pip install zstandard)")
+
+    os.makedirs(args.out, exist_ok=True)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=min(args.jobs, len(targets))) as pool:
+        futures = [pool.submit(run_target, target, args.out, not args.no_cache, fmt=args.format)
+                   for target in targets]
+        for future in as_completed(futures):
+            result = future.result()
+            summary = "cached" if result.cached else \
+                f"{result.written} written, {result.unchanged} unchanged"
+            print(f"  {result.target.name:32} {result.seconds * 1000:8.1f} ms  {summary}")
+
+    print(f"✅ {len(targets)} targets in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,172 @@
+# Incremental materializer for the scaffold trees built by script.py
+#
+# project_structure is a nested dict: directories are dicts, files are strings,
+# and dicts stored under a name with an extension (package.json, tsconfig.json)
+# are JSON documents. The tree is walked lazily and written with a thread pool;
+# a manifest of content hashes next to the output lets re-runs skip every file
+# whose content did not change, so build caches keyed on mtime stay warm.
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+MANIFEST_NAME = ".scaffold-manifest.json"
+
+
+@dataclass
+class MaterializeReport:
+    written: list = field(default_factory=list)
+    unchanged: list = field(default_factory=list)
+    removed: list = field(default_factory=list)
+
+
+def is_document_name(name):
+    return os.path.splitext(name)[1] != ""
+
+
+def is_file_node(name, value):
+    return not isinstance(value, dict) or is_document_name(name)
+
+
+def render(value):
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, indent=2) + "\n"
+
+
+def _under(path, prefixes):
+    return any(path == p or path.startswith(p + "/") for p in prefixes)
+
+
+def iter_entries(tree, prefix="", skip=()):
+    # Yields (relative posix path, file content) without building a flat copy
+    for name, value in tree.items():
+        path = f"{prefix}/{name}" if prefix else name
+        if path in skip:
+            continue
+        if is_file_node(name, value):
+            yield path, render(value)
+        else:
+            yield from iter_entries(value, path, skip)
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def load_manifest(root, manifest=MANIFEST_NAME):
+    try:
+        with open(os.path.join(root, manifest)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(root, records, manifest=MANIFEST_NAME):
+    target = os.path.join(root, manifest)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = target + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(records, f, indent=2, sort_keys=True)
+    os.replace(tmp, target)
+
+
+def _stat_record(target, digest):
+    st = os.stat(target)
+    return {"sha256": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _sync_entry(root, path, content, known):
+    data = content.encode("utf-8")
+    digest = content_hash(data)
+    target = os.path.join(root, *path.split("/"))
+
+    try:
+        st = os.stat(target)
+    except FileNotFoundError:
+        st = None
+
+    if st is not None:
+        # Manifest hit with an untouched file: no need to read it back
+        if known and known["sha256"] == digest and known["size"] == st.st_size \
+                and known["mtime_ns"] == st.st_mtime_ns:
+            return path, known, False
+        # Unknown or edited file: compare against what is actually on disk
+        if st.st_size == len(data):
+            with open(target, "rb") as f:
+                if content_hash(f.read()) == digest:
+                    return path, _stat_record(target, digest), False
+
+    os.makedirs(os.path.dirname(target) or root, exist_ok=True)
+    tmp = target + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, target)
+    return path, _stat_record(target, digest), True
+
+
+def materialize(tree, root, workers=8, prune=False, skip=(), manifest_name=MANIFEST_NAME):
+    # skip names subtrees known to be unchanged since the last run (see
+    # gencache); their manifest records are carried over without touching disk.
+    # Callers writing disjoint subtrees into one root use separate manifest_names.
+    os.makedirs(root, exist_ok=True)
+    previous = load_manifest(root, manifest_name)
+    manifest = {}
+    report = MaterializeReport()
+
+    if not previous:
+        skip = ()
+    skip = frozenset(skip)
+    if skip:
+        for path, record in previous.items():
+            if _under(path, skip):
+                manifest[path] = record
+                report.unchanged.append(path)
+
+    def collect(futures):
+        for future in futures:
+            path, record, changed = future.result()
+            manifest[path] = record
+            (report.written if changed else report.unchanged).append(path)
+
+    # Keep a bounded window of in-flight writes so the generator stays lazy
+    window = workers * 4
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for path, content in iter_entries(tree, skip=skip):
+            pending.add(pool.submit(_sync_entry, root, path, content, previous.get(path)))
+            if len(pending) >= window:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(pending)
+
+    if prune:
+        for path in sorted(set(previous) - set(manifest)):
+            try:
+                os.remove(os.path.join(root, *path.split("/")))
+            except FileNotFoundError:
+                pass
+            report.removed.append(path)
+    else:
+        # Remember files we no longer generate so a later --prune can find them
+        for path in set(previous) - set(manifest):
+            manifest[path] = previous[path]
+
+    save_manifest(root, manifest, manifest_name)
+    return report
+
+
+if __name__ == "__main__":
+    from script import project_structure
+
+    parser = argparse.ArgumentParser(description="Write the figma-clone scaffold to disk")
+    parser.add_argument("root", nargs="?", default=".", help="output directory")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--prune", action="store_true", help="delete files no longer generated")
+    args = parser.parse_args()
+
+    report = materialize(project_structure, args.root, workers=args.workers, prune=args.prune)
+    print(f"✅ {len(report.written)} written, {len(report.unchanged)} unchanged, "
+          f"{len(report.removed)} removed")
@@ -0,0 +1,249 @@
+# Per-object artboard storage (replaces the Artboard.objects Json blob)
+#
+# Artboard.objects is one JSON array, so every persisted edit rewrites every
+# object on the artboard, and large artboards approach MongoDB's 16 MB document
+# limit. Here each canvas object is its own ArtboardObject document keyed by
+# (artboardId, objectId), carrying
+#
+#   data      the object itself
+#   zIndex    paint order, so reads come back bottom to top
+#   minX..maxY its bounding box (spatial_index.bounds_of), indexed so a read
+#             can fetch only the objects intersecting a viewport
+#   version   incremented on every write; write_if() is a compare-and-set on it
+#
+# A flush of N operations costs one bulk write of the objects they touched,
+# independent of artboard size.
+#
+# The collection is injected (an async client over the artboard_objects
+# collection); MemoryObjectCollection is the in-process stand-in used here and
+# in tests:
+#   bulk_upsert(artboard_id, docs) -> awaitable {objectId: version}
+#   delete_many(artboard_id, object_ids) -> awaitable
+#   compare_and_set(artboard_id, doc, expected_version) -> awaitable bool
+#   find(artboard_id, rect=None) -> awaitable [doc], rect = (minX, minY, maxX, maxY)
+#
+# Per-artboard consumers of a flush (this store, WriteBehindQueue,
+# ThumbnailPipeline, SearchIndex) share one step signature,
+# persist_operations(artboard_id, state, operations); batcher_persist() turns
+# a list of them into OperationBatcher's persist(project_id, operations, state).
+#
+#   python object_store.py        # bytes written per flush and viewport reads vs. the blob
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+
+from document_state import DocumentState
+from spatial_index import bounds_of
+
+log = logging.getLogger(__name__)
+
+
+class VersionConflict(Exception):
+    def __init__(self, object_id, expected, actual):
+        super().__init__(f"object {object_id} is at version {actual}, expected {expected}")
+        self.object_id = object_id
+        self.expected = expected
+        self.actual = actual
+
+
+def object_document(object_id, obj):
+    # The ArtboardObject fields derived from one canvas object (minus version)
+    minx, miny, maxx, maxy = bounds_of(obj)
+    return {"objectId": object_id, "data": obj, "zIndex": obj.get("zIndex", 0),
+            "minX": minx, "minY": miny, "maxX": maxx, "maxY": maxy}
+
+
+class MemoryObjectCollection:
+    # Stand-in for the artboard_objects collection; documents are stored as
+    # JSON text so written and read byte counts match what a database moves
+    def __init__(self):
+        self._docs = {}  # artboard id -> {object id: (version, bounds, text)}
+        self.metrics = {"writes": 0, "bytes_written": 0, "bytes_read": 0}
+
+    async def bulk_upsert(self, artboard_id, docs):
+        stored = self._docs.setdefault(artboard_id, {})
+        versions = {}
+        for doc in docs:
+            previous = stored.get(doc["objectId"])
+            version = 1 if previous is None else previous[0] + 1
+            text = json.dumps({**doc, "artboardId": artboard_id, "version": version},
+                              separators=(",", ":"))
+            stored[doc["objectId"]] = (version, (doc["minX"], doc["minY"], doc["maxX"], doc["maxY"]), text)
+            versions[doc["objectId"]] = version
+            self.metrics["bytes_written"] += len(text)
+        self.metrics["writes"] += 1
+        return versions
+
+    async def delete_many(self, artboard_id, object_ids):
+        stored = self._docs.get(artboard_id, {})
+        for object_id in object_ids:
+            stored.pop(object_id, None)
+        self.metrics["writes"] += 1
+
+    async def compare_and_set(self, artboard_id, doc, expected_version):
+        current = self._docs.get(artboard_id, {}).get(doc["objectId"])
+        if (current[0] if current else 0) != expected_version:
+            return False
+        await self.bulk_upsert(artboard_id, [doc])
+        return True
+
+    async def version(self, artboard_id, object_id):
+        current = self._docs.get(artboard_id, {}).get(object_id)
+        return current[0] if current else 0
+
+    async def find(self, artboard_id, rect=None):
+        # A database answers the rect filter from the (minX, minY) index
+        docs = []
+        for _, (minx, miny, maxx, maxy), text in self._docs.get(artboard_id, {}).values():
+            if rect is not None and (minx > rect[2] or maxx < rect[0]
+                                     or miny > rect[3] or maxy < rect[1]):
+                continue
+            self.metrics["bytes_read"] += len(text)
+            docs.append(json.loads(text))
+        return docs
+
+    def count(self, artboard_id):
+        return len(self._docs.get(artboard_id, {}))
+
+
+class ArtboardObjectStore:
+    def __init__(self, collection=None):
+        self.collection = collection if collection is not None else MemoryObjectCollection()
+        self.metrics = {"flushes": 0, "objects_written": 0, "objects_deleted": 0}
+
+    async def write(self, artboard_id, changes):
+        # changes: {object id: object, or None to delete}. Returns the new
+        # version of every upserted object.
+        upserts = [object_document(object_id, obj) for object_id, obj in changes.items()
+                   if obj is not None]
+        deletes = [object_id for object_id, obj in changes.items() if obj is None]
+        versions = {}
+        if upserts:
+            versions = await self.collection.bulk_upsert(artboard_id, upserts)
+        if deletes:
+            await self.collection.delete_many(artboard_id, deletes)
+        self.metrics["flushes"] += 1
+        self.metrics["objects_written"] += len(upserts)
+        self.metrics["objects_deleted"] += len(deletes)
+        return versions
+
+    async def persist_operations(self, artboard_id, state, operations):
+        # A batcher_persist step: writes each object the artboard's operations
+        # touched, once, as it stands in the room's state
+        touched = dict.fromkeys(op.object_id for op in operations if op.type != "noop")
+        if touched:
+            return await self.write(artboard_id, {object_id: state.objects.get(object_id)
+                                                  for object_id in touched})
+        return {}
+
+    async def write_if(self, artboard_id, object_id, obj, expected_version):
+        # Optimistic write for writers outside a room (REST edits, imports)
+        if not await self.collection.compare_and_set(artboard_id, object_document(object_id, obj),
+                                                     expected_version):
+            actual = await self.collection.version(artboard_id, object_id)
+            raise VersionConflict(object_id, expected_version, actual)
+        return expected_version + 1
+
+    async def load(self, artboard_id, viewport=None):
+        # Objects of an artboard in paint order; with viewport=(x, y, width,
+        # height) only those whose bounds intersect it
+        rect = None
+        if viewport is not None:
+            x, y, width, height = viewport
+            rect = (x, y, x + width, y + height)
+        docs = await self.collection.find(artboard_id, rect)
+        docs.sort(key=lambda doc: doc["zIndex"])
+        return [(doc["objectId"], doc["data"], doc["version"]) for doc in docs]
+
+    async def load_state(self, artboard_id):
+        # A DocumentState for a room that is being opened
+        return DocumentState.from_snapshot({"objects": {
+            object_id: data for object_id, data, _ in await self.load(artboard_id)}})
+
+
+def batcher_persist(*steps):
+    # OperationBatcher's persist(project_id, operations, state) over
+    # per-artboard steps. state is the room's DocumentState as of the flush;
+    # an operation belongs to its artboard_id, or else to the artboardId of
+    # its object in that state. Each artboard's operations go through the
+    # steps in order.
+    async def persist(project_id, operations, state):
+        by_artboard = {}
+        for op in operations:
+            artboard_id = op.artboard_id
+            if artboard_id is None:
+                obj = state.objects.get(op.object_id)
+                artboard_id = obj.get("artboardId") if obj is not None else None
+            if artboard_id is None:
+                log.warning("operation %s on %s has no artboard; not persisted", op.id, op.object_id)
+                continue
+            by_artboard.setdefault(artboard_id, []).append(op)
+        for artboard_id, artboard_operations in by_artboard.items():
+            for step in steps:
+                await step(artboard_id, state, artboard_operations)
+    return persist
+
+
+def _random_object(rng, z, world):
+    return {"type": "rectangle", "x": round(rng.uniform(0, world), 2),
+            "y": round(rng.uniform(0, world), 2), "width": round(rng.uniform(10, 120), 2),
+            "height": round(rng.uniform(10, 120), 2), "fill": f"#{rng.randrange(1 << 24):06x}",
+            "stroke": "#000000", "strokeWidth": 1, "rotation": 0, "zIndex": z}
+
+
+async def _benchmark(sizes, flushes, ops_per_flush, world, seed):
+    from operational_transform import Operation
+
+    print(f"{'objects':>8} {'blob KB/flush':>14} {'docs KB/flush':>14} "
+          f"{'full read ms':>13} {'viewport read ms':>17} {'viewport objects':>17}")
+    for size in sizes:
+        rng = random.Random(seed)
+        objects = {f"obj-{i}": _random_object(rng, i, world) for i in range(size)}
+        store = ArtboardObjectStore()
+        await store.write("artboard-1", objects)
+        state = DocumentState.from_snapshot({"objects": objects})
+        collection = store.collection
+        collection.metrics.update(bytes_written=0, bytes_read=0)
+        persist = batcher_persist(store.persist_operations)
+
+        blob_bytes = 0
+        ids = list(objects)
+        for flush in range(flushes):
+            batch = []
+            for i in range(ops_per_flush):
+                object_id = rng.choice(ids)
+                obj = state.objects[object_id]
+                moved = {**obj, "x": round(obj["x"] + rng.uniform(-5, 5), 2)}
+                state = state.advance(state.objects.set(object_id, moved))
+                batch.append(Operation(f"op-{flush}-{i}", "update", object_id, {"x": moved["x"]},
+                                       "user-1", flush, "client-1", artboard_id="artboard-1"))
+            await persist("project-1", batch, state)
+            # What project.update({ objects }) writes for the same flush
+            blob_bytes += len(json.dumps(list(state.objects.to_dict().values()),
+                                         separators=(",", ":")))
+        docs_bytes = collection.metrics["bytes_written"]
+
+        start = time.perf_counter()
+        everything = await store.load("artboard-1")
+        full_ms = (time.perf_counter() - start) * 1e3
+        start = time.perf_counter()
+        visible = await store.load("artboard-1", (world / 2, world / 2, 375, 812))
+        viewport_ms = (time.perf_counter() - start) * 1e3
+        assert len(everything) == size
+
+        print(f"{size:8} {blob_bytes / flushes / 1024:14.1f} "
+              f"{docs_bytes / flushes / 1024:14.1f} {full_ms:13.1f} {viewport_ms:17.1f} "
+              f"{len(visible):17}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-object artboard storage")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 50_000])
+    parser.add_argument("--flushes", type=int, default=50)
+    parser.add_argument("--ops", type=int, default=20, help="operations per persisted flush")
+    parser.add_argument("--world", type=float, default=8192.0)
+    args = parser.parse_args()
+    asyncio.run(_benchmark(args.sizes, args.flushes, args.ops, args.world, seed=18))
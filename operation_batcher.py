@@ -0,0 +1,295 @@
+# Micro-batching stage for canvas:operation events
+#
+# SocketService.handleCanvasOperation does a permission lookup, an OT
+# transform, a broadcast and a project.update for every single event. Here
+# operations are queued per room and flushed once per window (16 ms by
+# default, or as soon as max_batch ops are waiting): one permission check
+# per distinct user in the batch, one pass through the OT engine, one
+# `canvas:operations` broadcast and one persistence write per flush. Batching
+# does not cut permission lookups by itself; authorize is wired to
+# PermissionCache.can_edit (permission_cache.py), so only its misses reach
+# the database.
+#
+# The transport and storage are injected so the same pipeline drives the
+# load tests and mirrors the Node service:
+#   authorize(user_id, project_id) -> awaitable bool (may edit?), e.g.
+#     PermissionCache(loader).can_edit
+#   broadcast(project_id, event, payload) -> awaitable or None
+#   persist(project_id, operations, state) -> awaitable; state is the room's
+#     DocumentState right after the flush, so a persist that runs after the
+#     room was released still writes what the flush produced
+#
+#   python operation_batcher.py   # 30 editors at 60 Hz, per-op vs batched
+import argparse
+import asyncio
+import functools
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+
+from document_state import DocumentState
+from operation_history import OperationHistory
+from permission_cache import Access, PermissionCache
+from operational_transform import Operation, OperationalTransformEngine, OperationBuffer
+
+log = logging.getLogger(__name__)
+
+
+class CollaborationRoom:
+    # Server-side state of one project room: recent ops for transforms, the
+    # bounded history and the current persistent document state
+    def __init__(self, project_id, state=None, buffer_size=1000):
+        self.project_id = project_id
+        self.engine = OperationalTransformEngine(OperationHistory())
+        self.buffer = OperationBuffer(max_size=buffer_size)
+        self.state = state or DocumentState()
+        self.last_activity = time.time()
+
+    def apply(self, op):
+        transformed = self.engine.transform_operation(op, self.buffer)
+        self.buffer.append(transformed)
+        self.state = self.engine.apply_operation(transformed, self.state)
+        self.last_activity = time.time()
+        return transformed
+
+
+class _RoomLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0  # holder plus waiters; the entry is dropped at zero
+
+
+class _PendingBatch:
+    __slots__ = ("items", "timer")
+
+    def __init__(self):
+        self.items = []
+        self.timer = None
+
+
+class OperationBatcher:
+    def __init__(self, authorize, broadcast, persist, window=0.016, max_batch=256,
+                 room_factory=CollaborationRoom):
+        self.authorize = authorize
+        self.broadcast = broadcast
+        self.persist = persist
+        self.window = window
+        self.max_batch = max_batch
+        self.room_factory = room_factory
+        self.rooms = {}
+        self._pending = {}
+        self._locks = {}
+        self._persisting = set()
+        self._flushing = {}  # project id -> flush tasks scheduled by the timer
+        self._persist_tails = {}  # project id -> its latest persist task
+        self.metrics = {"operations": 0, "batches": 0, "rejected": 0, "largest_batch": 0,
+                        "authorize_calls": 0, "persist_calls": 0}
+
+    def room(self, project_id):
+        room = self.rooms.get(project_id)
+        if room is None:
+            room = self.rooms[project_id] = self.room_factory(project_id)
+        return room
+
+    def submit(self, project_id, user_id, operation):
+        # Returns a future resolving to the transformed operation (the ack for
+        # the sender) or failing with PermissionError
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.get(project_id)
+        if batch is None:
+            batch = self._pending[project_id] = _PendingBatch()
+            batch.timer = loop.call_later(self.window, self._schedule_flush, project_id)
+        batch.items.append((user_id, operation, future))
+        if len(batch.items) >= self.max_batch:
+            batch.timer.cancel()
+            self._schedule_flush(project_id)
+        return future
+
+    def _schedule_flush(self, project_id):
+        batch = self._pending.pop(project_id, None)
+        if batch is not None:
+            task = asyncio.ensure_future(self._flush(project_id, batch.items))
+            self._flushing.setdefault(project_id, set()).add(task)
+            task.add_done_callback(functools.partial(self._flushed, project_id))
+            task.add_done_callback(self._log_failure)
+
+    def _flushed(self, project_id, task):
+        tasks = self._flushing.get(project_id)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self._flushing[project_id]
+
+    async def flush_all(self):
+        for project_id in list(self._pending):
+            batch = self._pending.pop(project_id)
+            batch.timer.cancel()
+            await self._flush(project_id, batch.items)
+        if self._persisting:
+            await asyncio.gather(*self._persisting, return_exceptions=True)
+
+    async def release(self, project_id):
+        # Flushes a room, waits for flushes in flight and returns the room
+        # (handoff to another replica, idle eviction); a later submit starts
+        # a fresh room
+        batch = self._pending.pop(project_id, None)
+        if batch is not None:
+            batch.timer.cancel()
+            await self._flush(project_id, batch.items)
+        # A timer flush that has not reached the room lock yet would
+        # otherwise recreate the room after it is popped
+        flushing = self._flushing.get(project_id)
+        if flushing:
+            await asyncio.wait(set(flushing))
+        async with self._room_lock(project_id):
+            room = self.rooms.pop(project_id, None)
+        tail = self._persist_tails.get(project_id)
+        if tail is not None:
+            await asyncio.wait((tail,))
+        return room
+
+    async def _flush(self, project_id, items):
+        # Flushes of one room are serialized so ops keep their arrival order
+        async with self._room_lock(project_id):
+            await self._process(project_id, items)
+
+    @asynccontextmanager
+    async def _room_lock(self, project_id):
+        # A room's lock lives while anyone holds or waits for it, so a flush
+        # racing release() never gets a second lock for the same room
+        entry = self._locks.get(project_id)
+        if entry is None:
+            entry = self._locks[project_id] = _RoomLock()
+        entry.users += 1
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            entry.users -= 1
+            if not entry.users:
+                del self._locks[project_id]
+
+    async def _process(self, project_id, items):
+        users = list(dict.fromkeys(user_id for user_id, _, _ in items))
+        self.metrics["authorize_calls"] += len(users)
+        results = await asyncio.gather(*(self.authorize(user_id, project_id) for user_id in users),
+                                       return_exceptions=True)
+        allowed = {user_id for user_id, ok in zip(users, results) if ok is True}
+
+        room = self.room(project_id)
+        applied = []
+        for user_id, operation, future in items:
+            if user_id not in allowed:
+                self.metrics["rejected"] += 1
+                if not future.done():
+                    future.set_exception(PermissionError("Insufficient permissions to edit project"))
+                continue
+            try:
+                transformed = room.apply(operation)
+            except Exception as error:  # one malformed op must not sink the batch
+                if not future.done():
+                    future.set_exception(error)
+                continue
+            applied.append((user_id, transformed))
+            if not future.done():
+                future.set_result(transformed)
+
+        self.metrics["batches"] += 1
+        self.metrics["operations"] += len(applied)
+        self.metrics["largest_batch"] = max(self.metrics["largest_batch"], len(items))
+        if not applied:
+            return
+
+        # One message for the whole batch; senders skip their own ops by clientId
+        result = self.broadcast(project_id, "canvas:operations", {
+            "operations": [{"operation": op.to_dict(), "userId": user_id} for user_id, op in applied],
+            "version": room.state.version,
+        })
+        if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+            await result
+
+        # Chained after the room's previous write, so flushes land in order
+        self.metrics["persist_calls"] += 1
+        task = asyncio.ensure_future(self._persist_after(
+            self._persist_tails.get(project_id), project_id, [op for _, op in applied], room.state))
+        self._persist_tails[project_id] = task
+        self._persisting.add(task)
+        task.add_done_callback(self._persisting.discard)
+        task.add_done_callback(functools.partial(self._persisted, project_id))
+        task.add_done_callback(self._log_failure)
+
+    async def _persist_after(self, previous, project_id, operations, state):
+        if previous is not None:
+            await asyncio.wait((previous,))  # its failure is logged on its own
+        await self.persist(project_id, operations, state)
+
+    def _persisted(self, project_id, task):
+        if self._persist_tails.get(project_id) is task:
+            del self._persist_tails[project_id]
+
+    @staticmethod
+    def _log_failure(task):
+        if not task.cancelled() and task.exception() is not None:
+            log.error("canvas operation pipeline failed", exc_info=task.exception())
+
+
+async def _simulate(editors, rate, seconds, window):
+    counts = {"broadcasts": 0, "persists": 0, "lookups": 0}
+
+    async def load_access(user_id, project_id):
+        counts["lookups"] += 1
+        await asyncio.sleep(0.001)  # a findUnique round trip
+        return Access("EDITOR", {})
+
+    def broadcast(project_id, event, payload):
+        counts["broadcasts"] += 1
+
+    async def persist(project_id, operations, state):
+        counts["persists"] += 1
+
+    # Drags and property edits on existing objects: the bulk of live traffic
+    objects = {f"obj-{i}": {"x": 0, "y": 0, "scaleX": 1, "scaleY": 1, "rotation": 0}
+               for i in range(500)}
+    batcher = OperationBatcher(PermissionCache(load_access).can_edit, broadcast, persist,
+                               window=window,
+                               room_factory=lambda project_id: CollaborationRoom(
+                                   project_id, DocumentState.from_snapshot({"objects": objects})))
+    rng = random.Random(11)
+    futures = []
+    start = time.perf_counter()
+    for _ in range(int(rate * seconds)):
+        for editor in range(editors):
+            if rng.random() < 0.7:
+                kind, data = "transform", {"transform": {"x": rng.uniform(-5, 5), "y": rng.uniform(-5, 5)}}
+            else:
+                kind, data = "update", {"fill": f"#{rng.randrange(1 << 24):06x}"}
+            op = Operation(f"op-{len(futures)}", kind, f"obj-{rng.randrange(500)}", data,
+                           f"user-{editor}", time.time(), f"client-{editor}")
+            futures.append(batcher.submit("project-1", op.user_id, op))
+        await asyncio.sleep(1 / rate)
+    await batcher.flush_all()
+    await asyncio.gather(*futures)
+    elapsed = time.perf_counter() - start
+    return len(futures), counts, batcher.metrics, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate batched canvas:operation handling")
+    parser.add_argument("--editors", type=int, default=30)
+    parser.add_argument("--rate", type=float, default=60.0, help="ops per second per editor")
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--window", type=float, default=0.016)
+    args = parser.parse_args()
+
+    ops, counts, metrics, elapsed = asyncio.run(
+        _simulate(args.editors, args.rate, args.seconds, args.window))
+    print(f"{ops} operations from {args.editors} editors in {elapsed:.2f}s")
+    print(f"  per-op handler: {ops} permission lookups, {ops} broadcasts, {ops} writes")
+    print(f"  batched:        {counts['lookups']} permission lookups "
+          f"({metrics['authorize_calls']} cached checks), "
+          f"{counts['broadcasts']} broadcasts, {counts['persists']} writes "
+          f"(largest batch {metrics['largest_batch']})")
@@ -0,0 +1,187 @@
+# Bounded, compacting operation history for the OT engine
+#
+# Replaces the unbounded operationHistory Map of OperationalTransformEngine.
+# Every applied op gets a room version. Clients acknowledge the versions they
+# have applied; everything at or below the lowest acknowledged version (the
+# watermark) is garbage-collected. While a slow client holds the watermark
+# back, runs of update/update or transform/transform ops on the same object
+# are folded into one op, except across a version some client is parked on
+# (replaying a merged additive transform to that client would double-apply).
+# If the history still outgrows max_entries, the oldest entries are dropped
+# down to LOW_WATER of max_entries (so the next full pass is that many ops
+# away) and the clients that needed them are flagged for a snapshot resync.
+#
+# Dependency checks stay O(1): live ids, ids folded into a merged op and a
+# bounded FIFO of recently collected ids are all dict/set lookups.
+import json
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from dataclasses import replace
+
+from operational_transform import compose_transforms
+
+COMPACTABLE = ("update", "transform")
+ENTRY_OVERHEAD = 160  # rough per-entry bookkeeping, in bytes
+LOW_WATER = 0.9       # fraction of max_entries kept after the bound is hit
+
+
+class _Entry:
+    __slots__ = ("version", "op", "aliases", "size")
+
+    def __init__(self, version, op, aliases, size):
+        self.version = version
+        self.op = op
+        self.aliases = aliases
+        self.size = size
+
+
+def _approx_size(op):
+    return ENTRY_OVERHEAD + len(json.dumps(op.data, default=str))
+
+
+def merge_operations(first, second):
+    # Folds two same-object ops of the same compactable type into one
+    if first.type == "update":
+        data = {**first.data, **second.data}
+    else:
+        data = {**first.data, **second.data,
+                "transform": compose_transforms(first.data.get("transform") or {},
+                                                 second.data.get("transform") or {})}
+    dependencies = list(dict.fromkeys([*first.dependencies, *second.dependencies]))
+    return replace(second, data=data, dependencies=dependencies)
+
+
+class OperationHistory:
+    def __init__(self, max_entries=10_000, tombstones=65_536):
+        self.max_entries = max_entries
+        self.low_water = int(max_entries * LOW_WATER)
+        self.version = 0
+        self._entries = OrderedDict()  # version -> _Entry, oldest first
+        self._ids = {}                 # op id (or folded alias) -> version
+        self._collected = set()
+        self._collected_order = deque()
+        self._tombstone_limit = tombstones
+        self._acks = {}                # client id -> last acknowledged version
+        self.needs_resync = set()
+        self.bytes = 0
+        self.collected_total = 0
+        self.compacted_total = 0
+        self.dropped_total = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, op_id):
+        return op_id in self._ids or op_id in self._collected
+
+    # Clients
+
+    def register_client(self, client_id, version=None):
+        self._acks[client_id] = self.version if version is None else version
+        self.needs_resync.discard(client_id)
+
+    def unregister_client(self, client_id):
+        self._acks.pop(client_id, None)
+        self.needs_resync.discard(client_id)
+        self.collect()
+
+    def acknowledge(self, client_id, version):
+        if version > self._acks.get(client_id, -1):
+            self._acks[client_id] = version
+            self.collect()
+
+    @property
+    def watermark(self):
+        return min(self._acks.values()) if self._acks else self.version
+
+    # Recording and reading
+
+    def record(self, op):
+        self.version += 1
+        entry = _Entry(self.version, op, [], _approx_size(op))
+        self._entries[self.version] = entry
+        self._ids[op.id] = self.version
+        self.bytes += entry.size
+        if len(self._entries) > self.max_entries:
+            self.collect()
+            self.compact()
+            self._enforce_bound()
+        return self.version
+
+    def get(self, op_id):
+        version = self._ids.get(op_id)
+        return self._entries[version].op if version is not None else None
+
+    def since(self, version):
+        # Ops a client at `version` still has to apply, oldest first
+        return [entry.op for v, entry in self._entries.items() if v > version]
+
+    # Reclaiming memory
+
+    def _forget(self, entry):
+        del self._entries[entry.version]
+        self.bytes -= entry.size
+        for op_id in (entry.op.id, *entry.aliases):
+            self._ids.pop(op_id, None)
+            self._collected.add(op_id)
+            self._collected_order.append(op_id)
+        while len(self._collected_order) > self._tombstone_limit:
+            self._collected.discard(self._collected_order.popleft())
+
+    def collect(self):
+        watermark = self.watermark
+        while self._entries:
+            version, entry = next(iter(self._entries.items()))
+            if version > watermark:
+                break
+            self._forget(entry)
+            self.collected_total += 1
+
+    def compact(self):
+        boundaries = sorted(self._acks.values())
+        last_by_object = {}
+        for version in list(self._entries):
+            entry = self._entries[version]
+            op = entry.op
+            previous = last_by_object.get(op.object_id)
+            last_by_object[op.object_id] = entry
+            if previous is None or op.type not in COMPACTABLE or previous.op.type != op.type:
+                continue
+            # A client acknowledged a version inside [previous, entry): keep both
+            i = bisect_left(boundaries, previous.version)
+            if i < len(boundaries) and boundaries[i] < version:
+                continue
+            merged = merge_operations(previous.op, op)
+            entry.op = merged
+            entry.aliases.extend([previous.op.id, *previous.aliases])
+            for op_id in (previous.op.id, *previous.aliases):
+                self._ids[op_id] = version
+            self.bytes -= entry.size + previous.size
+            entry.size = _approx_size(merged) + len(entry.aliases) * 48
+            self.bytes += entry.size
+            del self._entries[previous.version]
+            self.compacted_total += 1
+
+    def _enforce_bound(self):
+        while len(self._entries) > self.low_water:
+            version, entry = next(iter(self._entries.items()))
+            self._forget(entry)
+            self.dropped_total += 1
+            for client_id, acked in self._acks.items():
+                if acked < version:
+                    self.needs_resync.add(client_id)
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "watermark": self.watermark,
+            "entries": len(self._entries),
+            "ids": len(self._ids),
+            "tombstones": len(self._collected),
+            "bytes": self.bytes,
+            "collected": self.collected_total,
+            "compacted": self.compacted_total,
+            "dropped": self.dropped_total,
+            "clients": len(self._acks),
+            "needs_resync": len(self.needs_resync),
+        }
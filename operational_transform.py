@@ -0,0 +1,283 @@
+# Python reference implementation of packages/backend/src/services/OperationalTransform.ts
+#
+# Mirrors OperationalTransformEngine from core-implementation.md so it can act
+# as a conformance oracle and load-test driver for the Node service. Instead of
+# filtering every buffered op on every incoming op, rooms keep an
+# OperationBuffer indexed per objectId and ordered by timestamp: transforming an
+# op touches only the ops on the same object that precede it.
+#
+#   python operational_transform.py            # scaling benchmark up to 100k ops
+import argparse
+import random
+import time
+from bisect import bisect_left, insort
+from collections import deque
+from dataclasses import dataclass, field, replace
+
+from document_state import DocumentState
+
+OP_TYPES = ("create", "update", "delete", "transform", "noop")
+
+
+@dataclass
+class Operation:
+    id: str
+    type: str
+    object_id: str
+    data: dict
+    user_id: str
+    timestamp: float
+    client_id: str
+    dependencies: list = field(default_factory=list)
+    artboard_id: str = None
+
+    @classmethod
+    def from_dict(cls, raw):
+        # Accepts the wire shape of the TypeScript Operation interface
+        return cls(
+            id=raw["id"],
+            type=raw["type"],
+            object_id=raw["objectId"],
+            data=raw.get("data"),
+            user_id=raw["userId"],
+            timestamp=raw["timestamp"],
+            client_id=raw["clientId"],
+            dependencies=list(raw.get("dependencies") or []),
+            artboard_id=raw.get("artboardId"),
+        )
+
+    def to_dict(self):
+        raw = {
+            "id": self.id,
+            "type": self.type,
+            "objectId": self.object_id,
+            "data": self.data,
+            "userId": self.user_id,
+            "timestamp": self.timestamp,
+            "clientId": self.client_id,
+        }
+        if self.dependencies:
+            raw["dependencies"] = list(self.dependencies)
+        if self.artboard_id is not None:
+            raw["artboardId"] = self.artboard_id
+        return raw
+
+
+class OperationBuffer:
+    # A room's recent operations (room.operations in SocketService), capped at
+    # max_size like the TS `slice(-1000)`, with a per-object timestamp index
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._order = deque()
+        self._by_object = {}
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        return (entry[2] for entry in self._order)
+
+    def append(self, op):
+        entry = (op.timestamp, self._seq, op)
+        self._seq += 1
+        self._order.append(entry)
+        insort(self._by_object.setdefault(op.object_id, []), entry, key=lambda e: e[:2])
+        while len(self._order) > self.max_size:
+            self._evict(self._order.popleft())
+
+    def _evict(self, entry):
+        entries = self._by_object[entry[2].object_id]
+        del entries[bisect_left(entries, entry[:2], key=lambda e: e[:2])]
+        if not entries:
+            del self._by_object[entry[2].object_id]
+
+    def conflicting(self, incoming):
+        # Same object, strictly earlier, other client; returned in arrival
+        # order, which is the order the TS filter() would yield them in
+        entries = self._by_object.get(incoming.object_id)
+        if not entries:
+            return []
+        end = bisect_left(entries, incoming.timestamp, key=lambda e: e[0])
+        found = [e for e in entries[:end] if e[2].client_id != incoming.client_id]
+        found.sort(key=lambda e: e[1])
+        return [e[2] for e in found]
+
+
+def _linear_conflicting(incoming, concurrent_ops):
+    return [op for op in concurrent_ops
+            if op.object_id == incoming.object_id
+            and op.timestamp < incoming.timestamp
+            and op.client_id != incoming.client_id]
+
+
+def compose_transforms(t1, t2):
+    return {
+        "x": (t1.get("x") or 0) + (t2.get("x") or 0),
+        "y": (t1.get("y") or 0) + (t2.get("y") or 0),
+        "scaleX": (t1.get("scaleX") or 1) * (t2.get("scaleX") or 1),
+        "scaleY": (t1.get("scaleY") or 1) * (t2.get("scaleY") or 1),
+        "rotation": (t1.get("rotation") or 0) + (t2.get("rotation") or 0),
+        "skewX": (t1.get("skewX") or 0) + (t2.get("skewX") or 0),
+        "skewY": (t1.get("skewY") or 0) + (t2.get("skewY") or 0),
+    }
+
+
+class OperationalTransformEngine:
+    def __init__(self, history=None):
+        from operation_history import OperationHistory
+
+        self.history = history if history is not None else OperationHistory()
+
+    def transform_operation(self, incoming, concurrent_ops):
+        if isinstance(concurrent_ops, OperationBuffer):
+            conflicting = concurrent_ops.conflicting(incoming)
+        else:
+            conflicting = _linear_conflicting(incoming, concurrent_ops)
+
+        transformed = incoming
+        for against in conflicting:
+            transformed = self.transform_against_operation(transformed, against)
+        return transformed
+
+    def transform_against_operation(self, op, against):
+        handler = {
+            ("update", "update"): self._transform_update_update,
+            ("update", "delete"): self._transform_update_delete,
+            ("delete", "update"): self._transform_delete_update,
+            ("transform", "transform"): self._transform_transform_transform,
+            ("create", "create"): self._transform_create_create,
+        }.get((op.type, against.type))
+        return handler(op, against) if handler else op
+
+    def _depends(self, op, against, **changes):
+        return replace(op, dependencies=[*op.dependencies, against.id], **changes)
+
+    def _transform_update_update(self, op, against):
+        # Later timestamp wins for properties both ops touch
+        merged = dict(against.data)
+        for key, value in op.data.items():
+            if key not in against.data or op.timestamp > against.timestamp:
+                merged[key] = value
+        return self._depends(op, against, data=merged)
+
+    def _transform_update_delete(self, op, against):
+        return self._depends(op, against, type="noop", data=None)
+
+    def _transform_delete_update(self, op, against):
+        return self._depends(op, against)
+
+    def _transform_transform_transform(self, op, against):
+        composed = compose_transforms(against.data.get("transform") or {},
+                                      op.data.get("transform") or {})
+        return self._depends(op, against, data={**op.data, "transform": composed})
+
+    def _transform_create_create(self, op, against):
+        if op.data.get("x") == against.data.get("x") and op.data.get("y") == against.data.get("y"):
+            return self._depends(op, against, data={**op.data, "x": op.data["x"] + 10,
+                                                    "y": op.data["y"] + 10})
+        return op
+
+    def can_apply_operation(self, op, current_state):
+        for dep_id in op.dependencies:
+            if dep_id not in self.history:
+                return False
+        exists = op.object_id in _as_state(current_state).objects
+        if op.type in ("update", "delete") and not exists:
+            return False
+        if op.type == "create" and exists:
+            return False
+        return True
+
+    def apply_operation(self, op, current_state):
+        # Returns a new DocumentState; current_state is left untouched and
+        # shares every trie node the op did not touch
+        state = _as_state(current_state)
+        objects = state.objects
+        obj = objects.get(op.object_id)
+
+        if op.type == "create":
+            objects = objects.set(op.object_id, op.data)
+        elif op.type == "update":
+            if obj is not None:
+                objects = objects.set(op.object_id, {**obj, **op.data})
+        elif op.type == "delete":
+            objects = objects.delete(op.object_id)
+        elif op.type == "transform":
+            if obj is not None:
+                transform = op.data["transform"]
+                objects = objects.set(op.object_id, {
+                    **obj,
+                    "x": obj["x"] + (transform.get("x") or 0),
+                    "y": obj["y"] + (transform.get("y") or 0),
+                    "scaleX": obj["scaleX"] * (transform.get("scaleX") or 1),
+                    "scaleY": obj["scaleY"] * (transform.get("scaleY") or 1),
+                    "rotation": obj["rotation"] + (transform.get("rotation") or 0),
+                })
+
+        self.history.record(op)
+        return state.advance(objects)
+
+
+def _as_state(state):
+    # Plain {"objects": {...}} dicts (the TS state shape) are converted once
+    if isinstance(state, DocumentState):
+        return state
+    return DocumentState.from_snapshot(state)
+
+
+def random_operation(rng, seq, num_objects, num_clients, timestamp):
+    kind = rng.choice(("update", "update", "transform", "create", "delete"))
+    if kind == "transform":
+        data = {"transform": {"x": rng.uniform(-5, 5), "y": rng.uniform(-5, 5)}}
+    elif kind == "create":
+        data = {"x": rng.randrange(0, 400, 10), "y": rng.randrange(0, 800, 10)}
+    elif kind == "update":
+        data = {rng.choice(("fill", "stroke", "opacity")): rng.random()}
+    else:
+        data = {}
+    client = rng.randrange(num_clients)
+    return Operation(
+        id=f"op-{seq}",
+        type=kind,
+        object_id=f"obj-{rng.randrange(num_objects)}",
+        data=data,
+        user_id=f"user-{client}",
+        timestamp=timestamp,
+        client_id=f"client-{client}",
+    )
+
+
+def benchmark(sizes=(1_000, 10_000, 100_000), incoming=2_000, linear_limit=10_000, seed=7):
+    print(f"{'buffered':>9} {'objects':>8} {'indexed us/op':>14} {'linear us/op':>13}")
+    for size in sizes:
+        rng = random.Random(seed)
+        num_objects = max(100, size // 50)
+        buffer = OperationBuffer(max_size=size)
+        for seq in range(size):
+            buffer.append(random_operation(rng, seq, num_objects, 30, seq))
+        ops = [random_operation(rng, size + i, num_objects, 30, size + rng.random() * -size)
+               for i in range(incoming)]
+
+        engine = OperationalTransformEngine()
+        start = time.perf_counter()
+        indexed = [engine.transform_operation(op, buffer) for op in ops]
+        indexed_us = (time.perf_counter() - start) / incoming * 1e6
+
+        linear = "-"
+        if size <= linear_limit:
+            flat = list(buffer)
+            start = time.perf_counter()
+            expected = [engine.transform_operation(op, flat) for op in ops]
+            linear = f"{(time.perf_counter() - start) / incoming * 1e6:13.1f}"
+            assert expected == indexed, "indexed lookup diverged from the linear reference"
+        print(f"{size:9} {num_objects:8} {indexed_us:14.1f} {linear:>13}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark indexed OT conflict lookup")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--incoming", type=int, default=2_000)
+    args = parser.parse_args()
+    benchmark(tuple(args.sizes), args.incoming)
@@ -0,0 +1,227 @@
+# Permission cache for the collaboration hot path
+#
+# handleCanvasOperation and handleProjectJoin call
+# prisma.collaboration.findUnique for every event. PermissionCache keeps
+# (userId, projectId) -> (role, permissions) in process, with a TTL, a short
+# negative TTL for "no access", and an LRU bound. A miss first tries the
+# shared Redis (the `redis` service in deployment_configs' compose file) and
+# only then the loader, and concurrent misses for one key share one load.
+#
+# Role changes must call invalidate()/invalidate_project(): the entry is
+# dropped here and in Redis, and the key is published on INVALIDATION_CHANNEL
+# so other replicas drop their local copy (wire their subscriber to
+# handle_invalidation). A load that races an invalidation is not cached.
+#
+# redis is any asyncio client with get/setex/delete/publish, e.g.
+# redis.asyncio.Redis.from_url(REDIS_URL); None keeps the cache process-local.
+#
+#   python permission_cache.py    # cached check vs. a simulated DB round trip
+import argparse
+import asyncio
+import json
+import time
+from collections import OrderedDict, namedtuple
+
+EDIT_ROLES = ("OWNER", "EDITOR")
+KEY_PREFIX = "perm"
+INVALIDATION_CHANNEL = "perm:invalidate"
+
+Access = namedtuple("Access", "role permissions")
+
+_NO_ACCESS = Access(None, {})
+
+
+def redis_key(user_id, project_id):
+    return f"{KEY_PREFIX}:{project_id}:{user_id}"
+
+
+class PermissionCache:
+    def __init__(self, loader, redis=None, ttl=60.0, negative_ttl=5.0, max_entries=100_000,
+                 clock=time.monotonic):
+        # loader(user_id, project_id) -> awaitable Access, or None for no access
+        self.loader = loader
+        self.redis = redis
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()  # (user, project) -> (expires, Access)
+        self._by_project = {}          # project -> {user}
+        self._generation = {}          # (user, project) -> invalidations during its load
+        self._loading = {}             # (user, project) -> Future
+        self.metrics = {"hits": 0, "misses": 0, "redis_hits": 0, "loads": 0,
+                        "coalesced": 0, "invalidations": 0, "evictions": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        total = self.metrics["hits"] + self.metrics["misses"]
+        return self.metrics["hits"] / total if total else 0.0
+
+    # Lookups
+
+    def peek(self, user_id, project_id):
+        # Synchronous fast path: the cached Access, or None when absent/expired
+        key = (user_id, project_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= self.clock():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    async def get(self, user_id, project_id):
+        # Access for the pair; role is None when the user has no collaboration
+        access = self.peek(user_id, project_id)
+        if access is not None:
+            self.metrics["hits"] += 1
+            return access
+        self.metrics["misses"] += 1
+
+        key = (user_id, project_id)
+        pending = self._loading.get(key)
+        if pending is not None:
+            self.metrics["coalesced"] += 1
+        else:
+            # A task of its own, so cancelling whichever caller started it
+            # leaves the load running for the others
+            pending = self._loading[key] = asyncio.ensure_future(self._load(key))
+            pending.add_done_callback(_retrieve)
+        return await asyncio.shield(pending)
+
+    async def _load(self, key):
+        try:
+            access = await self._fetch(*key)
+        finally:
+            del self._loading[key]
+            invalidated = self._generation.pop(key, 0)
+        if not invalidated:
+            self._store(key, access)
+        return access
+
+    async def can_edit(self, user_id, project_id):
+        # Drop-in authorize() for OperationBatcher
+        return (await self.get(user_id, project_id)).role in EDIT_ROLES
+
+    async def can_view(self, user_id, project_id):
+        return (await self.get(user_id, project_id)).role is not None
+
+    async def _fetch(self, user_id, project_id):
+        if self.redis is not None:
+            raw = await self.redis.get(redis_key(user_id, project_id))
+            if raw is not None:
+                self.metrics["redis_hits"] += 1
+                role, permissions = json.loads(raw)
+                return Access(role, permissions)
+        self.metrics["loads"] += 1
+        access = await self.loader(user_id, project_id) or _NO_ACCESS
+        # An invalidate() during the load has already deleted the Redis key;
+        # writing this result back would restore the revoked role
+        if self.redis is not None and not self._generation.get((user_id, project_id)):
+            ttl = self.ttl if access.role is not None else self.negative_ttl
+            await self.redis.setex(redis_key(user_id, project_id), max(1, round(ttl)),
+                                   json.dumps([access.role, access.permissions]))
+        return access
+
+    def _store(self, key, access):
+        ttl = self.ttl if access.role is not None else self.negative_ttl
+        self._entries[key] = (self.clock() + ttl, access)
+        self._entries.move_to_end(key)
+        self._by_project.setdefault(key[1], set()).add(key[0])
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+            self.metrics["evictions"] += 1
+
+    def _drop(self, key):
+        if self._entries.pop(key, None) is None:
+            return
+        users = self._by_project.get(key[1])
+        if users is not None:
+            users.discard(key[0])
+            if not users:
+                del self._by_project[key[1]]
+
+    # Invalidation
+
+    def _forget(self, user_id, project_id):
+        key = (user_id, project_id)
+        if key in self._loading:
+            self._generation[key] = self._generation.get(key, 0) + 1
+        self._drop(key)
+        self.metrics["invalidations"] += 1
+
+    def _forget_project(self, project_id):
+        users = set(self._by_project.get(project_id, ()))
+        users.update(u for u, p in self._loading if p == project_id)
+        for user_id in users:
+            self._forget(user_id, project_id)
+        return users
+
+    async def invalidate(self, user_id, project_id):
+        # Call after a Collaboration row is created, updated or deleted
+        self._forget(user_id, project_id)
+        if self.redis is not None:
+            await self.redis.delete(redis_key(user_id, project_id))
+            await self.redis.publish(INVALIDATION_CHANNEL,
+                                     json.dumps({"projectId": project_id, "userId": user_id}))
+
+    async def invalidate_project(self, project_id, user_ids=()):
+        # Project deleted or ownership moved; user_ids adds rows unknown locally
+        users = self._forget_project(project_id) | set(user_ids)
+        if self.redis is not None:
+            if users:
+                await self.redis.delete(*(redis_key(u, project_id) for u in users))
+            await self.redis.publish(INVALIDATION_CHANNEL, json.dumps({"projectId": project_id}))
+
+    def handle_invalidation(self, message):
+        # Subscriber callback for INVALIDATION_CHANNEL messages from other replicas
+        payload = json.loads(message)
+        if payload.get("userId") is None:
+            self._forget_project(payload["projectId"])
+        else:
+            self._forget(payload["userId"], payload["projectId"])
+
+
+def _retrieve(task):
+    # Callers re-raise a failed load; this keeps an unawaited one quiet
+    if not task.cancelled():
+        task.exception()
+
+
+async def _benchmark(users, projects, checks, db_latency):
+    async def loader(user_id, project_id):
+        await asyncio.sleep(db_latency)
+        return Access("EDITOR", {})
+
+    cache = PermissionCache(loader)
+    pairs = [(f"user-{u}", f"project-{p}") for u in range(users) for p in range(projects)]
+    start = time.perf_counter()
+    for user_id, project_id in pairs:
+        await cache.can_edit(user_id, project_id)
+    cold = (time.perf_counter() - start) / len(pairs)
+
+    start = time.perf_counter()
+    for i in range(checks):
+        user_id, project_id = pairs[i % len(pairs)]
+        await cache.can_edit(user_id, project_id)
+    warm = (time.perf_counter() - start) / checks
+    return cold, warm, cache
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the permission cache")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--projects", type=int, default=20)
+    parser.add_argument("--checks", type=int, default=200_000)
+    parser.add_argument("--db-latency", type=float, default=0.002, help="seconds per findUnique")
+    args = parser.parse_args()
+
+    cold, warm, cache = asyncio.run(_benchmark(args.users, args.projects, args.checks,
+                                               args.db_latency))
+    print(f"miss (loader round trip): {cold * 1e6:9.1f} us/check")
+    print(f"hit  (in-process cache):  {warm * 1e6:9.1f} us/check")
+    print(f"hit rate {cache.hit_rate:.1%}, {cache.metrics}")
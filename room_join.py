@@ -0,0 +1,371 @@
+# Room joins as a streamed snapshot plus op tail
+#
+# SocketService.handleProjectJoin awaits the access check, a session.create
+# and a full project load before emitting one `project:state` message with
+# every artboard and object in it, so a designer opening a large file stares
+# at an empty canvas for as long as the whole document takes to load, encode
+# and download. Here the join pins the room's current DocumentState (an O(1)
+# reference to an immutable trie, see document_state.py) and streams it:
+#
+#   project:snapshot-begin   version V, object count, the active artboard
+#   project:snapshot-chunk   deflated JSON objects; the ones inside the
+#                            client's viewport first, then the rest of the
+#                            active artboard, then the other artboards
+#   project:snapshot-end     V again, chunk and object totals
+#   canvas:operations        the batches broadcast after V was pinned
+#
+# The first paint only needs the begin message and the visible chunks, found
+# through a per-artboard SpatialIndex, so its cost is set by the viewport and
+# not by the size of the project. The Session row is written in the
+# background after that first paint. Batches that the OperationBatcher
+# broadcasts while the snapshot is on the wire are buffered for the joining
+# socket and replayed after snapshot-end; the socket joins the room
+# synchronously once that buffer drains, so it neither misses a batch nor
+# sees one twice.
+#
+#   python room_join.py   # 1k..100k objects: first paint vs. one project:state
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import time
+import zlib
+
+from document_state import DocumentState
+from operation_batcher import CollaborationRoom, OperationBatcher
+from operational_transform import Operation, OperationalTransformEngine
+from operation_history import OperationHistory
+from spatial_index import SpatialIndex, bounds_of
+
+log = logging.getLogger(__name__)
+
+CHUNK_OBJECTS = 500  # objects per snapshot chunk
+COMPRESSION_LEVEL = 6
+
+
+class IndexedRoom(CollaborationRoom):
+    # CollaborationRoom that keeps a SpatialIndex per artboard in step with
+    # its state, so a join can find the objects in a viewport without a scan.
+    # Objects without an artboardId are indexed under None.
+    def __init__(self, project_id, state=None, buffer_size=1000):
+        super().__init__(project_id, state, buffer_size)
+        self.indexes = {}
+        self._artboard_of = {}
+        for object_id, obj in self.state.objects.items():
+            self._index(object_id, obj)
+
+    def apply(self, op):
+        transformed = super().apply(op)
+        self._index(transformed.object_id, self.state.objects.get(transformed.object_id))
+        return transformed
+
+    def _index(self, object_id, obj):
+        previous = self._artboard_of.get(object_id, _MISSING)
+        artboard_id = _MISSING if obj is None else obj.get("artboardId")
+        if previous is not _MISSING and previous != artboard_id:
+            self.indexes[previous].remove(object_id)
+            del self._artboard_of[object_id]
+        if artboard_id is _MISSING:
+            return
+        index = self.indexes.get(artboard_id)
+        if index is None:
+            index = self.indexes[artboard_id] = SpatialIndex(-32768.0, -32768.0, 65536.0, max_depth=12)
+        index.insert(object_id, bounds_of(obj), obj.get("zIndex", 0))
+        self._artboard_of[object_id] = artboard_id
+
+    def visible(self, artboard_id, viewport):
+        # Ids on the artboard intersecting viewport {x, y, width, height},
+        # bottom-most first so chunks arrive in paint order
+        index = self.indexes.get(artboard_id)
+        if index is None or viewport is None:
+            return []
+        x, y = viewport["x"], viewport["y"]
+        ids = index.query_rect(x, y, x + viewport["width"], y + viewport["height"])
+        ids.reverse()
+        return ids
+
+
+_MISSING = object()
+
+
+class _Join:
+    __slots__ = ("buffered",)
+
+    def __init__(self):
+        self.buffered = []
+
+
+class JoinStreamer:
+    # send(event, payload) -> awaitable; it stands in for socket.emit and is
+    # awaited, so a slow socket paces the stream instead of queueing it all
+    def __init__(self, chunk_objects=CHUNK_OBJECTS, level=COMPRESSION_LEVEL):
+        self.chunk_objects = chunk_objects
+        self.level = level
+        self._joining = {}
+        self._background = set()
+        self.metrics = {"joins": 0, "chunks": 0, "objects": 0, "bytes": 0, "replayed_batches": 0}
+
+    def wrap_broadcast(self, broadcast):
+        # Passed to OperationBatcher in place of broadcast: every batch is
+        # also buffered for the sockets still receiving a snapshot
+        def tee(project_id, event, payload):
+            if event == "canvas:operations":
+                for join in self._joining.get(project_id, ()):
+                    join.buffered.append(payload)
+            return broadcast(project_id, event, payload)
+        return tee
+
+    async def join(self, room, send, artboard_id=None, viewport=None, go_live=None,
+                   on_first_paint=None):
+        # Streams room to one socket. go_live() adds the socket to the room's
+        # broadcasts and must not await; on_first_paint() (the Session write)
+        # runs in the background once the visible objects are out.
+        # Returns the snapshot version.
+        join = _Join()
+        joining = self._joining.setdefault(room.project_id, [])
+        joining.append(join)
+        self.metrics["joins"] += 1
+        try:
+            # Pinned in the same step as the registration above: batches up
+            # to V are in the snapshot, every later one lands in the buffer
+            state = room.state
+            version = state.version
+            visible = room.visible(artboard_id, viewport)
+            await send("project:snapshot-begin", {
+                "version": version,
+                "artboardId": artboard_id,
+                "objectCount": len(state.objects),
+                "visibleCount": len(visible),
+            })
+
+            counts = {"chunks": 0, "objects": 0}
+            objects = state.objects
+            sent = set(visible)
+            await self._send_chunks(send, counts, artboard_id, "visible",
+                                    [objects[object_id] for object_id in visible])
+            if on_first_paint is not None:
+                task = asyncio.ensure_future(on_first_paint())
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+                task.add_done_callback(_log_failure)
+
+            # The rest, from the pinned trie: the active artboard, then the
+            # others grouped by artboard
+            others = {}
+            active = []
+            for object_id, obj in objects.items():
+                if object_id in sent:
+                    continue
+                board = obj.get("artboardId")
+                if board == artboard_id:
+                    active.append(obj)
+                    if len(active) == self.chunk_objects:
+                        await self._send_chunks(send, counts, artboard_id, "artboard", active)
+                        active = []
+                else:
+                    others.setdefault(board, []).append(obj)
+            await self._send_chunks(send, counts, artboard_id, "artboard", active)
+            for board, board_objects in others.items():
+                await self._send_chunks(send, counts, board, "project", board_objects)
+
+            await send("project:snapshot-end", {"version": version, **counts})
+
+            # Tail: replay what was broadcast meanwhile until nothing is left,
+            # then hand over to the room without yielding in between
+            while join.buffered:
+                batches, join.buffered = join.buffered, []
+                for payload in batches:
+                    if payload["version"] > version:
+                        self.metrics["replayed_batches"] += 1
+                        await send("canvas:operations", payload)
+            if go_live is not None:
+                go_live()
+            return version
+        finally:
+            joining.remove(join)
+            if not joining:
+                del self._joining[room.project_id]
+
+    async def _send_chunks(self, send, counts, artboard_id, phase, objects):
+        for start in range(0, len(objects), self.chunk_objects):
+            batch = objects[start:start + self.chunk_objects]
+            data = zlib.compress(json.dumps(batch, separators=(",", ":")).encode(), self.level)
+            await send("project:snapshot-chunk", {
+                "seq": counts["chunks"],
+                "artboardId": artboard_id,
+                "phase": phase,
+                "encoding": "deflate",
+                "data": data,
+            })
+            counts["chunks"] += 1
+            counts["objects"] += len(batch)
+            self.metrics["chunks"] += 1
+            self.metrics["objects"] += len(batch)
+            self.metrics["bytes"] += len(data)
+
+    async def close(self):
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+
+
+def _log_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        log.error("join background task failed", exc_info=task.exception())
+
+
+class _Client:
+    # What the browser does with the stream: decode chunks into a map,
+    # apply the tail and the live batches on top, and note the first paint
+    def __init__(self, bandwidth, started):
+        self.bandwidth = bandwidth
+        self.started = started
+        self.objects = {}
+        self.version = None
+        self.first_paint = None
+        self.bytes = 0
+        self.visible_count = self._visible = 0
+        self._engine = OperationalTransformEngine(OperationHistory())
+        self._state = None
+
+    async def receive(self, event, payload):
+        size = len(payload["data"]) if "data" in payload else len(json.dumps(payload))
+        self.bytes += size
+        await asyncio.sleep(size / self.bandwidth)
+        if event == "project:snapshot-begin":
+            self.visible_count = self._visible = payload["visibleCount"]
+        elif event == "project:snapshot-chunk":
+            chunk = json.loads(zlib.decompress(payload["data"]))
+            for obj in chunk:
+                self.objects[obj["id"]] = obj
+            if payload["phase"] == "visible":
+                self._visible -= len(chunk)
+        elif event == "project:snapshot-end":
+            self.version = payload["version"]
+            self._state = DocumentState.from_snapshot({"objects": self.objects,
+                                                       "version": self.version})
+        elif event == "canvas:operations":
+            if payload["version"] <= self.version:
+                return
+            for entry in payload["operations"]:
+                op = Operation.from_dict(entry["operation"])
+                self._state = self._engine.apply_operation(op, self._state)
+            self.version = payload["version"]
+        if self.first_paint is None and self._visible <= 0 and event != "canvas:operations":
+            self.first_paint = time.perf_counter() - self.started
+
+    def state(self):
+        return self._state.objects.to_dict()
+
+
+def _project(rng, count, artboards, world):
+    objects = {}
+    for i in range(count):
+        x, y = rng.uniform(0, world), rng.uniform(0, world)
+        size = rng.expovariate(1 / 40) + 4
+        objects[f"obj-{i}"] = {
+            "id": f"obj-{i}", "type": "rectangle", "artboardId": f"artboard-{i % artboards}",
+            "x": x, "y": y, "width": size, "height": size * rng.uniform(0.5, 2),
+            "scaleX": 1, "scaleY": 1, "rotation": 0, "zIndex": i,
+            "fill": f"#{rng.randrange(1 << 24):06x}", "stroke": "#000000", "strokeWidth": 1,
+            "name": f"Layer {i}",
+        }
+    return objects
+
+
+async def _run(count, artboards, spacing, bandwidth, editors, seed):
+    # Artboards grow with the project at a fixed density, as real files do
+    rng = random.Random(seed)
+    world = spacing * math.sqrt(count / artboards)
+    objects = _project(rng, count, artboards, world)
+    live = {}
+
+    def broadcast(project_id, event, payload):
+        for client in live.values():
+            client.append(payload)
+
+    async def authorize(user_id, project_id):
+        return True
+
+    async def persist(project_id, operations, state):
+        pass
+
+    streamer = JoinStreamer()
+    batcher = OperationBatcher(authorize, streamer.wrap_broadcast(broadcast), persist,
+                               room_factory=lambda project_id: IndexedRoom(
+                                   project_id, DocumentState.from_snapshot({"objects": objects})))
+    room = batcher.room("project-1")
+
+    # Baseline: one project:state message with every object, as today
+    start = time.perf_counter()
+    full = json.dumps(list(objects.values()), separators=(",", ":")).encode()
+    full_seconds = time.perf_counter() - start + len(full) / bandwidth
+
+    # Editors keep moving objects while the snapshot streams
+    stop = asyncio.Event()
+
+    async def edit(editor):
+        seq = 0
+        while not stop.is_set():
+            object_id = f"obj-{rng.randrange(count)}"
+            op = Operation(f"op-{editor}-{seq}", "transform", object_id,
+                           {"transform": {"x": rng.uniform(-20, 20), "y": rng.uniform(-20, 20)}},
+                           f"user-{editor}", time.time(), f"client-{editor}")
+            seq += 1
+            await batcher.submit("project-1", op.user_id, op)
+            await asyncio.sleep(1 / 60)
+
+    tasks = [asyncio.ensure_future(edit(editor)) for editor in range(editors)]
+    await asyncio.sleep(0.05)
+
+    started = time.perf_counter()
+    client = _Client(bandwidth, started)
+    pending = []
+    session = {}
+
+    async def write_session():
+        await asyncio.sleep(0.02)  # session.create round trip
+        session["written"] = time.perf_counter() - started
+
+    def go_live():
+        live["client"] = pending
+
+    viewport = {"x": (world - 1440) / 2, "y": (world - 900) / 2, "width": 1440, "height": 900}
+    await streamer.join(room, client.receive, "artboard-0", viewport, go_live, write_session)
+    complete = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*tasks)
+    await batcher.flush_all()
+    for payload in pending:
+        await client.receive("canvas:operations", payload)
+    await streamer.close()
+
+    assert client.state() == room.state.objects.to_dict(), "client diverged from the room"
+    return {
+        "first_paint": client.first_paint, "visible": client.visible_count, "complete": complete, "bytes": client.bytes,
+        "full_seconds": full_seconds, "full_bytes": len(full), "session": session.get("written"),
+        "replayed": streamer.metrics["replayed_batches"], "live": len(pending),
+    }
+
+
+def benchmark(sizes=(1_000, 10_000, 100_000), artboards=4, spacing=150.0, bandwidth=5e6,
+              editors=5, seed=21):
+    print(f"link {bandwidth / 1e6:.0f} MB/s, {editors} editors moving objects during the join")
+    for count in sizes:
+        result = asyncio.run(_run(count, artboards, spacing, bandwidth, editors, seed))
+        print(f"{count:>7} objects: first paint {result['first_paint'] * 1000:5.1f} ms "
+              f"({result['visible']} visible), complete {result['complete']:6.2f}s, {result['bytes'] / 1e6:6.2f} MB "
+              f"| project:state {result['full_seconds']:6.2f}s, {result['full_bytes'] / 1e6:6.2f} MB "
+              f"| session row at {result['session'] * 1000:.0f} ms, "
+              f"{result['replayed']} tail + {result['live']} live batches, state matches")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streamed room joins vs. one project:state message")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--artboards", type=int, default=4)
+    parser.add_argument("--bandwidth", type=float, default=5e6, help="bytes per second to the client")
+    parser.add_argument("--editors", type=int, default=5)
+    args = parser.parse_args()
+    benchmark(args.sizes, args.artboards, bandwidth=args.bandwidth, editors=args.editors)
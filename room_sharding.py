@@ -0,0 +1,638 @@
+# Room sharding across backend replicas
+#
+# SocketService.rooms is an in-process Map, so two users of one project who
+# land on backend-1 and backend-2 never see each other's operations. Here
+# every project has exactly one owner replica, picked by a consistent-hash
+# ring over the live INSTANCE_IDs. The owner runs the room (OT state and the
+# OperationBatcher); every other replica is only an edge for its sockets:
+#
+#   edge --publish node:{owner}--> owner --publish room:{projectId}--> edges
+#
+# Edges forward canvas operations to the owner's inbox channel and subscribe
+# to the room's fan-out channel while they have sockets in it. nginx spreads
+# sockets with least_conn and one socket serves several projects, so with n
+# replicas only about 1/n of a room's operations start on its owner.
+#
+# This module is the reference for the Node service; SocketService still
+# keeps rooms per process and does not route by this ring yet.
+#
+# Ring changes and handoff. Membership changes are announced on shard:ring.
+# A node that learns it no longer owns a room flushes it and sends the
+# snapshot (state plus the recent ops the OT engine transforms against) to
+# the new owner as a `handoff`, then forwards anything that still reaches it
+# for that room. Messages from one publisher arrive in order, so
+# - on drain (leave), the leaving node sends every handoff before announcing
+#   the leave, and peers only route to the new owners after the handoffs;
+# - on join, the new node holds operations for rooms that moved to it until
+#   each previous owner confirms with `handoff-complete`.
+# An operation that was in flight during a ring change can be applied after a
+# later one from the same client; the OT engine resolves it by timestamp like
+# any concurrent operation.
+#
+# The bus is injected: RedisBus over redis.asyncio in production, LocalBus in
+# process, and the harness below runs one replica per process over a small
+# TCP broker with Redis pub/sub semantics.
+#
+#   python room_sharding.py       # rooms served as replicas are added, plus a drain
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import random
+import time
+from bisect import bisect
+from collections import defaultdict
+
+from document_state import DocumentState
+from operation_batcher import CollaborationRoom, OperationBatcher
+from operational_transform import Operation
+
+log = logging.getLogger(__name__)
+
+RING_CHANNEL = "shard:ring"
+HANDOFF_TAIL = 200  # recent ops sent with a handoff for transforming late ops
+
+
+def node_channel(node_id):
+    return f"node:{node_id}"
+
+
+def room_channel(project_id):
+    return f"room:{project_id}"
+
+
+def _point(key):
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    # Consistent hashing with virtual nodes: adding or removing one of n nodes
+    # moves about 1/n of the projects
+    def __init__(self, nodes=(), vnodes=128):
+        self.vnodes = vnodes
+        self._points = []
+        self._owners = []
+        self.nodes = frozenset()
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes = self.nodes | {node}
+        self._rebuild()
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes = self.nodes - {node}
+        self._rebuild()
+
+    def _rebuild(self):
+        points = sorted((_point(f"{node}#{i}"), node) for node in self.nodes for i in range(self.vnodes))
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key):
+        if not self._points:
+            raise LookupError("hash ring has no nodes")
+        i = bisect(self._points, _point(key))
+        return self._owners[i % len(self._owners)]
+
+    def copy(self):
+        ring = HashRing(vnodes=self.vnodes)
+        ring.nodes = self.nodes
+        ring._points = self._points
+        ring._owners = self._owners
+        return ring
+
+
+class LocalBus:
+    # In-process pub/sub with Redis semantics (per-publisher order, no replay)
+    def __init__(self):
+        self._subscribers = defaultdict(list)
+
+    def connect(self):
+        return _LocalConnection(self)
+
+
+class _LocalConnection:
+    def __init__(self, bus):
+        self.bus = bus
+        self.handlers = {}
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    async def subscribe(self, channel, handler):
+        self.handlers[channel] = handler
+        if self not in self.bus._subscribers[channel]:
+            self.bus._subscribers[channel].append(self)
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._pump())
+
+    async def unsubscribe(self, channel):
+        self.handlers.pop(channel, None)
+        if self in self.bus._subscribers[channel]:
+            self.bus._subscribers[channel].remove(self)
+
+    async def publish(self, channel, message):
+        text = json.dumps(message, separators=(",", ":"))
+        for connection in self.bus._subscribers.get(channel, ()):
+            connection.queue.put_nowait((channel, text))
+
+    async def _pump(self):
+        while True:
+            channel, text = await self.queue.get()
+            handler = self.handlers.get(channel)
+            if handler is not None:
+                try:
+                    await handler(json.loads(text))
+                except Exception:
+                    log.exception("handler for %s failed", channel)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+
+
+class RedisBus:
+    # Pub/sub over redis.asyncio: one connection publishes, one listens
+    def __init__(self, url):
+        import redis.asyncio as redis  # only needed when sharding over Redis
+        self._client = redis.from_url(url)
+        self._pubsub = self._client.pubsub()
+        self.handlers = {}
+        self.task = None
+
+    def connect(self):
+        return self
+
+    async def subscribe(self, channel, handler):
+        self.handlers[channel] = handler
+        await self._pubsub.subscribe(channel)
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._listen())
+
+    async def unsubscribe(self, channel):
+        self.handlers.pop(channel, None)
+        await self._pubsub.unsubscribe(channel)
+
+    async def publish(self, channel, message):
+        await self._client.publish(channel, json.dumps(message, separators=(",", ":")))
+
+    async def _listen(self):
+        async for raw in self._pubsub.listen():
+            if raw["type"] != "message":
+                continue
+            channel = raw["channel"].decode() if isinstance(raw["channel"], bytes) else raw["channel"]
+            handler = self.handlers.get(channel)
+            if handler is not None:
+                try:
+                    await handler(json.loads(raw["data"]))
+                except Exception:
+                    log.exception("handler for %s failed", channel)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        await self._pubsub.close()
+        await self._client.close()
+
+
+class ShardNode:
+    def __init__(self, node_id, connection, nodes, deliver, authorize=None, persist=None,
+                 room_factory=CollaborationRoom, window=0.016):
+        # connection: a bus connection (subscribe/unsubscribe/publish)
+        # nodes: the ring this node starts from (INSTANCE_IDs of live replicas)
+        # deliver(project_id, event, payload): send to this node's sockets in the room
+        self.node_id = node_id
+        self.bus = connection
+        self.ring = HashRing(nodes)
+        self.deliver = deliver
+        self.room_factory = room_factory
+        self.batcher = OperationBatcher(authorize or self._allow, self._fan_out,
+                                        persist or self._no_persist, window=window,
+                                        room_factory=self._make_room)
+        self.sockets = defaultdict(int)  # project -> local sockets in the room
+        self.draining = False
+        self._incoming = {}              # project -> handed-off room waiting to be adopted
+        self._awaiting = set()           # previous owners that have not confirmed a join
+        self._held = defaultdict(list)   # previous owner -> ops held until it confirms
+        self._previous_ring = None
+        self.metrics = {"local": 0, "forwarded": 0, "relayed_in": 0, "handoffs_sent": 0,
+                        "handoffs_received": 0, "delivered": 0, "held": 0}
+
+    @staticmethod
+    async def _allow(user_id, project_id):
+        return True
+
+    @staticmethod
+    async def _no_persist(project_id, operations, state):
+        return None
+
+    def _make_room(self, project_id):
+        room = self._incoming.pop(project_id, None)
+        return room if room is not None else self.room_factory(project_id)
+
+    @property
+    def rooms(self):
+        return self.batcher.rooms
+
+    def owns(self, project_id):
+        return not self.draining and self.ring.owner(project_id) == self.node_id
+
+    async def start(self):
+        await self.bus.subscribe(node_channel(self.node_id), self._on_inbox)
+        await self.bus.subscribe(RING_CHANNEL, self._on_ring)
+
+    async def join_ring(self):
+        # Scale-up: a started node that is not in the ring yet takes over the
+        # rooms that now hash to it; peers hand them over
+        self._previous_ring = self.ring.copy()
+        self.ring.add(self.node_id)
+        self._awaiting = set(self._previous_ring.nodes)
+        await self.bus.publish(RING_CHANNEL, {"type": "join", "node": self.node_id})
+
+    # Edge side
+
+    async def join_room(self, project_id):
+        self.sockets[project_id] += 1
+        if self.sockets[project_id] == 1:
+            await self.bus.subscribe(room_channel(project_id), self._on_room)
+
+    async def leave_room(self, project_id):
+        self.sockets[project_id] -= 1
+        if self.sockets[project_id] <= 0:
+            del self.sockets[project_id]
+            await self.bus.unsubscribe(room_channel(project_id))
+
+    async def submit(self, project_id, user_id, operation):
+        # canvas:operation from a local socket; operation is the wire dict
+        await self._route(project_id, user_id, operation)
+
+    async def _route(self, project_id, user_id, operation):
+        owner = self.ring.owner(project_id)
+        if owner == self.node_id and not self.draining:
+            previous = self._previous_owner(project_id)
+            if previous is not None:
+                self.metrics["held"] += 1
+                self._held[previous].append((project_id, user_id, operation))
+                return
+            self.metrics["local"] += 1
+            future = self.batcher.submit(project_id, user_id, Operation.from_dict(operation))
+            future.add_done_callback(self._log_rejection)
+            return
+        if self.draining and owner == self.node_id:
+            owner = self._ring_without_self().owner(project_id)
+        self.metrics["forwarded"] += 1
+        await self.bus.publish(node_channel(owner), {"type": "op", "projectId": project_id,
+                                                     "userId": user_id, "operation": operation})
+
+    def _previous_owner(self, project_id):
+        # While a join is unconfirmed, ops for rooms that moved here wait for
+        # their previous owner's handoff-complete
+        if not self._awaiting or project_id in self.rooms:
+            return None
+        previous = self._previous_ring.owner(project_id)
+        return previous if previous in self._awaiting else None
+
+    @staticmethod
+    def _log_rejection(future):
+        if not future.cancelled() and future.exception() is not None:
+            log.warning("operation rejected: %s", future.exception())
+
+    async def _on_room(self, message):
+        self.metrics["delivered"] += len(message["payload"].get("operations", ()))
+        result = self.deliver(message["projectId"], message["event"], message["payload"])
+        if asyncio.iscoroutine(result):
+            await result
+
+    # Owner side
+
+    async def _fan_out(self, project_id, event, payload):
+        await self.bus.publish(room_channel(project_id), {"projectId": project_id, "event": event,
+                                                          "payload": payload})
+
+    async def _on_inbox(self, message):
+        kind = message["type"]
+        if kind == "op":
+            self.metrics["relayed_in"] += 1
+            await self._route(message["projectId"], message["userId"], message["operation"])
+        elif kind == "handoff":
+            self._adopt(message)
+        elif kind == "handoff-complete":
+            await self._confirm(message["node"])
+
+    def _adopt(self, message):
+        project_id = message["projectId"]
+        self.metrics["handoffs_received"] += 1
+        room = self.room_factory(project_id, DocumentState.from_snapshot(message["snapshot"]))
+        for raw in message["recent"]:
+            room.buffer.append(Operation.from_dict(raw))
+        if project_id in self.rooms:
+            log.warning("handoff for %s replaces a live room", project_id)
+            del self.rooms[project_id]
+        self._incoming[project_id] = room
+        self.batcher.room(project_id)
+
+    async def _confirm(self, node):
+        self._awaiting.discard(node)
+        for project_id, user_id, operation in self._held.pop(node, ()):
+            await self._route(project_id, user_id, operation)
+        if not self._awaiting:
+            self._previous_ring = None
+
+    async def _on_ring(self, message):
+        node = message["node"]
+        if node == self.node_id:
+            return
+        if message["type"] == "join":
+            self.ring.add(node)
+            await self._hand_off_moved()
+            await self.bus.publish(node_channel(node), {"type": "handoff-complete",
+                                                        "node": self.node_id})
+        elif message["type"] == "leave":
+            self.ring.remove(node)
+            if node in self._awaiting:
+                await self._confirm(node)
+
+    async def _hand_off_moved(self):
+        for project_id in list(self.rooms):
+            owner = self._ring_without_self().owner(project_id) if self.draining \
+                else self.ring.owner(project_id)
+            if owner != self.node_id:
+                await self._hand_off(project_id, owner)
+
+    async def _hand_off(self, project_id, owner):
+        room = await self.batcher.release(project_id)
+        if room is None:
+            return
+        recent = [op.to_dict() for op in list(room.buffer)[-HANDOFF_TAIL:]]
+        self.metrics["handoffs_sent"] += 1
+        await self.bus.publish(node_channel(owner), {"type": "handoff", "projectId": project_id,
+                                                     "snapshot": room.state.snapshot(),
+                                                     "recent": recent})
+
+    def _ring_without_self(self):
+        ring = self.ring.copy()
+        ring.remove(self.node_id)
+        return ring
+
+    async def drain(self):
+        # Graceful shutdown: hand every room to its next owner, then leave.
+        # Ops that still arrive are forwarded by the caller until it exits.
+        self.draining = True
+        await self._hand_off_moved()
+        await self.bus.publish(RING_CHANNEL, {"type": "leave", "node": self.node_id})
+
+
+# Multi-process harness
+
+class _Broker:
+    # Redis-style pub/sub over TCP with JSON lines, for the local harness
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+
+    async def serve(self, reader, writer):
+        channels = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = json.loads(line)
+                if command["op"] == "sub":
+                    self.subscribers[command["channel"]].add(writer)
+                    channels.add(command["channel"])
+                elif command["op"] == "unsub":
+                    self.subscribers[command["channel"]].discard(writer)
+                    channels.discard(command["channel"])
+                else:
+                    frame = (json.dumps({"channel": command["channel"], "message": command["message"]},
+                                        separators=(",", ":")) + "\n").encode()
+                    for subscriber in list(self.subscribers.get(command["channel"], ())):
+                        subscriber.write(frame)
+        finally:
+            for channel in channels:
+                self.subscribers[channel].discard(writer)
+            writer.close()
+
+
+class _TcpConnection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.handlers = {}
+        self.task = asyncio.ensure_future(self._listen())
+
+    @classmethod
+    async def open(cls, port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=1 << 24)
+        return cls(reader, writer)
+
+    def _send(self, command):
+        self.writer.write((json.dumps(command, separators=(",", ":")) + "\n").encode())
+
+    async def subscribe(self, channel, handler):
+        self.handlers[channel] = handler
+        self._send({"op": "sub", "channel": channel})
+        await self.writer.drain()
+
+    async def unsubscribe(self, channel):
+        self.handlers.pop(channel, None)
+        self._send({"op": "unsub", "channel": channel})
+        await self.writer.drain()
+
+    async def publish(self, channel, message):
+        self._send({"op": "pub", "channel": channel, "message": message})
+        await self.writer.drain()
+
+    async def _listen(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return
+            frame = json.loads(line)
+            handler = self.handlers.get(frame["channel"])
+            if handler is not None:
+                try:
+                    await handler(frame["message"])
+                except Exception:
+                    log.exception("handler for %s failed", frame["channel"])
+
+
+class _SeededRoom(CollaborationRoom):
+    def __init__(self, project_id, state=None, buffer_size=1000):
+        if state is None:
+            state = DocumentState.from_snapshot({"objects": {
+                f"obj-{i}": {"x": 0.0, "y": 0.0, "scaleX": 1, "scaleY": 1, "rotation": 0,
+                             "fill": "#4ECDC4"} for i in range(20)}})
+        super().__init__(project_id, state, buffer_size)
+
+
+def _worker(node_id, nodes, port, load, seconds, join_at, drain_at, barrier, results):
+    # load: [(project_id, ops per second this replica's sockets send to it)]
+    async def run():
+        connection = await _TcpConnection.open(port)
+        node = ShardNode(node_id, connection, nodes, lambda *args: None, room_factory=_SeededRoom)
+        await node.start()
+        for project_id, _ in load:
+            await node.join_room(project_id)
+        await loop.run_in_executor(None, barrier.wait)  # every replica is subscribed
+        projects = [project_id for project_id, _ in load]
+        weights = [rate for _, rate in load]
+        total_rate = sum(weights)
+        rng = random.Random(node_id)
+        start = loop.time()
+        cpu_start = time.process_time()
+        sent, seq, due, tick = 0, 0, 0.0, 0.02
+        drained = joined = False
+        while loop.time() - start < seconds:
+            if join_at is not None and not joined and loop.time() - start >= join_at:
+                await node.join_ring()
+                joined = True
+            if drain_at is not None and not drained and loop.time() - start >= drain_at:
+                await node.drain()
+                drained = True
+            due += total_rate * tick
+            for project_id in rng.choices(projects, weights, k=int(due)) if projects else ():
+                seq += 1
+                await node.submit(project_id, f"user-{node_id}", {
+                    "id": f"{node_id}-{seq}", "type": "update", "objectId": f"obj-{rng.randrange(20)}",
+                    "data": {"fill": f"#{rng.randrange(1 << 24):06x}"}, "userId": f"user-{node_id}",
+                    "timestamp": time.time() * 1000, "clientId": node_id})
+                sent += 1
+            due -= int(due)
+            await asyncio.sleep(tick)
+        # Keep relaying for peers until every replica has sent its load
+        await loop.run_in_executor(None, barrier.wait)
+        await asyncio.sleep(0.5)
+        await node.batcher.flush_all()
+        cpu = time.process_time() - cpu_start
+        versions = {project_id: room.state.version for project_id, room in node.rooms.items()}
+        results.put({"node": node_id, "sent": sent, "cpu": cpu, "rooms": len(node.rooms),
+                     "applied": node.batcher.metrics["operations"], "versions": versions,
+                     "metrics": node.metrics})
+        await loop.run_in_executor(None, barrier.wait)
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(run())
+    loop.close()
+
+
+async def _serve_broker(ready, stop):
+    broker = _Broker()
+    server = await asyncio.start_server(broker.serve, "127.0.0.1", 0, limit=1 << 24)
+    ready.put(server.sockets[0].getsockname()[1])
+    while stop.empty():
+        await asyncio.sleep(0.05)
+    server.close()
+
+
+def _broker_process(ready, stop):
+    asyncio.run(_serve_broker(ready, stop))
+
+
+def _loads(nodes, projects, rate, affinity, seed=20):
+    # A room's sockets are spread over the replicas; `affinity` of its traffic
+    # starts on the owner and the rest on one other replica. None means no
+    # sticky routing: every replica, owner included, sends an equal share.
+    ring = HashRing(nodes)
+    rng = random.Random(seed)
+    loads = {node: [] for node in nodes}
+    for project_id in projects:
+        if affinity is None:
+            for node in nodes:
+                loads[node].append((project_id, rate / len(nodes)))
+            continue
+        owner = ring.owner(project_id)
+        others = [node for node in nodes if node != owner]
+        if not others:
+            loads[owner].append((project_id, rate))
+            continue
+        loads[owner].append((project_id, rate * affinity))
+        loads[rng.choice(others)].append((project_id, rate * (1 - affinity)))
+    return loads
+
+
+def _run_cluster(replicas, rooms_per_replica, rate, seconds, affinity, join=False, drain=False):
+    ready, stop, results = multiprocessing.Queue(), multiprocessing.Queue(), multiprocessing.Queue()
+    broker = multiprocessing.Process(target=_broker_process, args=(ready, stop))
+    broker.start()
+    port = ready.get()
+    nodes = [f"backend-{i + 1}" for i in range(replicas)]
+    projects = [f"project-{i}" for i in range(rooms_per_replica * replicas)]
+    initial = nodes[:-1] if join else nodes
+    loads = _loads(initial, projects, rate, affinity)
+    if join:
+        # The joining replica starts as an edge with a share of every room's
+        # sockets and joins the ring a third of the way in
+        share = 1 / replicas if affinity is None else 1 - affinity
+        loads[nodes[-1]] = [(project_id, rate * share) for project_id in projects[::replicas]]
+    barrier = multiprocessing.Barrier(replicas)
+    workers = []
+    for i, node_id in enumerate(nodes):
+        join_at = seconds / 3 if join and node_id == nodes[-1] else None
+        drain_at = seconds / 2 if drain and i == 0 else None
+        worker = multiprocessing.Process(target=_worker, args=(
+            node_id, initial, port, loads[node_id], seconds, join_at, drain_at, barrier, results))
+        worker.start()
+        workers.append(worker)
+    reports = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    stop.put(True)
+    broker.join()
+    return projects, reports
+
+
+def harness(max_replicas=4, rooms_per_replica=50, rate=20.0, seconds=4.0, affinity=None):
+    routing = ("sockets spread evenly" if affinity is None
+               else f"{affinity:.0%} of a room's traffic on its owner")
+    print(f"{rooms_per_replica} rooms per replica, {rate:.0f} ops/s per room, {routing}, "
+          f"{seconds:.0f} s runs "
+          f"({multiprocessing.cpu_count()} CPU core(s) here)")
+    print(f"{'replicas':>8} {'rooms':>6} {'ops applied':>12} {'busiest cpu s':>14} "
+          f"{'room capacity':>14} {'relayed':>8}")
+    for replicas in range(1, max_replicas + 1):
+        projects, reports = _run_cluster(replicas, rooms_per_replica, rate, seconds, affinity)
+        sent = sum(r["sent"] for r in reports)
+        applied = sum(r["applied"] for r in reports)
+        busiest = max(r["cpu"] for r in reports)
+        forwarded = sum(r["metrics"]["forwarded"] for r in reports)
+        assert applied == sent, (applied, sent)
+        # Rooms at which the busiest replica's CPU time would reach wall time;
+        # per-process CPU time keeps this meaningful on a machine with fewer
+        # cores than replicas
+        capacity = sent / busiest / rate
+        print(f"{replicas:8} {len(projects):6} {applied:12} {busiest:14.2f} {capacity:14.0f} "
+              f"{forwarded / max(1, sent):8.0%}")
+
+    for label, options in (("drain", {"drain": True}), ("join", {"join": True})):
+        projects, reports = _run_cluster(3, rooms_per_replica, rate, seconds, affinity, **options)
+        sent = sum(r["sent"] for r in reports)
+        versions = {}
+        for report in reports:
+            for project_id, version in report["versions"].items():
+                assert project_id not in versions, f"{project_id} owned twice after {label}"
+                versions[project_id] = version
+        assert sum(versions.values()) == sent, (label, sum(versions.values()), sent)
+        handoffs = sum(r["metrics"]["handoffs_sent"] for r in reports)
+        held = sum(r["metrics"]["held"] for r in reports)
+        print(f"{label}: {handoffs} rooms handed off ({held} ops held until handoff), "
+              f"{sum(versions.values())} of {sent} ops in the final room states")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-process room sharding harness")
+    parser.add_argument("--replicas", type=int, default=4)
+    parser.add_argument("--rooms", type=int, default=50, help="rooms per replica")
+    parser.add_argument("--rate", type=float, default=20.0, help="operations per second per room")
+    parser.add_argument("--seconds", type=float, default=4.0)
+    parser.add_argument("--affinity", type=float, default=None,
+                        help="share of a room's operations sent from its owner replica "
+                             "(default: spread evenly, as with least_conn)")
+    args = parser.parse_args()
+    harness(args.replicas, args.rooms, args.rate, args.seconds, args.affinity)
@@ -1,5 +1,3 @@
-import json
-import os
 
 # Create comprehensive project structure
 project_structure = {
@@ -289,7 +287,7 @@ model Project {
   id          String   @id @default(auto()) @map("_id") @db.ObjectId
   name        String
   description String?
-  thumbnail   String?
+  thumbnail   String?  // level-0 tile key of the first artboard (thumbnails.py)
   createdAt   DateTime @default(now())
   updatedAt   DateTime @updatedAt
   ownerId     String   @db.ObjectId
@@ -311,17 +309,40 @@ model Artboard {
   height    Int
   x         Float    @default(0)
   y         Float    @default(0)
-  objects   Json     @default("[]")
+  thumbnail String?  // level-0 tile key
+  tiles     Json?    // thumbnail tile manifest, see thumbnails.py
   createdAt DateTime @default(now())
   updatedAt DateTime @updatedAt
   projectId String   @db.ObjectId
 
   // Relations
-  project Project @relation(fields: [projectId], references: [id], onDelete: Cascade)
+  project Project          @relation(fields: [projectId], references: [id], onDelete: Cascade)
+  objects ArtboardObject[]
 
   @@map("artboards")
 }
 
+model ArtboardObject {
+  id         String   @id @default(auto()) @map("_id") @db.ObjectId
+  objectId   String   // client-side object id, as in canvas operations
+  data       Json
+  zIndex     Float    @default(0)
+  minX       Float
+  minY       Float
+  maxX       Float
+  maxY       Float
+  version    Int      @default(1)
+  updatedAt  DateTime @updatedAt
+  artboardId String   @db.ObjectId
+
+  // Relations
+  artboard Artboard @relation(fields: [artboardId], references: [id], onDelete: Cascade)
+
+  @@unique([artboardId, objectId])
+  @@index([artboardId, minX, minY])
+  @@map("artboard_objects")
+}
+
 model Collaboration {
   id          String   @id @default(auto()) @map("_id") @db.ObjectId
   role        String   // "owner", "editor", "viewer"
@@ -391,13 +412,18 @@ model Version {
   id          String   @id @default(auto()) @map("_id") @db.ObjectId
   name        String
   description String?
-  snapshot    Json
+  seq         Int      // 1, 2, 3... per project
+  kind        String   @default("keyframe") // "keyframe", "delta"
+  baseSeq     Int      // keyframe a restore replays from
+  snapshot    Json?    // full state (keyframes only)
+  delta       Json?    // { set, patch, delete } against seq - 1 (deltas only)
   createdAt   DateTime @default(now())
   projectId   String   @db.ObjectId
 
   // Relations
   project Project @relation(fields: [projectId], references: [id], onDelete: Cascade)
 
+  @@unique([projectId, seq])
   @@map("versions")
 }
 """
@@ -783,11 +809,14 @@ jobs:
     }
 }
 
-# Save project structure to JSON
-with open('project_structure.json', 'w') as f:
-    json.dump(project_structure, f, indent=2)
-
-print("Project structure created successfully!")
-print("\nMain directories:")
-for key in project_structure["figma-clone"]["packages"].keys():
-    print(f"- packages/{key}")
\ No newline at end of file
+if __name__ == "__main__":
+    from gencache import write_json
+
+    # Save project structure to JSON (skipped when nothing changed since the last run)
+    if write_json(project_structure, 'project_structure.json'):
+        print("Project structure created successfully!")
+    else:
+        print("Project structure unchanged, nothing to write.")
+    print("\nMain directories:")
+    for key in project_structure["figma-clone"]["packages"].keys():
+        print(f"- packages/{key}")
\ No newline at end of file
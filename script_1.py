@@ -838,20 +838,20 @@ AUDIT_LOGGING=true"""
 }
 
 # Save all deployment configuration files
-import os
-import json
-
-# Create deployment_configs.json
-with open('deployment_configs.json', 'w') as f:
-    json.dump(deployment_configs, f, indent=2)
-
-print("✅ Created comprehensive deployment configuration files:")
-for filename in deployment_configs.keys():
-    print(f"  📁 {filename}")
-
-print("\n🚀 Deployment configurations include:")
-print("  • Docker Compose for production with full monitoring stack")
-print("  • Nginx configuration with SSL, load balancing, and security")
-print("  • Kubernetes manifests for container orchestration")
-print("  • Terraform infrastructure as code for AWS")
-print("  • Environment variables template for production")
\ No newline at end of file
+if __name__ == "__main__":
+    from gencache import write_json
+
+    # Create deployment_configs.json (skipped when nothing changed since the last run)
+    if not write_json(deployment_configs, 'deployment_configs.json'):
+        print("✅ Deployment configuration files unchanged, nothing to write.")
+    else:
+        print("✅ Created comprehensive deployment configuration files:")
+        for filename in deployment_configs.keys():
+            print(f"  📁 {filename}")
+
+        print("\n🚀 Deployment configurations include:")
+        print("  • Docker Compose for production with full monitoring stack")
+        print("  • Nginx configuration with SSL, load balancing, and security")
+        print("  • Kubernetes manifests for container orchestration")
+        print("  • Terraform infrastructure as code for AWS")
+        print("  • Environment variables template for production")
\ No newline at end of file
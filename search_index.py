@@ -0,0 +1,448 @@
+# Inverted index behind GET /api/search
+#
+# Project names, artboard names, canvas object names, the text of text
+# layers and comment content live in separate collections, object data in
+# ArtboardObject.data Json, so answering a search from the database means
+# scanning all of it. SearchIndex keeps an in-memory inverted index instead:
+#
+#   term -> {project id: {document: weighted term frequency}}
+#
+# Postings are grouped by project, so a search with projectId reads only that
+# project's postings. Results are ranked with BM25 (k1, b) over a document's
+# name (counted name_weight times) and text, and reported with relevance
+# relative to the best hit. The last word of a query is also matched as a
+# prefix, for search-as-you-type, and suggest() completes a prefix from the
+# vocabulary, most common terms first.
+#
+# Updates are incremental. persist_operations() is a batcher_persist step
+# (object_store.py), so it sees every batch the OperationBatcher persists. An
+# edit that leaves an object's name and text alone (a move, a restyle) only
+# records its new bounds, which the spatial filter uses: a search scoped to an
+# artboard can pass bounds to keep the objects intersecting a viewport or
+# selection. The first such query builds the artboard's SpatialIndex, which
+# later edits keep up to date.
+#
+#   python search_index.py        # 1M synthetic objects: build, update and query costs
+import argparse
+import bisect
+import heapq
+import math
+import random
+import re
+import resource
+import time
+
+from spatial_index import SpatialIndex, bounds_of
+
+PROJECT = "project"
+ARTBOARD = "artboard"
+OBJECT = "object"
+COMMENT = "comment"
+SEARCH_TYPES = {"projects": (PROJECT, ARTBOARD), "objects": (OBJECT,), "comments": (COMMENT,)}
+
+_TOKEN = re.compile(r"[^\W_]+")
+_CAMEL = re.compile(r"(?<=[a-z])(?=[A-Z])")
+PREFIX_EXPANSIONS = 3  # vocabulary terms a trailing prefix expands to
+TOP_COMPLETIONS = 16   # most common completions cached per prefix
+
+
+def tokenize(text):
+    # Lowercased words; camelCase and snake_case are split ("navBar_icon" ->
+    # nav, bar, icon)
+    if not text:
+        return []
+    return _TOKEN.findall(_CAMEL.sub(" ", str(text)).lower())
+
+
+def object_text(obj):
+    # (name, text) of a canvas object; text layers keep their text in `text`,
+    # `content` or properties.text
+    properties = obj.get("properties") or {}
+    text = obj.get("text") or obj.get("content") or properties.get("text") or properties.get("content")
+    return obj.get("name"), text if isinstance(text, str) else None
+
+
+class _Doc:
+    __slots__ = ("kind", "id", "project", "artboard", "title", "description", "terms", "length",
+                 "bounds")
+
+    def __init__(self, kind, doc_id, project, artboard, title, description, terms, length, bounds):
+        self.kind = kind
+        self.id = doc_id
+        self.project = project
+        self.artboard = artboard
+        self.title = title
+        self.description = description
+        self.terms = terms      # ((term, weighted frequency), ...)
+        self.length = length
+        self.bounds = bounds
+
+
+class SearchIndex:
+    def __init__(self, k1=1.2, b=0.75, name_weight=3):
+        self.k1 = k1
+        self.b = b
+        self.name_weight = name_weight
+        self._numbers = {}        # (kind, id) -> document number
+        self._docs = []           # document number -> _Doc, or None once removed
+        self._kinds = []          # document number -> kind, and
+        self._lengths = []        # -> length, read by the scoring loop
+        self._free = []
+        self._postings = {}       # term -> {project id: {document number: frequency}}
+        self._df = {}             # term -> documents containing it
+        self._total_length = 0
+        self._vocabulary = []     # sorted terms, for prefix completion
+        self._top_completions = {}  # prefix -> its TOP_COMPLETIONS most common terms
+        self._project_names = {}
+        self._artboard_projects = {}  # artboard id -> project id
+        self._artboard_objects = {}   # artboard id -> {object document numbers}
+        self._spatial = {}        # artboard id -> SpatialIndex, once queried spatially
+        self.metrics = {"indexed": 0, "removed": 0, "bounds_only": 0, "queries": 0}
+
+    def __len__(self):
+        return len(self._numbers)
+
+    # Documents
+
+    def index_project(self, project_id, name, description=None):
+        self._project_names[project_id] = name
+        self._index((PROJECT, project_id), PROJECT, project_id, project_id, None, name, description)
+
+    def index_artboard(self, artboard_id, project_id, name):
+        self._artboard_projects[artboard_id] = project_id
+        self._index((ARTBOARD, artboard_id), ARTBOARD, artboard_id, project_id, artboard_id, name, None)
+
+    def index_comment(self, comment_id, project_id, content):
+        self._index((COMMENT, comment_id), COMMENT, comment_id, project_id, None, None, content)
+
+    def index_object(self, artboard_id, object_id, obj):
+        # Indexes a canvas object (from ArtboardObject.data or a room's state);
+        # obj None removes it. Object ids are only unique within an artboard.
+        key = (OBJECT, artboard_id, object_id)
+        if obj is None:
+            self._remove(key)
+            return
+        number = self._numbers.get(key)
+        name, text = object_text(obj)
+        bounds = bounds_of(obj)
+        if number is not None:
+            doc = self._docs[number]
+            if doc.title == name and doc.description == text:
+                doc.bounds = bounds
+                spatial = self._spatial.get(artboard_id)
+                if spatial is not None:
+                    spatial.update(number, bounds)
+                self.metrics["bounds_only"] += 1
+                return
+        project_id = self._artboard_projects.get(artboard_id)
+        if project_id is None:
+            raise KeyError(f"artboard {artboard_id} is not indexed")
+        self._index(key, OBJECT, object_id, project_id, artboard_id, name, text, bounds)
+
+    def remove(self, kind, doc_id, artboard_id=None):
+        # Objects are identified by artboard_id and their object id
+        self._remove((kind, artboard_id, doc_id) if kind == OBJECT else (kind, doc_id))
+        if kind == PROJECT:
+            self._project_names.pop(doc_id, None)
+
+    async def persist_operations(self, artboard_id, state, operations):
+        # A batcher_persist step, listed after the store's
+        touched = dict.fromkeys(op.object_id for op in operations if op.type != "noop")
+        for object_id in touched:
+            self.index_object(artboard_id, object_id, state.objects.get(object_id))
+
+    def _index(self, key, kind, doc_id, project_id, artboard_id, title, description, bounds=None):
+        self._remove(key)
+        frequencies = {}
+        for term in tokenize(title):
+            frequencies[term] = frequencies.get(term, 0) + self.name_weight
+        for term in tokenize(description):
+            frequencies[term] = frequencies.get(term, 0) + 1
+        doc = _Doc(kind, doc_id, project_id, artboard_id, title, description,
+                   tuple(frequencies.items()), sum(frequencies.values()), bounds)
+        if self._free:
+            number = self._free.pop()
+            self._docs[number], self._kinds[number], self._lengths[number] = doc, kind, doc.length
+        else:
+            number = len(self._docs)
+            self._docs.append(doc)
+            self._kinds.append(kind)
+            self._lengths.append(doc.length)
+        self._numbers[key] = number
+        for term, frequency in doc.terms:
+            by_project = self._postings.get(term)
+            if by_project is None:
+                by_project = self._postings[term] = {}
+                bisect.insort(self._vocabulary, term)
+            group = by_project.get(project_id)
+            if group is None:
+                group = by_project[project_id] = {}
+            group[number] = frequency
+            self._df[term] = self._df.get(term, 0) + 1
+            if self._top_completions:
+                self._forget_completions(term)
+        self._total_length += doc.length
+        if kind == OBJECT:
+            self._artboard_objects.setdefault(artboard_id, set()).add(number)
+            spatial = self._spatial.get(artboard_id)
+            if spatial is not None:
+                spatial.insert(number, bounds)
+        self.metrics["indexed"] += 1
+
+    def _remove(self, key):
+        number = self._numbers.pop(key, None)
+        if number is None:
+            return
+        doc = self._docs[number]
+        for term, _ in doc.terms:
+            by_project = self._postings[term]
+            group = by_project[doc.project]
+            del group[number]
+            if not group:
+                del by_project[doc.project]
+            self._df[term] -= 1
+            if self._top_completions:
+                self._forget_completions(term)
+            if not self._df[term]:
+                del self._df[term], self._postings[term]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, term)]
+        self._total_length -= doc.length
+        if doc.kind == OBJECT:
+            self._artboard_objects[doc.artboard].discard(number)
+            spatial = self._spatial.get(doc.artboard)
+            if spatial is not None:
+                spatial.remove(number)
+        self._docs[number] = self._kinds[number] = None
+        self._free.append(number)
+        self.metrics["removed"] += 1
+
+    # Queries
+
+    def search(self, q, type="all", project_id=None, limit=20, page=1, artboard_id=None,
+               bounds=None):
+        # SearchQuery -> (results, total count). artboard_id limits the search
+        # to that artboard's objects; bounds=(minx, miny, maxx, maxy) further
+        # to those intersecting it.
+        self.metrics["queries"] += 1
+        kinds = SEARCH_TYPES.get(type)
+        within = None
+        if artboard_id is not None:
+            # An artboard's objects are all posted under its project
+            artboard_project = self._artboard_projects.get(artboard_id)
+            if artboard_project is None or project_id not in (None, artboard_project):
+                return [], 0
+            project_id = artboard_project
+        if bounds is not None:
+            if artboard_id is None:
+                raise ValueError("a spatial search needs an artboard")
+            within = set(self._spatial_index(artboard_id).query_rect(*bounds))
+        elif artboard_id is not None:
+            within = self._artboard_objects.get(artboard_id, set())
+
+        count = len(self._numbers)
+        if not count or within is not None and not within:
+            return [], 0
+        # BM25 with the length normalization folded into two constants
+        k1 = self.k1
+        k1_base = k1 * (1 - self.b)
+        # Every document empty: no length to normalize by
+        k1_length = k1 * self.b * count / self._total_length if self._total_length else 0.0
+        kinds_of, lengths = self._kinds, self._lengths
+        scores = {}
+        for term, boost in self._query_terms(q):
+            by_project = self._postings.get(term)
+            if by_project is None:
+                continue
+            df = self._df[term]
+            weight = boost * math.log(1 + (count - df + 0.5) / (df + 0.5)) * (k1 + 1)
+            if project_id is not None:
+                groups = [by_project[project_id]] if project_id in by_project else []
+            else:
+                groups = by_project.values()
+            for group in groups:
+                if within is not None:
+                    if len(within) < len(group):
+                        group = {number: group[number] for number in within if number in group}
+                    else:
+                        group = {number: frequency for number, frequency in group.items()
+                                 if number in within}
+                for number, frequency in group.items():
+                    if kinds is not None and kinds_of[number] not in kinds:
+                        continue
+                    scores[number] = scores.get(number, 0.0) + weight * frequency / (
+                        frequency + k1_base + k1_length * lengths[number])
+
+        if not scores:
+            return [], 0
+        start = max(0, page - 1) * limit
+        ranked = heapq.nlargest(start + limit, scores.items(), key=lambda item: item[1])
+        best = ranked[0][1]
+        results = []
+        for number, score in ranked[start:]:
+            doc = self._docs[number]
+            result = {"type": doc.kind, "id": doc.id, "title": doc.title or doc.description or "",
+                      "relevance": round(score / best, 4)}
+            if doc.title and doc.description:
+                result["description"] = doc.description
+            if doc.kind == OBJECT:
+                result["artboardId"] = doc.artboard
+            if doc.kind != PROJECT:
+                result["project"] = {"id": doc.project, "name": self._project_names.get(doc.project)}
+            results.append(result)
+        return results, len(scores)
+
+    def suggest(self, prefix, limit=5, project_id=None):
+        # Vocabulary terms starting with the last word of `prefix`, most
+        # common first
+        words = tokenize(prefix)
+        if not words:
+            return []
+        return self._completions(words[-1], limit, project_id)
+
+    def _query_terms(self, q):
+        # (term, weight) pairs; a trailing word without a following space is
+        # also expanded to its most common completions
+        words = tokenize(q)
+        terms = {word: 1.0 for word in words}
+        if words and q[-1:].isalnum():
+            for term in self._completions(words[-1], PREFIX_EXPANSIONS):
+                terms.setdefault(term, 0.5)
+        return terms.items()
+
+    def _completions(self, prefix, limit, project_id=None):
+        # The `limit` most common terms starting with prefix, ranked over the
+        # whole prefix range. Unscoped results are cached per prefix until the
+        # document frequency of a term under it changes.
+        if project_id is None and limit <= TOP_COMPLETIONS:
+            top = self._top_completions.get(prefix)
+            if top is None:
+                top = self._top_completions[prefix] = self._rank_completions(
+                    prefix, TOP_COMPLETIONS, None)
+            return top[:limit]
+        return self._rank_completions(prefix, limit, project_id)
+
+    def _rank_completions(self, prefix, limit, project_id):
+        vocabulary = self._vocabulary
+        start = bisect.bisect_left(vocabulary, prefix)
+        end = bisect.bisect_left(vocabulary, prefix + "\U0010ffff", start)
+        candidates = vocabulary[start:end]
+        if project_id is not None:
+            candidates = [term for term in candidates if project_id in self._postings[term]]
+        return heapq.nlargest(limit, candidates, key=self._df.__getitem__)
+
+    def _forget_completions(self, term):
+        for end in range(len(term) + 1):
+            self._top_completions.pop(term[:end], None)
+
+    def _spatial_index(self, artboard_id):
+        spatial = self._spatial.get(artboard_id)
+        if spatial is None:
+            spatial = self._spatial[artboard_id] = SpatialIndex(-4096.0, -4096.0, 16384.0)
+            for number in self._artboard_objects.get(artboard_id, ()):
+                spatial.insert(number, self._docs[number].bounds)
+        return spatial
+
+
+_NOUNS = ["button", "icon", "header", "footer", "card", "avatar", "label", "title", "input",
+          "toggle", "badge", "banner", "tab", "menu", "divider", "image", "logo", "chip",
+          "tooltip", "modal", "list", "row", "cell", "slider", "checkbox", "hero", "nav", "search"]
+_QUALIFIERS = ["primary", "secondary", "large", "small", "active", "disabled", "hover", "dark",
+               "light", "mobile", "desktop", "outline", "filled", "rounded", "left", "right"]
+_WORDS = ["welcome", "sign", "in", "continue", "checkout", "cart", "profile", "settings", "the",
+          "your", "order", "shipping", "payment", "account", "notifications", "privacy",
+          "terms", "help", "share", "download", "upload", "save", "cancel", "delete", "edit"]
+
+
+def _corpus(rng, objects, projects, artboards_per_project):
+    # Names drawn from a UI vocabulary with a Zipf-like skew, a tenth of the
+    # objects text layers, and a unique-ish token per object so the vocabulary
+    # grows with the corpus as real names do
+    noun_weights = [1 / (i + 1) for i in range(len(_NOUNS))]
+    artboards = projects * artboards_per_project
+    for i in range(objects):
+        artboard = i % artboards
+        noun = rng.choices(_NOUNS, noun_weights)[0]
+        name = f"{rng.choice(_QUALIFIERS)} {noun} v{rng.randrange(20_000)}"
+        obj = {"type": "rectangle", "name": name, "x": rng.uniform(0, 2000), "y": rng.uniform(0, 2000),
+               "width": rng.uniform(10, 200), "height": rng.uniform(10, 200)}
+        if rng.random() < 0.1:
+            obj["type"] = "text"
+            obj["text"] = " ".join(rng.choices(_WORDS, k=rng.randrange(2, 8)))
+        yield f"artboard-{artboard}", f"obj-{i}", obj
+
+
+def benchmark(objects=1_000_000, projects=2_000, artboards_per_project=5, comments=50_000,
+              queries=500, updates=100_000, seed=23):
+    rng = random.Random(seed)
+    index = SearchIndex()
+    start = time.perf_counter()
+    for p in range(projects):
+        index.index_project(f"project-{p}", f"{rng.choice(_QUALIFIERS)} {rng.choice(_NOUNS)} app {p}")
+        for a in range(artboards_per_project):
+            index.index_artboard(f"artboard-{p * artboards_per_project + a}", f"project-{p}",
+                                 f"{rng.choice(_WORDS)} screen")
+    sample = []
+    for artboard_id, object_id, obj in _corpus(rng, objects, projects, artboards_per_project):
+        index.index_object(artboard_id, object_id, obj)
+        if len(sample) < 10_000:
+            sample.append((artboard_id, object_id, obj))
+    for c in range(comments):
+        index.index_comment(f"comment-{c}", f"project-{rng.randrange(projects)}",
+                            " ".join(rng.choices(_WORDS + _NOUNS, k=rng.randrange(3, 15))))
+    build_s = time.perf_counter() - start
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(f"{len(index):,} documents ({objects:,} objects), {len(index._postings):,} terms: "
+          f"built in {build_s:.1f} s ({len(index) / build_s:,.0f} docs/s), peak RSS {memory / 2**20:,.0f} MB")
+
+    # The operation stream: mostly moves, which only touch bounds, and renames
+    start = time.perf_counter()
+    for _ in range(updates):
+        artboard_id, object_id, obj = rng.choice(sample)
+        if rng.random() < 0.9:
+            obj = {**obj, "x": obj["x"] + rng.uniform(-10, 10)}
+        else:
+            obj = {**obj, "name": f"{rng.choice(_QUALIFIERS)} {rng.choice(_NOUNS)} renamed"}
+        index.index_object(artboard_id, object_id, obj)
+    update_us = (time.perf_counter() - start) / updates * 1e6
+    print(f"{updates:,} updates (90% moves): {update_us:.1f} us each")
+
+    def timed(label, make_query):
+        timings = []
+        totals = 0
+        for _ in range(queries):
+            args, kwargs = make_query()
+            start = time.perf_counter()
+            _, total = index.search(*args, **kwargs)
+            timings.append((time.perf_counter() - start) * 1e3)
+            totals += total
+        timings.sort()
+        print(f"{label:>34} {timings[len(timings) // 2]:9.2f} {timings[int(len(timings) * 0.99)]:9.2f} "
+              f"{totals / queries:12,.0f}")
+
+    print(f"{'query':>34} {'p50 ms':>9} {'p99 ms':>9} {'avg matches':>12}")
+    timed("rare term, all projects", lambda: ((f"v{rng.randrange(20_000)}",), {}))
+    timed("two common terms, all projects",
+          lambda: ((f"{rng.choice(_QUALIFIERS)} {rng.choice(_NOUNS)} ",), {}))
+    timed("two common terms, one project",
+          lambda: ((f"{rng.choice(_QUALIFIERS)} {rng.choice(_NOUNS)} ",),
+                   {"project_id": f"project-{rng.randrange(projects)}"}))
+    timed("prefix as typed, one project",
+          lambda: ((rng.choice(_NOUNS)[:3],), {"project_id": f"project-{rng.randrange(projects)}"}))
+    timed("objects in a viewport",
+          lambda: ((rng.choice(_NOUNS),),
+                   {"artboard_id": f"artboard-{rng.randrange(projects * artboards_per_project)}",
+                    "bounds": (500, 500, 1300, 1300)}))
+    start = time.perf_counter()
+    for _ in range(queries):
+        index.suggest(rng.choice(_NOUNS + _WORDS)[:2])
+    print(f"{'suggest (2-letter prefix)':>34} {(time.perf_counter() - start) / queries * 1e3:9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the search index on a synthetic corpus")
+    parser.add_argument("--objects", type=int, default=1_000_000)
+    parser.add_argument("--projects", type=int, default=2_000)
+    parser.add_argument("--comments", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+    benchmark(args.objects, args.projects, comments=args.comments, queries=args.queries)
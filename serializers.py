@@ -0,0 +1,235 @@
+# Output backends for project_structure / deployment_configs artifacts
+#
+#   json     pretty-printed, what script.py has always written (indent=2)
+#   compact  JSON without whitespace
+#   binary   length-prefixed tree that can be memory-mapped and queried in place
+#   gzip     compact JSON, gzip-compressed
+#   zstd     compact JSON, zstd-compressed (needs the zstandard package)
+#
+# Binary layout (little endian), after the 4-byte MAGIC:
+#   str   tag=1  u32 length, utf-8 bytes
+#   dict  tag=2  u32 count, count x (u16 key length, key bytes, u32 child offset
+#                relative to the start of this dict), then the children
+#   other tag=3  u32 length, compact JSON bytes (lists, numbers, bools, null)
+# A lookup reads only the key tables along the requested path.
+import argparse
+import gzip
+import json
+import mmap
+import os
+import struct
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"DSB\x01"
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+TAG_STR = 1
+TAG_DICT = 2
+TAG_JSON = 3
+
+_HEAD = struct.Struct("<BI")
+_KEYLEN = struct.Struct("<H")
+_OFFSET = struct.Struct("<I")
+
+EXTENSIONS = {
+    "json": ".json",
+    "compact": ".json",
+    "binary": ".dsb",
+    "gzip": ".json.gz",
+    "zstd": ".json.zst",
+}
+
+
+def _compact(value):
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def _encode(value):
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+        return _HEAD.pack(TAG_STR, len(data)) + data
+    if isinstance(value, dict):
+        keys = [name.encode("utf-8") for name in value]
+        children = [_encode(child) for child in value.values()]
+        offset = _HEAD.size + sum(_KEYLEN.size + len(k) + _OFFSET.size for k in keys)
+        parts = [_HEAD.pack(TAG_DICT, len(keys))]
+        for key, child in zip(keys, children):
+            parts.append(_KEYLEN.pack(len(key)) + key + _OFFSET.pack(offset))
+            offset += len(child)
+        parts.extend(children)
+        return b"".join(parts)
+    data = _compact(value)
+    return _HEAD.pack(TAG_JSON, len(data)) + data
+
+
+def dumps(tree, fmt="json"):
+    if fmt == "json":
+        return json.dumps(tree, indent=2).encode("utf-8")
+    if fmt == "compact":
+        return _compact(tree)
+    if fmt == "binary":
+        return MAGIC + _encode(tree)
+    if fmt == "gzip":
+        # mtime=0 keeps the output byte-stable across runs
+        return gzip.compress(_compact(tree), mtime=0)
+    if fmt == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd output requires the zstandard package (pip install zstandard)")
+        return zstandard.ZstdCompressor(level=10).compress(_compact(tree))
+    raise ValueError(f"unknown format {fmt!r}; expected one of {', '.join(EXTENSIONS)}")
+
+
+def dump(tree, path, fmt="json"):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(dumps(tree, fmt))
+    os.replace(tmp, path)
+
+
+def loads(data):
+    if data.startswith(MAGIC):
+        return BinaryArtifact(data).load()
+    if data.startswith(GZIP_MAGIC):
+        return json.loads(gzip.decompress(data))
+    if data.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError("reading zstd artifacts requires the zstandard package")
+        return json.loads(zstandard.ZstdDecompressor().decompressobj().decompress(data))
+    return json.loads(data)
+
+
+def load(path):
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+class BinaryArtifact:
+    # Read-only view over a binary artifact; open() memory-maps the file so a
+    # lookup only pages in the key tables it walks and the value it returns
+
+    def __init__(self, buffer, _mapping=None):
+        self._buf = memoryview(buffer)
+        self._mapping = _mapping
+        if bytes(self._buf[:len(MAGIC)]) != MAGIC:
+            raise ValueError("not a binary scaffold artifact")
+
+    @classmethod
+    def open(cls, path):
+        with open(path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mapping, mapping)
+
+    def close(self):
+        self._buf.release()
+        if self._mapping is not None:
+            self._mapping.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _entries(self, pos):
+        _, count = _HEAD.unpack_from(self._buf, pos)
+        cursor = pos + _HEAD.size
+        for _ in range(count):
+            (key_len,) = _KEYLEN.unpack_from(self._buf, cursor)
+            cursor += _KEYLEN.size
+            key = bytes(self._buf[cursor:cursor + key_len]).decode("utf-8")
+            cursor += key_len
+            (offset,) = _OFFSET.unpack_from(self._buf, cursor)
+            cursor += _OFFSET.size
+            yield key, pos + offset
+
+    def _decode(self, pos):
+        tag, length = _HEAD.unpack_from(self._buf, pos)
+        if tag == TAG_DICT:
+            return {key: self._decode(child) for key, child in self._entries(pos)}
+        data = self._buf[pos + _HEAD.size:pos + _HEAD.size + length]
+        if tag == TAG_STR:
+            return str(data, "utf-8")
+        return json.loads(bytes(data))
+
+    def _find(self, path):
+        pos = len(MAGIC)
+        remaining = path.strip("/")
+        while remaining:
+            if self._buf[pos] != TAG_DICT:
+                raise KeyError(path)
+            for key, child in self._entries(pos):
+                # Keys may themselves contain "/" (deployment_configs is flat)
+                if remaining == key or remaining.startswith(key + "/"):
+                    pos, remaining = child, remaining[len(key) + 1:]
+                    break
+            else:
+                raise KeyError(path)
+        return pos
+
+    def leaves(self, is_document, pos=len(MAGIC), prefix=""):
+        # Yields (path, position) of every non-dict entry and of every dict
+        # is_document(name) accepts (package.json); other dicts are descended
+        for name, child in self._entries(pos):
+            path = f"{prefix}/{name}" if prefix else name
+            if self._buf[child] != TAG_DICT or is_document(name):
+                yield path, child
+            else:
+                yield from self.leaves(is_document, child, path)
+
+    def value_at(self, pos):
+        return self._decode(pos)
+
+    def lookup(self, path):
+        # Paths are relative to the document root; for project_structure the
+        # single "figma-clone" root may be omitted ("packages/backend/...")
+        try:
+            return self._decode(self._find(path))
+        except KeyError:
+            roots = list(self._entries(len(MAGIC))) if self._buf[len(MAGIC)] == TAG_DICT else []
+            if len(roots) != 1:
+                raise
+            return self._decode(self._find(f"{roots[0][0]}/{path}"))
+
+    def load(self):
+        return self._decode(len(MAGIC))
+
+
+def _compare(tree):
+    print(f"{'format':8} {'bytes':>10} {'load ms':>9}")
+    for fmt in EXTENSIONS:
+        try:
+            data = dumps(tree, fmt)
+        except RuntimeError:
+            continue
+        start = time.perf_counter()
+        loads(data)
+        print(f"{fmt:8} {len(data):10} {(time.perf_counter() - start) * 1000:9.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert or query scaffold artifacts")
+    parser.add_argument("source", help="artifact to read (any format)")
+    parser.add_argument("--format", choices=list(EXTENSIONS), help="convert to this format")
+    parser.add_argument("--out", help="output path (default: source name + format extension)")
+    parser.add_argument("--get", metavar="PATH", help="print one entry of a binary artifact")
+    parser.add_argument("--compare", action="store_true", help="print size and load time per format")
+    args = parser.parse_args()
+
+    if args.get:
+        with BinaryArtifact.open(args.source) as artifact:
+            value = artifact.lookup(args.get)
+        print(value if isinstance(value, str) else json.dumps(value, indent=2))
+    else:
+        tree = load(args.source)
+        if args.compare:
+            _compare(tree)
+        if args.format:
+            directory, name = os.path.split(args.source)
+            stem = os.path.join(directory, name.split(".", 1)[0])
+            dump(tree, args.out or stem + EXTENSIONS[args.format], args.format)
@@ -0,0 +1,293 @@
+# Spatial index for canvas hit testing (reference for the SpatialIndex in app.js)
+#
+# DesignStudioApp.getObjectAtPoint walks every object and never matches lines.
+# SpatialIndex is a loose quadtree: an object lives in the deepest node whose
+# cell contains its bounding-box center and is at least as large as the box,
+# so each node's loose bounds (its cell grown by half a cell on every side)
+# contain all of its objects. Insert, move and delete touch one node; point and
+# marquee queries visit only the nodes whose loose bounds overlap the query.
+# Results are ordered topmost first by z. The algorithm, shared with app.js,
+# is described in spatial-index-spec.md.
+#
+#   python spatial_index.py       # 50k objects: indexed vs. linear hit testing
+import argparse
+import math
+import random
+import time
+
+HIT_TOLERANCE = 4.0  # canvas units around thin shapes (lines, hairline strokes)
+
+
+def bounds_of(obj, tolerance=0.0):
+    # (minx, miny, maxx, maxy) of an app.js canvas object, stroke included
+    pad = (obj.get("strokeWidth") or 0) / 2 + tolerance
+    kind = obj.get("type")
+    if kind == "circle":
+        r = obj["r"]
+        return (obj["cx"] - r - pad, obj["cy"] - r - pad, obj["cx"] + r + pad, obj["cy"] + r + pad)
+    if kind == "line":
+        return (min(obj["x1"], obj["x2"]) - pad, min(obj["y1"], obj["y2"]) - pad,
+                max(obj["x1"], obj["x2"]) + pad, max(obj["y1"], obj["y2"]) + pad)
+    x, y = obj.get("x", 0), obj.get("y", 0)
+    return (x - pad, y - pad, x + obj.get("width", 0) + pad, y + obj.get("height", 0) + pad)
+
+
+def hit_test(obj, px, py, tolerance=HIT_TOLERANCE):
+    # Exact test on the shape itself, after the index has filtered by bounds
+    pad = (obj.get("strokeWidth") or 0) / 2
+    kind = obj.get("type")
+    if kind == "circle":
+        return math.hypot(px - obj["cx"], py - obj["cy"]) <= obj["r"] + pad
+    if kind == "line":
+        x1, y1, x2, y2 = obj["x1"], obj["y1"], obj["x2"], obj["y2"]
+        dx, dy = x2 - x1, y2 - y1
+        length_sq = dx * dx + dy * dy
+        t = 0.0 if length_sq == 0 else max(0.0, min(1.0, ((px - x1) * dx + (py - y1) * dy) / length_sq))
+        return math.hypot(px - (x1 + t * dx), py - (y1 + t * dy)) <= pad + tolerance
+    minx, miny, maxx, maxy = bounds_of(obj)
+    return minx <= px <= maxx and miny <= py <= maxy
+
+
+class _Node:
+    __slots__ = ("x", "y", "size", "depth", "children", "items")
+
+    def __init__(self, x, y, size, depth):
+        self.x = x
+        self.y = y
+        self.size = size
+        self.depth = depth
+        self.children = None
+        self.items = {}  # id -> entry
+
+    def loose(self):
+        half = self.size / 2
+        return (self.x - half, self.y - half, self.x + self.size + half, self.y + self.size + half)
+
+
+class _Entry:
+    __slots__ = ("minx", "miny", "maxx", "maxy", "z", "node")
+
+    def __init__(self, bounds, z, node):
+        self.minx, self.miny, self.maxx, self.maxy = bounds
+        self.z = z
+        self.node = node
+
+
+class SpatialIndex:
+    def __init__(self, x=0.0, y=0.0, size=1024.0, max_depth=10):
+        # The world is the square cell at (x, y); objects whose center falls
+        # outside it, or that are larger than it, are kept in a small overflow
+        # set and tested linearly
+        self.root = _Node(x, y, size, 0)
+        self.max_depth = max_depth
+        self.overflow = {}
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, item_id):
+        return item_id in self._entries
+
+    def bounds(self, item_id):
+        entry = self._entries[item_id]
+        return (entry.minx, entry.miny, entry.maxx, entry.maxy)
+
+    def z(self, item_id):
+        return self._entries[item_id].z
+
+    # Updates
+
+    def _target(self, bounds):
+        minx, miny, maxx, maxy = bounds
+        cx, cy = (minx + maxx) / 2, (miny + maxy) / 2
+        extent = max(maxx - minx, maxy - miny)
+        node = self.root
+        # Outside the root cell, or too big for the root's loose bounds
+        if (extent > node.size or not (node.x <= cx < node.x + node.size
+                                       and node.y <= cy < node.y + node.size)):
+            return None
+        while node.depth < self.max_depth and extent <= node.size / 2:
+            half = node.size / 2
+            if node.children is None:
+                node.children = [None] * 4
+            i = (cx >= node.x + half) + 2 * (cy >= node.y + half)
+            child = node.children[i]
+            if child is None:
+                child = node.children[i] = _Node(node.x + half * (i & 1), node.y + half * (i >> 1),
+                                                 half, node.depth + 1)
+            node = child
+        return node
+
+    def insert(self, item_id, bounds, z=0):
+        if item_id in self._entries:
+            self.remove(item_id)
+        node = self._target(bounds)
+        entry = _Entry(bounds, z, node)
+        (self.overflow if node is None else node.items)[item_id] = entry
+        self._entries[item_id] = entry
+
+    def update(self, item_id, bounds=None, z=None):
+        # Moves/resizes and/or restacks an indexed object
+        entry = self._entries[item_id]
+        if z is not None:
+            entry.z = z
+        if bounds is not None:
+            node = self._target(bounds)
+            if node is not entry.node:
+                (self.overflow if entry.node is None else entry.node.items).pop(item_id)
+                (self.overflow if node is None else node.items)[item_id] = entry
+                entry.node = node
+            entry.minx, entry.miny, entry.maxx, entry.maxy = bounds
+
+    def remove(self, item_id):
+        entry = self._entries.pop(item_id, None)
+        if entry is not None:
+            (self.overflow if entry.node is None else entry.node.items).pop(item_id)
+
+    def clear(self):
+        self.root = _Node(self.root.x, self.root.y, self.root.size, 0)
+        self.overflow.clear()
+        self._entries.clear()
+
+    # Queries
+
+    def _visit(self, minx, miny, maxx, maxy):
+        # Yields (id, entry) for every object in a node whose loose bounds overlap
+        yield from self.overflow.items()
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            half = node.size / 2
+            if (node.x - half > maxx or node.y - half > maxy
+                    or node.x + node.size + half < minx or node.y + node.size + half < miny):
+                continue
+            yield from node.items.items()
+            if node.children is not None:
+                stack.extend(child for child in node.children if child is not None)
+
+    def query_point(self, px, py):
+        # Ids whose bounds contain the point, topmost first
+        found = [(entry.z, item_id) for item_id, entry in self._visit(px, py, px, py)
+                 if entry.minx <= px <= entry.maxx and entry.miny <= py <= entry.maxy]
+        found.sort(reverse=True)
+        return [item_id for _, item_id in found]
+
+    def query_rect(self, minx, miny, maxx, maxy, contain=False):
+        # Marquee selection: ids intersecting (or, with contain, fully inside)
+        # the rectangle, topmost first
+        if contain:
+            found = [(entry.z, item_id) for item_id, entry in self._visit(minx, miny, maxx, maxy)
+                     if entry.minx >= minx and entry.maxx <= maxx
+                     and entry.miny >= miny and entry.maxy <= maxy]
+        else:
+            found = [(entry.z, item_id) for item_id, entry in self._visit(minx, miny, maxx, maxy)
+                     if entry.minx <= maxx and entry.maxx >= minx
+                     and entry.miny <= maxy and entry.maxy >= miny]
+        found.sort(reverse=True)
+        return [item_id for _, item_id in found]
+
+
+class CanvasIndex:
+    # SpatialIndex over app.js-shaped objects, with the exact shape test
+    def __init__(self, size=1024.0, tolerance=HIT_TOLERANCE, **kwargs):
+        self.index = SpatialIndex(size=size, **kwargs)
+        self.objects = {}
+        self.tolerance = tolerance
+        self._next_z = 0
+
+    def add(self, obj, z=None):
+        if z is None:
+            z = self._next_z
+        self._next_z = max(self._next_z, z + 1)
+        self.objects[obj["id"]] = obj
+        self.index.insert(obj["id"], bounds_of(obj, self.tolerance), z)
+
+    def changed(self, obj):
+        self.objects[obj["id"]] = obj
+        self.index.update(obj["id"], bounds_of(obj, self.tolerance))
+
+    def remove(self, obj_id):
+        self.objects.pop(obj_id, None)
+        self.index.remove(obj_id)
+
+    def object_at(self, px, py):
+        for obj_id in self.index.query_point(px, py):
+            if hit_test(self.objects[obj_id], px, py, self.tolerance):
+                return obj_id
+        return None
+
+    def objects_in(self, minx, miny, maxx, maxy, contain=False):
+        return self.index.query_rect(minx, miny, maxx, maxy, contain)
+
+
+def _random_object(rng, i, world):
+    kind = rng.choice(("rectangle", "rectangle", "circle", "line"))
+    x, y = rng.uniform(0, world), rng.uniform(0, world)
+    size = rng.expovariate(1 / 30) + 2
+    if kind == "circle":
+        return {"id": f"obj-{i}", "type": kind, "cx": x, "cy": y, "r": size / 2, "strokeWidth": 2}
+    if kind == "line":
+        angle = rng.uniform(0, math.tau)
+        return {"id": f"obj-{i}", "type": kind, "x1": x, "y1": y, "x2": x + size * math.cos(angle),
+                "y2": y + size * math.sin(angle), "strokeWidth": 2}
+    return {"id": f"obj-{i}", "type": kind, "x": x, "y": y, "width": size,
+            "height": size * rng.uniform(0.3, 3), "strokeWidth": 2}
+
+
+def benchmark(count=50_000, queries=2_000, world=4096.0, seed=13):
+    rng = random.Random(seed)
+    canvas = CanvasIndex(size=world)
+    objects = [_random_object(rng, i, world) for i in range(count)]
+    start = time.perf_counter()
+    for obj in objects:
+        canvas.add(obj)
+    build_ms = (time.perf_counter() - start) * 1e3
+
+    points = [(rng.uniform(0, world), rng.uniform(0, world)) for _ in range(queries)]
+    start = time.perf_counter()
+    indexed = [canvas.object_at(x, y) for x, y in points]
+    point_us = (time.perf_counter() - start) / queries * 1e6
+
+    def linear(px, py):
+        for obj in reversed(objects):
+            if hit_test(obj, px, py):
+                return obj["id"]
+        return None
+
+    sample = points[:200]
+    start = time.perf_counter()
+    expected = [linear(x, y) for x, y in sample]
+    linear_us = (time.perf_counter() - start) / len(sample) * 1e6
+    assert expected == indexed[:len(sample)], "indexed hit test diverged from the linear scan"
+
+    start = time.perf_counter()
+    hits = 0
+    for x, y in points:
+        hits += len(canvas.objects_in(x, y, x + 200, y + 150))
+    marquee_us = (time.perf_counter() - start) / queries * 1e6
+
+    start = time.perf_counter()
+    for obj in rng.sample(objects, queries):
+        if obj["type"] == "circle":
+            obj["cx"] += rng.uniform(-50, 50)
+        elif obj["type"] == "line":
+            obj["x1"] += 10
+            obj["x2"] += 10
+        else:
+            obj["x"] += rng.uniform(-50, 50)
+        canvas.changed(obj)
+    move_us = (time.perf_counter() - start) / queries * 1e6
+
+    print(f"{count} objects, built in {build_ms:.0f} ms")
+    print(f"  point hit test:  {point_us:8.1f} us indexed, {linear_us:8.1f} us linear")
+    print(f"  marquee 200x150: {marquee_us:8.1f} us ({hits / queries:.0f} objects on average)")
+    print(f"  move/resize:     {move_us:8.1f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the canvas spatial index")
+    parser.add_argument("--objects", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=2_000)
+    args = parser.parse_args()
+    benchmark(args.objects, args.queries)
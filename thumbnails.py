@@ -0,0 +1,399 @@
+# Tiled thumbnails for projects and artboards
+#
+# Project.thumbnail has no producer, so project lists either show nothing or
+# render every design on the client. ThumbnailPipeline renders each artboard
+# in the background as a pyramid of tile_size x tile_size PNG tiles:
+#
+#   level 0      the whole artboard in one tile (its thumbnail)
+#   level n      twice the resolution of level n - 1, cut into a grid
+#
+# A change dirties only the tiles, at each level, whose area contains the
+# changed object's old or new bounds; the pipeline remembers every object's
+# bounds so a move also repaints where the object was. Dirty tiles are
+# rendered debounce seconds after an artboard's first unrendered change, in
+# the render worker pool (export_engine.render_png), one pass per artboard at
+# a time.
+#
+# Tiles are content-addressed: a tile's key hashes the objects it shows and
+# its geometry, so an edit that is undone, an artboard duplicated or the
+# blank tiles of every artboard map to tiles the store already holds, and
+# no render happens. The tile store is injected (an object store bucket in
+# production; MemoryTileStore here):
+#   has(key) -> awaitable bool
+#   put(key, data) -> awaitable
+#   get(key) -> awaitable bytes or None
+#
+# After a pass, publish(artboard_id, manifest) is called with the artboard's
+# manifest, which is stored in Artboard.tiles; its level-0 tile key is
+# Artboard.thumbnail and, for a project's first artboard, Project.thumbnail.
+# inline_thumbnails() returns those tiles as data URIs, so a project list is
+# served in one response.
+#
+#   python thumbnails.py          # tiles rendered per edit vs. re-rendering artboards
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import math
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from export_engine import RENDERER_VERSION, render_png
+from object_store import ArtboardObjectStore
+from spatial_index import bounds_of
+
+log = logging.getLogger(__name__)
+
+
+class MemoryTileStore:
+    # Stand-in for the tile bucket, keyed by content hash
+    def __init__(self):
+        self._tiles = {}
+        self.metrics = {"puts": 0, "bytes": 0}
+
+    async def has(self, key):
+        return key in self._tiles
+
+    async def put(self, key, data):
+        if key not in self._tiles:
+            self._tiles[key] = data
+            self.metrics["puts"] += 1
+            self.metrics["bytes"] += len(data)
+
+    async def get(self, key):
+        return self._tiles.get(key)
+
+    def __len__(self):
+        return len(self._tiles)
+
+
+def tile_levels(width, height, tile_size, levels):
+    # [(scale, span, columns, rows)] per level; span is the tile's side in
+    # artboard units
+    base = tile_size / max(width, height)
+    grid = []
+    for level in range(levels):
+        scale = base * (1 << level)
+        span = tile_size / scale
+        grid.append((scale, span, max(1, math.ceil(width / span)), max(1, math.ceil(height / span))))
+    return grid
+
+
+def tile_key(objects, region, scale):
+    # Content hash of a tile. Blank tiles leave their position out, so all
+    # blank tiles of one size share a key.
+    origin = region[:2] if objects else None
+    text = json.dumps([RENDERER_VERSION, origin, region[2:], scale, objects],
+                      sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class _Board:
+    __slots__ = ("artboard", "grid", "bounds", "pending", "dirty", "tiles", "first_dirty",
+                 "timer", "rendering")
+
+    def __init__(self, artboard, grid):
+        self.artboard = artboard
+        self.grid = grid
+        self.bounds = None      # object id -> bounds, once a full pass has run
+        self.pending = {}       # marks received while bounds is None
+        self.dirty = set()      # (level, column, row)
+        self.tiles = {}         # (level, column, row) -> tile key
+        self.first_dirty = None
+        self.timer = None
+        self.rendering = None   # task of the pass in flight
+
+
+class ThumbnailPipeline:
+    def __init__(self, store=None, tiles=None, publish=None, tile_size=256, levels=3,
+                 debounce=5.0, workers=None, executor=None):
+        # store: ArtboardObjectStore the objects are read from
+        # tiles: content-addressed tile store (has/put/get)
+        # publish: async publish(artboard_id, manifest), or None
+        # debounce: seconds from an artboard's first change to its re-render
+        self.store = store if store is not None else ArtboardObjectStore()
+        self.tiles = tiles if tiles is not None else MemoryTileStore()
+        self.publish = publish
+        self.tile_size = tile_size
+        self.levels = levels
+        self.debounce = debounce
+        self._executor = executor or ProcessPoolExecutor(workers)
+        self._owns_executor = executor is None
+        self._render_gate = asyncio.Semaphore(workers or 4)
+        self.boards = {}
+        self._inflight = {}  # tile key -> future of a render in progress
+        self.metrics = {"passes": 0, "tiles_dirtied": 0, "tiles_rendered": 0, "tiles_reused": 0,
+                        "render_ms": 0.0, "failures": 0}
+
+    def register(self, artboard):
+        # artboard: {"id", "width", "height"} as in the Artboard model; a new
+        # artboard gets a full pass. Re-registering after a resize starts over.
+        board = self.boards.get(artboard["id"])
+        if board is not None and (board.artboard["width"], board.artboard["height"]) == \
+                (artboard["width"], artboard["height"]):
+            board.artboard = artboard
+            return board
+        board = self.boards[artboard["id"]] = _Board(
+            artboard, tile_levels(artboard["width"], artboard["height"], self.tile_size, self.levels))
+        self._dirty_all(board)
+        self._schedule(board)
+        return board
+
+    def mark(self, artboard_id, changes):
+        # changes: {object id: object, or None for a delete}, as written to
+        # the ArtboardObjectStore
+        board = self.boards.get(artboard_id)
+        if board is None:
+            raise KeyError(f"artboard {artboard_id} is not registered")
+        if board.bounds is None:
+            # The first pass may be loading right now and miss these; it
+            # replays them once it has the bounds
+            board.pending.update(changes)
+            return
+        self._apply_marks(board, changes)
+        if board.dirty:
+            self._schedule(board)
+
+    def _apply_marks(self, board, changes):
+        before = len(board.dirty)
+        for object_id, obj in changes.items():
+            old = board.bounds.pop(object_id, None)
+            if old is not None:
+                self._dirty_rect(board, old)
+            if obj is not None:
+                board.bounds[object_id] = bounds_of(obj)
+                self._dirty_rect(board, board.bounds[object_id])
+        self.metrics["tiles_dirtied"] += len(board.dirty) - before
+
+    async def persist_operations(self, artboard_id, state, operations):
+        # A batcher_persist step, listed after the store's
+        touched = dict.fromkeys(op.object_id for op in operations if op.type != "noop")
+        self.mark(artboard_id, {object_id: state.objects.get(object_id) for object_id in touched})
+
+    async def flush(self, artboard_id=None):
+        # Renders pending tiles now, for one artboard or all of them
+        ids = [artboard_id] if artboard_id is not None else list(self.boards)
+        for board in [self.boards[i] for i in ids]:
+            if board.timer is not None:
+                board.timer.cancel()
+                board.timer = None
+            while board.rendering is not None or board.dirty:
+                if board.rendering is None:
+                    board.rendering = asyncio.ensure_future(self._render(board))
+                await asyncio.shield(board.rendering)
+
+    def manifest(self, artboard_id):
+        # Tile keys per level, row-major; None for tiles not rendered yet
+        board = self.boards[artboard_id]
+        levels = []
+        for level, (scale, span, columns, rows) in enumerate(board.grid):
+            levels.append({"level": level, "scale": scale, "span": span, "columns": columns,
+                           "rows": rows, "tiles": [board.tiles.get((level, column, row))
+                                                   for row in range(rows) for column in range(columns)]})
+        return {"tileSize": self.tile_size, "thumbnail": board.tiles.get((0, 0, 0)), "levels": levels}
+
+    async def inline_thumbnails(self, artboard_ids):
+        # {artboard id: data URI of its level-0 tile} for a list response
+        thumbnails = {}
+        for artboard_id in artboard_ids:
+            board = self.boards.get(artboard_id)
+            key = board.tiles.get((0, 0, 0)) if board is not None else None
+            data = await self.tiles.get(key) if key is not None else None
+            if data is not None:
+                thumbnails[artboard_id] = "data:image/png;base64," + base64.b64encode(data).decode()
+        return thumbnails
+
+    def close(self):
+        for board in self.boards.values():
+            if board.timer is not None:
+                board.timer.cancel()
+        if self._owns_executor:
+            self._executor.shutdown()
+
+    def _dirty_all(self, board):
+        for level, (_, _, columns, rows) in enumerate(board.grid):
+            board.dirty.update((level, column, row) for column in range(columns) for row in range(rows))
+
+    def _dirty_rect(self, board, rect):
+        minx, miny, maxx, maxy = rect
+        for level, (_, span, columns, rows) in enumerate(board.grid):
+            first_col, last_col = max(0, int(minx // span)), min(columns - 1, int(maxx // span))
+            first_row, last_row = max(0, int(miny // span)), min(rows - 1, int(maxy // span))
+            for column in range(first_col, last_col + 1):
+                for row in range(first_row, last_row + 1):
+                    board.dirty.add((level, column, row))
+
+    def _region(self, board, level, column, row):
+        _, span, _, _ = board.grid[level]
+        x, y = column * span, row * span
+        return (x, y, min(span, board.artboard["width"] - x), min(span, board.artboard["height"] - y))
+
+    def _schedule(self, board):
+        if board.first_dirty is None:
+            board.first_dirty = time.monotonic()
+        if board.rendering is not None or board.timer is not None:
+            return  # the pass in flight reschedules when it finishes
+        delay = max(0.0, board.first_dirty + self.debounce - time.monotonic())
+        board.timer = asyncio.get_running_loop().call_later(delay, self._start, board)
+
+    def _start(self, board):
+        board.timer = None
+        if board.rendering is None and board.dirty:
+            board.rendering = asyncio.ensure_future(self._render(board))
+
+    async def _render(self, board):
+        dirty, board.dirty = board.dirty, set()
+        board.first_dirty = None
+        artboard_id = board.artboard["id"]
+        try:
+            if board.bounds is None:
+                # First pass: remember every object's bounds for later marks.
+                # Marks from before the load are in what it reads; those that
+                # arrive during it are replayed, dirtying tiles for the next pass.
+                board.pending = {}
+                board.bounds = {object_id: bounds_of(data)
+                                for object_id, data, _ in await self.store.load(artboard_id)}
+                changes, board.pending = board.pending, {}
+                self._apply_marks(board, changes)
+            results = await asyncio.gather(*(self._render_tile(board, tile) for tile in sorted(dirty)))
+            board.tiles.update(zip(sorted(dirty), results))
+            self.metrics["passes"] += 1
+            if self.publish is not None:
+                await self.publish(artboard_id, self.manifest(artboard_id))
+        except Exception:
+            log.exception("thumbnail pass for artboard %s failed", artboard_id)
+            self.metrics["failures"] += 1
+            board.dirty |= dirty
+        finally:
+            board.rendering = None
+        if board.dirty:
+            self._schedule(board)
+
+    async def _render_tile(self, board, tile):
+        level, column, row = tile
+        region = self._region(board, level, column, row)
+        scale = board.grid[level][0]
+        objects = [data for _, data, _ in await self.store.load(board.artboard["id"], region)]
+        key = tile_key(objects, region, scale)
+        if board.tiles.get(tile) == key or await self.tiles.has(key):
+            self.metrics["tiles_reused"] += 1
+            return key
+        # Identical tiles of other artboards may be rendering right now
+        future = self._inflight.get(key)
+        if future is not None:
+            await asyncio.shield(future)
+            self.metrics["tiles_reused"] += 1
+            return key
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            async with self._render_gate:
+                start = time.perf_counter()
+                data = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, render_png, objects, region, scale)
+                self.metrics["render_ms"] += (time.perf_counter() - start) * 1e3
+            await self.tiles.put(key, data)
+            self.metrics["tiles_rendered"] += 1
+            future.set_result(key)
+        except BaseException as error:
+            future.set_exception(error)
+            future.exception()  # retrieved here; waiters re-raise it
+            raise
+        finally:
+            del self._inflight[key]
+        return key
+
+
+def _random_objects(rng, count, width, height):
+    objects = {}
+    for z in range(count):
+        size = rng.uniform(8, 60)
+        x, y = round(rng.uniform(0, width - size), 2), round(rng.uniform(0, height - size), 2)
+        if rng.random() < 0.7:
+            obj = {"type": "rectangle", "x": x, "y": y, "width": round(size, 2), "height": round(size, 2)}
+        else:
+            obj = {"type": "circle", "cx": x + size / 2, "cy": y + size / 2, "r": round(size / 2, 2)}
+        obj.update(fill=f"#{rng.randrange(1 << 24):06x}", stroke="#000000", strokeWidth=1, zIndex=z)
+        objects[f"obj-{z}"] = obj
+    return objects
+
+
+def _moved(obj, dx, dy):
+    if obj["type"] == "circle":
+        return {**obj, "cx": obj["cx"] + dx, "cy": obj["cy"] + dy}
+    return {**obj, "x": obj["x"] + dx, "y": obj["y"] + dy}
+
+
+async def _benchmark(artboards, objects, edits, levels, workers, seed):
+    rng = random.Random(seed)
+    store = ArtboardObjectStore()
+    published = {}
+
+    async def publish(artboard_id, manifest):
+        published[artboard_id] = manifest
+
+    pipeline = ThumbnailPipeline(store, publish=publish, levels=levels, debounce=0.05,
+                                 workers=workers)
+    boards = []
+    for i in range(artboards):
+        artboard = {"id": f"artboard-{i}", "projectId": f"project-{i // 4}", "width": 375, "height": 812}
+        # Every fourth artboard is a copy of the one before, as duplicated screens are
+        contents = (boards[-1][1] if i % 4 == 3 else _random_objects(rng, objects, 375, 812))
+        await store.write(artboard["id"], contents)
+        boards.append((artboard, contents))
+
+    try:
+        start = time.perf_counter()
+        for artboard, _ in boards:
+            pipeline.register(artboard)
+        await pipeline.flush()
+        build_s = time.perf_counter() - start
+        tiles_per_board = sum(columns * rows for _, _, columns, rows in pipeline.boards["artboard-0"].grid)
+        full = dict(pipeline.metrics)
+        print(f"{artboards} artboards x {objects} objects, {levels} levels "
+              f"({tiles_per_board} tiles per artboard)")
+        print(f"initial build: {build_s:.2f} s, {full['tiles_rendered']} tiles rendered, "
+              f"{full['tiles_reused']} reused, {len(pipeline.tiles)} stored")
+
+        # Edits: moves of single objects, batched by the debounce
+        start = time.perf_counter()
+        edited = set()
+        for _ in range(edits):
+            artboard, contents = rng.choice(boards)
+            edited.add(artboard["id"])
+            object_id = rng.choice(list(contents))
+            obj = _moved(contents[object_id], rng.uniform(-15, 15), rng.uniform(-15, 15))
+            contents[object_id] = obj
+            await store.write(artboard["id"], {object_id: obj})
+            pipeline.mark(artboard["id"], {object_id: obj})
+        await pipeline.flush()
+        edit_s = time.perf_counter() - start
+        rendered = pipeline.metrics["tiles_rendered"] - full["tiles_rendered"]
+        per_tile_ms = build_s * 1e3 / max(1, full["tiles_rendered"])
+        whole = len(edited) * tiles_per_board
+        print(f"{edits} edits on {len(edited)} artboards: {pipeline.metrics['tiles_dirtied']} tiles "
+              f"dirtied, {rendered} rendered in {edit_s:.2f} s; re-rendering the edited artboards "
+              f"would render {whole} tiles (~{whole * per_tile_ms / 1e3:.1f} s)")
+
+        # A project list page: one response with every thumbnail inlined
+        start = time.perf_counter()
+        firsts = [artboard["id"] for i, (artboard, _) in enumerate(boards) if i % 4 == 0]
+        inline = await pipeline.inline_thumbnails(firsts)
+        body = json.dumps({"projects": [{"id": i, "thumbnail": uri} for i, uri in inline.items()]})
+        print(f"project list: {len(inline)} thumbnails in one {len(body) / 1024:.0f} KB response "
+              f"({(time.perf_counter() - start) * 1e3:.1f} ms); {len(published)} manifests published")
+    finally:
+        pipeline.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark tiled thumbnail rendering")
+    parser.add_argument("--artboards", type=int, default=40)
+    parser.add_argument("--objects", type=int, default=300, help="objects per artboard")
+    parser.add_argument("--edits", type=int, default=200)
+    parser.add_argument("--levels", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    asyncio.run(_benchmark(args.artboards, args.objects, args.edits, args.levels, args.workers, seed=22))
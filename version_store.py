@@ -0,0 +1,289 @@
+# Keyframe + delta storage for project versions
+#
+# Version.snapshot stores the complete project state on every autosave, so
+# storage and write volume grow with (object count x saves) even when a save
+# changed a handful of objects. VersionStore writes a full keyframe only every
+# keyframe_interval versions; the versions in between store a delta against
+# the previous version:
+#
+#   {"set": {id: object}, "patch": {id: {field: value}}, "delete": [id]}
+#
+# Deltas come from PersistentMap.diff, which skips the trie nodes two states
+# share, so computing one costs the size of the change rather than a scan of
+# the artboard. Restoring version n loads the nearest keyframe at or before n
+# and replays at most keyframe_interval - 1 deltas. A keyframe is also forced
+# once the deltas since the last one outweigh it (max_chain_ratio), so
+# large rewrites do not produce long, heavy chains.
+#
+# Records map onto the Version model: seq, kind ("keyframe" | "delta"),
+# baseSeq (the keyframe a restore starts from), and snapshot or delta.
+#
+#   python version_store.py       # bytes per version and restore time per spacing
+import argparse
+import json
+import random
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from document_state import MISSING, DocumentState
+
+KEYFRAME = "keyframe"
+DELTA = "delta"
+
+
+class MemoryVersionStorage:
+    # Stand-in for the versions collection; records are kept as JSON text,
+    # as the database would, so sizes and decode costs are realistic
+    def __init__(self):
+        self._records = {}  # project id -> {seq: json text}
+
+    def put(self, record):
+        text = json.dumps(record, separators=(",", ":"))
+        self._records.setdefault(record["projectId"], {})[record["seq"]] = text
+        return len(text)
+
+    def get(self, project_id, seq):
+        text = self._records.get(project_id, {}).get(seq)
+        return None if text is None else json.loads(text)
+
+    def range(self, project_id, first, last):
+        # Records with first <= seq <= last, in seq order
+        records = self._records.get(project_id, {})
+        return [json.loads(records[seq]) for seq in range(first, last + 1) if seq in records]
+
+    def latest_seq(self, project_id):
+        records = self._records.get(project_id)
+        return max(records) if records else None
+
+    def size(self, project_id=None):
+        projects = [project_id] if project_id is not None else list(self._records)
+        return sum(len(text) for p in projects for text in self._records.get(p, {}).values())
+
+
+def compute_delta(before, after):
+    # Delta taking DocumentState `before` to `after`; None when nothing changed
+    changed, patched, deleted = {}, {}, []
+    for object_id, old, new in before.objects.diff(after.objects):
+        if new is MISSING:
+            deleted.append(object_id)
+        elif old is MISSING or not old.keys() <= new.keys():
+            changed[object_id] = new
+        else:
+            fields = {key: value for key, value in new.items() if old.get(key, MISSING) != value}
+            if fields:
+                patched[object_id] = fields
+    delta = {}
+    if changed:
+        delta["set"] = changed
+    if patched:
+        delta["patch"] = patched
+    if deleted:
+        delta["delete"] = deleted
+    return delta or None
+
+
+def apply_delta(state, delta, version):
+    objects = state.objects
+    for object_id, obj in delta.get("set", {}).items():
+        objects = objects.set(object_id, obj)
+    for object_id, fields in delta.get("patch", {}).items():
+        objects = objects.set(object_id, {**objects[object_id], **fields})
+    for object_id in delta.get("delete", ()):
+        objects = objects.delete(object_id)
+    return DocumentState(objects, version)
+
+
+class _Head:
+    __slots__ = ("seq", "state", "keyframe_seq", "keyframe_bytes", "chain_bytes")
+
+    def __init__(self, seq, state, keyframe_seq, keyframe_bytes, chain_bytes):
+        self.seq = seq
+        self.state = state
+        self.keyframe_seq = keyframe_seq
+        self.keyframe_bytes = keyframe_bytes
+        self.chain_bytes = chain_bytes
+
+
+class VersionStore:
+    def __init__(self, storage=None, keyframe_interval=32, max_chain_ratio=1.0, cache_size=16):
+        # keyframe_interval: versions per keyframe; 1 stores full snapshots only
+        # max_chain_ratio: force a keyframe once delta bytes since the last one
+        #   exceed this multiple of its size
+        # cache_size: decoded keyframe states kept for repeated restores
+        if keyframe_interval < 1:
+            raise ValueError("keyframe_interval must be at least 1")
+        self.storage = storage if storage is not None else MemoryVersionStorage()
+        self.keyframe_interval = keyframe_interval
+        self.max_chain_ratio = max_chain_ratio
+        self.cache_size = cache_size
+        self._heads = {}
+        self._keyframes = OrderedDict()  # (project, seq) -> DocumentState
+        self.metrics = {"keyframes": 0, "deltas": 0, "bytes": 0, "replayed": 0}
+
+    def save(self, project_id, state, name="Autosave", description=None, created_by=None):
+        # Stores `state` as the project's next version and returns its record
+        head = self._head(project_id)
+        seq = 1 if head is None else head.seq + 1
+        record = {
+            "projectId": project_id,
+            "seq": seq,
+            "name": name,
+            "description": description,
+            "createdBy": created_by,
+            "createdAt": datetime.now(timezone.utc).isoformat(),
+            "stateVersion": state.version,
+        }
+        delta = None
+        if head is not None and seq - head.keyframe_seq < self.keyframe_interval:
+            delta = compute_delta(head.state, state) or {}
+            delta_bytes = len(json.dumps(delta, separators=(",", ":")))
+            if head.chain_bytes + delta_bytes > self.max_chain_ratio * head.keyframe_bytes:
+                delta = None
+
+        if delta is None:
+            record.update(kind=KEYFRAME, baseSeq=seq, snapshot=state.snapshot())
+            size = self.storage.put(record)
+            self._heads[project_id] = _Head(seq, state, seq, size, 0)
+            self._cache_keyframe(project_id, seq, state)
+            self.metrics["keyframes"] += 1
+        else:
+            record.update(kind=DELTA, baseSeq=head.keyframe_seq, delta=delta)
+            size = self.storage.put(record)
+            head.seq, head.state = seq, state
+            head.chain_bytes += size
+            self.metrics["deltas"] += 1
+        self.metrics["bytes"] += size
+        return record
+
+    def restore(self, project_id, seq):
+        # DocumentState of version `seq`
+        head = self._heads.get(project_id)
+        if head is not None and head.seq == seq:
+            return head.state
+        record = self.storage.get(project_id, seq)
+        if record is None:
+            raise KeyError(f"project {project_id} has no version {seq}")
+        if record["kind"] == KEYFRAME:
+            return self._keyframe(project_id, seq, record)
+        base = record["baseSeq"]
+        state = self._keyframe(project_id, base)
+        for delta_record in self.storage.range(project_id, base + 1, seq - 1):
+            state = apply_delta(state, delta_record["delta"], delta_record["stateVersion"])
+        self.metrics["replayed"] += seq - base
+        return apply_delta(state, record["delta"], record["stateVersion"])
+
+    def forget(self, project_id):
+        # Drops in-memory state for a project (e.g. when its room closes)
+        self._heads.pop(project_id, None)
+        for key in [key for key in self._keyframes if key[0] == project_id]:
+            del self._keyframes[key]
+
+    def _head(self, project_id):
+        # Rebuilt from storage after a restart, so the chain continues
+        head = self._heads.get(project_id)
+        if head is not None:
+            return head
+        seq = self.storage.latest_seq(project_id)
+        if seq is None:
+            return None
+        state = self.restore(project_id, seq)
+        base = self.storage.get(project_id, seq)["baseSeq"]
+        records = self.storage.range(project_id, base, seq)
+        sizes = [len(json.dumps(r, separators=(",", ":"))) for r in records]
+        head = self._heads[project_id] = _Head(seq, state, base, sizes[0], sum(sizes[1:]))
+        return head
+
+    def _keyframe(self, project_id, seq, record=None):
+        key = (project_id, seq)
+        state = self._keyframes.get(key)
+        if state is not None:
+            self._keyframes.move_to_end(key)
+            return state
+        if record is None:
+            record = self.storage.get(project_id, seq)
+        state = DocumentState.from_snapshot(record["snapshot"])
+        self._cache_keyframe(project_id, seq, state)
+        return state
+
+    def _cache_keyframe(self, project_id, seq, state):
+        self._keyframes[(project_id, seq)] = state
+        while len(self._keyframes) > self.cache_size:
+            self._keyframes.popitem(last=False)
+
+
+def _edit(rng, state, objects, ops, next_id):
+    # `ops` random edits in the mix autosaves see: mostly moves and restyles,
+    # plus strokes added to and removed from objects
+    current = state.objects
+    for _ in range(ops):
+        roll = rng.random()
+        if roll < 0.03 or not objects:
+            object_id = f"obj-{next_id}"
+            next_id += 1
+            objects.append(object_id)
+            current = current.set(object_id, {"type": "rectangle", "x": 0.0, "y": 0.0, "width": 40.0,
+                                              "height": 40.0, "fill": "#4ECDC4", "rotation": 0})
+        elif roll < 0.05:
+            current = current.delete(objects.pop(rng.randrange(len(objects))))
+        else:
+            object_id = rng.choice(objects)
+            obj = current[object_id]
+            if roll < 0.8:
+                obj = {**obj, "x": round(obj["x"] + rng.uniform(-20, 20), 2),
+                       "y": round(obj["y"] + rng.uniform(-20, 20), 2)}
+            elif roll < 0.9:
+                if "stroke" in obj:
+                    obj = {key: value for key, value in obj.items() if key != "stroke"}
+                else:
+                    obj = {**obj, "stroke": f"#{rng.randrange(1 << 24):06x}"}
+            else:
+                obj = {**obj, "fill": f"#{rng.randrange(1 << 24):06x}"}
+            current = current.set(object_id, obj)
+    return DocumentState(current, state.version + ops), next_id
+
+
+def benchmark(objects=5_000, versions=400, ops_per_save=40, intervals=(1, 8, 32, 128),
+              restores=50, seed=17):
+    rng = random.Random(seed)
+    ids = [f"obj-{i}" for i in range(objects)]
+    state = DocumentState.from_snapshot({"objects": {
+        object_id: {"type": "rectangle", "x": round(rng.uniform(0, 375), 2),
+                    "y": round(rng.uniform(0, 812), 2), "width": 40.0, "height": 40.0,
+                    "fill": "#4ECDC4", "rotation": 0} for object_id in ids}})
+    states, next_id = [], objects
+    for _ in range(versions):
+        state, next_id = _edit(rng, state, ids, ops_per_save, next_id)
+        states.append(state)
+    targets = [rng.randrange(1, versions + 1) for _ in range(restores)]
+
+    print(f"{objects} objects, {versions} versions, {ops_per_save} edits per save")
+    print(f"{'interval':>8} {'bytes/version':>14} {'save ms':>8} {'restore ms':>11} {'worst ms':>9}")
+    for interval in intervals:
+        store = VersionStore(keyframe_interval=interval, cache_size=0)
+        start = time.perf_counter()
+        for saved in states:
+            store.save("project-1", saved)
+        save_ms = (time.perf_counter() - start) / versions * 1e3
+
+        # Cold restores: nothing decoded is reused between them
+        store.forget("project-1")
+        timings = []
+        for seq in targets:
+            start = time.perf_counter()
+            restored = store.restore("project-1", seq)
+            timings.append((time.perf_counter() - start) * 1e3)
+            assert restored.objects.to_dict() == states[seq - 1].objects.to_dict()
+        per_version = store.storage.size("project-1") / versions
+        print(f"{interval:8} {per_version:14.0f} {save_ms:8.2f} "
+              f"{sum(timings) / len(timings):11.2f} {max(timings):9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark keyframe + delta version storage")
+    parser.add_argument("--objects", type=int, default=5_000)
+    parser.add_argument("--versions", type=int, default=400)
+    parser.add_argument("--ops", type=int, default=40, help="edits between saves")
+    parser.add_argument("--intervals", type=int, nargs="+", default=[1, 8, 32, 128])
+    args = parser.parse_args()
+    benchmark(args.objects, args.versions, args.ops, tuple(args.intervals))
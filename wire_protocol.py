@@ -0,0 +1,358 @@
+# Compact binary wire protocol for WebSocket events
+#
+# CanvasOperationEvent, CursorUpdateEvent and friends go out as verbose JSON
+# that repeats ids, user names, avatars and property names on every message.
+# A binary frame is
+#
+#   u8 schema version | varint event code | value
+#
+# where a value is a tagged tree (null/bool/int/fixed/float/str/list/dict).
+# Every int is a zigzag LEB128 varint. Floats with at most two decimals (all
+# canvas coordinates, sizes and angles in practice) are sent as varints of
+# value*100 and decode to the identical float. Strings up to INTERN_MAX_BYTES
+# (dict keys, ids, names, colors, tools) are interned per session: the first
+# occurrence is sent inline and added to the session table, later ones are a
+# one- or two-byte reference. Fields whose values are unique per message
+# (LITERAL_FIELDS) are never interned so they do not fill the table.
+# Timestamps are zigzag deltas against the previous timestamp in the session.
+#
+# Each direction of a connection owns one Session; the peer decodes with its
+# own Session, so both tables evolve identically over the ordered socket.
+#
+# Negotiation: the client lists protocols in the Socket.IO handshake
+# (auth.protocols = ["dsw/1", "json"]); the server answers with
+# negotiate(offered) in `protocol:selected`. JSON is always the fallback, and a
+# frame with an unknown schema version, or a truncated one, raises
+# ProtocolError. A frame that fails to encode or decode leaves the Session's
+# table and timestamp base untouched.
+#
+#   python wire_protocol.py       # size and throughput vs. the JSON path
+import argparse
+import json
+import random
+import struct
+import time
+
+SCHEMA_VERSION = 1
+PROTOCOL = f"dsw/{SCHEMA_VERSION}"
+JSON_PROTOCOL = "json"
+SUPPORTED = (PROTOCOL, JSON_PROTOCOL)  # server preference order
+
+INTERN_MAX_BYTES = 64
+INTERN_TABLE_SIZE = 4096
+LITERAL_FIELDS = frozenset(("id", "dependencies", "content", "description", "message"))
+TIMESTAMP_FIELDS = frozenset(("timestamp", "t", "joinedAt"))
+
+EVENTS = (
+    "canvas:operation",
+    "canvas:operations",
+    "cursor:move",
+    "cursor:update",
+    "cursor:frame",
+    "user:joined",
+    "user:left",
+    "users:update",
+    "selection:update",
+    "error",
+)
+_EVENT_CODES = {name: i + 1 for i, name in enumerate(EVENTS)}  # 0: name follows
+
+_NULL, _FALSE, _TRUE, _INT, _FIXED, _FLOAT, _STR, _LIST, _DICT, _TIME = range(10)
+# _STR is followed by a string reference:
+#   0 -> literal, not interned;  1 -> literal, interned;  n >= 2 -> table[n - 2]
+
+_F64 = struct.Struct("<d")
+_FIXED_LIMIT = 1e13  # |value * 100| stays exact in a double
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def negotiate(offered):
+    # First server-preferred protocol the client offered; JSON if none match
+    offered = set(offered or ())
+    for protocol in SUPPORTED:
+        if protocol in offered:
+            return protocol
+    return JSON_PROTOCOL
+
+
+def _write_uvarint(out, n):
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _write_varint(out, n):
+    _write_uvarint(out, (n << 1) if n >= 0 else ((-n << 1) - 1))
+
+
+def _read_uvarint(buf, pos):
+    byte = buf[pos]
+    if byte < 0x80:
+        return byte, pos + 1
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _read_varint(buf, pos):
+    n, pos = _read_uvarint(buf, pos)
+    return (n >> 1) ^ -(n & 1), pos
+
+
+class Session:
+    # One direction of one connection: the intern table and timestamp base
+    def __init__(self):
+        self._ids = {}
+        self._strings = []
+        self._last_time = 0
+
+    # Encoding
+
+    def encode(self, event, payload):
+        out = bytearray((SCHEMA_VERSION,))
+        mark = self._mark()
+        try:
+            code = _EVENT_CODES.get(event)
+            if code is None:
+                out.append(0)
+                self._write_str(out, event, True)
+            else:
+                _write_uvarint(out, code)
+            self._write(out, payload, True, False)
+        except BaseException:
+            # The frame is never sent, so the peer must not see its interning
+            self._rollback(mark)
+            raise
+        return bytes(out)
+
+    def _mark(self):
+        return len(self._strings), self._last_time
+
+    def _rollback(self, mark):
+        size, self._last_time = mark
+        for value in self._strings[size:]:
+            del self._ids[value]
+        del self._strings[size:]
+
+    def _write_str(self, out, value, intern):
+        ref = self._ids.get(value)
+        if ref is not None:
+            _write_uvarint(out, ref + 2)
+            return
+        raw = value.encode("utf-8")
+        if intern and len(raw) <= INTERN_MAX_BYTES and len(self._strings) < INTERN_TABLE_SIZE:
+            self._ids[value] = len(self._strings)
+            self._strings.append(value)
+            out.append(1)
+        else:
+            out.append(0)
+        _write_uvarint(out, len(raw))
+        out += raw
+
+    def _write(self, out, value, intern, is_time):
+        # Checks ordered by how often each type occurs in canvas traffic
+        kind = type(value)
+        if kind is str:
+            out.append(_STR)
+            self._write_str(out, value, intern)
+        elif kind is float:
+            fixed = round(value * 100) if abs(value) < _FIXED_LIMIT else None
+            if fixed is not None and fixed / 100 == value:
+                out.append(_FIXED)
+                _write_varint(out, fixed)
+            else:
+                out.append(_FLOAT)
+                out += _F64.pack(value)
+        elif kind is dict:
+            out.append(_DICT)
+            _write_uvarint(out, len(value))
+            for key, item in value.items():
+                self._write_str(out, key, True)
+                self._write(out, item, intern and key not in LITERAL_FIELDS,
+                            key in TIMESTAMP_FIELDS)
+        elif kind is int:
+            if is_time:
+                out.append(_TIME)
+                _write_varint(out, value - self._last_time)
+                self._last_time = value
+            else:
+                out.append(_INT)
+                _write_varint(out, value)
+        elif kind is list or kind is tuple:
+            out.append(_LIST)
+            _write_uvarint(out, len(value))
+            for item in value:
+                self._write(out, item, intern, False)
+        elif value is None:
+            out.append(_NULL)
+        elif value is True:
+            out.append(_TRUE)
+        elif value is False:
+            out.append(_FALSE)
+        elif isinstance(value, str):
+            self._write(out, str(value), intern, is_time)
+        elif isinstance(value, dict):
+            self._write(out, dict(value), intern, is_time)
+        elif isinstance(value, (list, tuple)):
+            self._write(out, list(value), intern, is_time)
+        elif isinstance(value, (int, float)):
+            self._write(out, (float if isinstance(value, float) else int)(value), intern, is_time)
+        else:
+            raise TypeError(f"cannot encode {type(value).__name__}")
+
+    # Decoding
+
+    def decode(self, frame):
+        # Returns (event, payload); a malformed frame leaves the session as it was
+        if not frame or frame[0] != SCHEMA_VERSION:
+            version = frame[0] if frame else None
+            raise ProtocolError(f"unsupported wire schema version {version!r}")
+        mark = self._mark()
+        try:
+            code, pos = _read_uvarint(frame, 1)
+            if code == 0:
+                event, pos = self._read_str(frame, pos)
+            elif code <= len(EVENTS):
+                event = EVENTS[code - 1]
+            else:
+                raise ProtocolError(f"unknown event code {code}")
+            payload, pos = self._read(frame, pos)
+            if pos != len(frame):
+                raise ProtocolError(f"{len(frame) - pos} trailing bytes in frame")
+        except (IndexError, struct.error, UnicodeDecodeError) as error:
+            self._rollback(mark)
+            raise ProtocolError(f"truncated or corrupt frame: {error}") from error
+        except BaseException:
+            self._rollback(mark)
+            raise
+        return event, payload
+
+    def _read_str(self, buf, pos):
+        ref, pos = _read_uvarint(buf, pos)
+        if ref >= 2:
+            return self._strings[ref - 2], pos
+        length, pos = _read_uvarint(buf, pos)
+        if pos + length > len(buf):
+            raise ProtocolError(f"string of {length} bytes runs past the end of the frame")
+        value = bytes(buf[pos:pos + length]).decode("utf-8")
+        if ref == 1:
+            self._ids[value] = len(self._strings)
+            self._strings.append(value)
+        return value, pos + length
+
+    def _read(self, buf, pos):
+        tag = buf[pos]
+        pos += 1
+        if tag == _STR:
+            return self._read_str(buf, pos)
+        if tag == _FIXED:
+            fixed, pos = _read_varint(buf, pos)
+            return fixed / 100, pos
+        if tag == _DICT:
+            count, pos = _read_uvarint(buf, pos)
+            result = {}
+            read_str, read = self._read_str, self._read
+            for _ in range(count):
+                key, pos = read_str(buf, pos)
+                result[key], pos = read(buf, pos)
+            return result, pos
+        if tag == _TIME:
+            delta, pos = _read_varint(buf, pos)
+            self._last_time += delta
+            return self._last_time, pos
+        if tag == _LIST:
+            count, pos = _read_uvarint(buf, pos)
+            items = []
+            for _ in range(count):
+                item, pos = self._read(buf, pos)
+                items.append(item)
+            return items, pos
+        if tag == _INT:
+            return _read_varint(buf, pos)
+        if tag == _FLOAT:
+            return _F64.unpack_from(buf, pos)[0], pos + 8
+        if tag == _NULL:
+            return None, pos
+        if tag == _TRUE:
+            return True, pos
+        if tag == _FALSE:
+            return False, pos
+        raise ProtocolError(f"unknown value tag {tag} at byte {pos - 1}")
+
+
+class JsonCodec:
+    # The fallback path: what SocketService sends today
+    def encode(self, event, payload):
+        return json.dumps({"event": event, "data": payload}, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, frame):
+        message = json.loads(frame)
+        return message["event"], message["data"]
+
+
+def codec_for(protocol):
+    # A fresh per-direction codec for the negotiated protocol
+    return Session() if protocol == PROTOCOL else JsonCodec()
+
+
+def _sample_messages(count, seed=5):
+    rng = random.Random(seed)
+    users = [{"id": f"65f1c2a9e4b0{i:012x}", "name": f"Designer {i}",
+              "avatar": f"https://cdn.designstudio.app/avatars/{i:04d}.png"} for i in range(12)]
+    objects = [f"65f1c3b7e4b0{i:012x}" for i in range(400)]
+    now = 1_760_000_000_000
+    messages = []
+    for i in range(count):
+        user = rng.choice(users)
+        now += rng.randrange(1, 40)
+        if rng.random() < 0.5:
+            messages.append(("cursor:update", {
+                "userId": user["id"], "userName": user["name"], "avatar": user["avatar"],
+                "x": round(rng.uniform(0, 375), 1), "y": round(rng.uniform(0, 812), 1),
+                "artboardId": "65f1c3b7e4b0aaaaaaaaaaaa", "tool": "select",
+                "selection": rng.sample(objects, rng.randrange(3)), "timestamp": now,
+            }))
+        else:
+            messages.append(("canvas:operation", {
+                "operation": {
+                    "id": f"op-{user['id']}-{i}", "type": "transform",
+                    "objectId": rng.choice(objects), "artboardId": "65f1c3b7e4b0aaaaaaaaaaaa",
+                    "data": {"transform": {"x": round(rng.uniform(-20, 20), 2),
+                                           "y": round(rng.uniform(-20, 20), 2)}},
+                    "timestamp": now, "clientId": f"client-{user['id']}",
+                },
+                "userId": user["id"], "userName": user["name"],
+            }))
+    return messages
+
+
+def benchmark(count=50_000):
+    messages = _sample_messages(count)
+    print(f"{'codec':>6} {'bytes/msg':>10} {'encode us':>10} {'decode us':>10}")
+    for name, make in (("json", JsonCodec), ("dsw/1", Session)):
+        encoder, decoder = make(), make()
+        start = time.perf_counter()
+        frames = [encoder.encode(event, payload) for event, payload in messages]
+        encode_us = (time.perf_counter() - start) / count * 1e6
+        start = time.perf_counter()
+        decoded = [decoder.decode(frame) for frame in frames]
+        decode_us = (time.perf_counter() - start) / count * 1e6
+        assert decoded == [(event, json.loads(json.dumps(payload))) for event, payload in messages]
+        size = sum(map(len, frames)) / count
+        print(f"{name:>6} {size:10.1f} {encode_us:10.2f} {decode_us:10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the binary wire protocol against JSON")
+    parser.add_argument("--messages", type=int, default=50_000)
+    args = parser.parse_args()
+    benchmark(args.messages)